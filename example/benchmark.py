@@ -0,0 +1,67 @@
+# measure the client-side throughput of the envs against the mock UnrealCV server, no UE binary or GPU is needed
+# sweep the observation types, resolutions and population sizes, report steps/s, resets/s and requests/step
+# e.g. python example/benchmark.py -e UnrealTrack-track_train-ContinuousColor-v0 -o Color Depth -r 160x120 640x480 -p 2 6
+
+import argparse
+import re
+import time
+import gym
+import gym_unrealcv
+from gym_unrealcv.envs.wrappers import configUE, augmentation
+
+
+def count_requests(env):
+    return sum(stats['count'] for stats in env.unwrapped.unrealcv.stats.snapshot().values())
+
+
+def run(env_id, resolution, population, resets, steps, latency, img_latency):
+    env = gym.make(env_id)
+    env = configUE.ConfigUEWrapper(env, resolution=resolution)
+    env.unwrapped.mock_server = True
+    env.unwrapped.mock_latency = latency
+    env.unwrapped.mock_img_latency = img_latency
+    population = max(population, 2)  # the tracking tasks need a target besides the tracker
+    env = augmentation.RandomPopulationWrapper(env, population, population)
+    env.seed(0)
+    env.reset()  # launch and warm up
+
+    t0 = time.time()
+    for _ in range(resets):
+        env.reset()
+    reset_time = time.time() - t0
+
+    requests = count_requests(env)
+    t0 = time.time()
+    for _ in range(steps):
+        actions = [space.sample() for space in env.action_space]
+        obs, rewards, done, info = env.step(actions)
+    step_time = time.time() - t0
+    requests = count_requests(env) - requests
+    env.close()
+    return dict(resets_per_sec=resets / reset_time, steps_per_sec=steps / step_time, requests_per_step=requests / steps)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the envs against the mock UnrealCV server')
+    parser.add_argument("-e", "--env_id", nargs='?', default='UnrealTrack-track_train-ContinuousColor-v0',
+                        help='the env to run, the observation type in the id is replaced by the sweep')
+    parser.add_argument("-o", "--obs", nargs='+', default=['Color'], help='the observation types to sweep')
+    parser.add_argument("-r", "--resolution", nargs='+', default=['160x120'], help='the resolutions (WxH) to sweep')
+    parser.add_argument("-p", "--population", nargs='+', type=int, default=[2], help='the population sizes to sweep, at least 2')
+    parser.add_argument("--resets", type=int, default=3, help='the number of resets to time')
+    parser.add_argument("--steps", type=int, default=200, help='the number of steps to time')
+    parser.add_argument("--latency", type=float, default=0.0, help='the latency (seconds) of every reply of the mock server')
+    parser.add_argument("--img-latency", type=float, default=0.0, help='the extra latency (seconds) of every image reply')
+    args = parser.parse_args()
+
+    match = re.match(r'^(.+-)(Discrete|Continuous|Mixed)(\w+)(-v\d+)$', args.env_id)
+    assert match is not None, f'Can not parse the env id {args.env_id}'
+    print(f'{"env":<50}{"resolution":>12}{"population":>12}{"steps/s":>10}{"resets/s":>10}{"requests/step":>15}')
+    for obs in args.obs:
+        env_id = f'{match.group(1)}{match.group(2)}{obs}{match.group(4)}'
+        for res in args.resolution:
+            resolution = tuple(int(x) for x in res.split('x'))
+            for population in args.population:
+                result = run(env_id, resolution, population, args.resets, args.steps, args.latency, args.img_latency)
+                print(f'{env_id:<50}{res:>12}{population:>12}{result["steps_per_sec"]:>10.1f}'
+                      f'{result["resets_per_sec"]:>10.2f}{result["requests_per_step"]:>15.1f}')
@@ -1,4 +1,5 @@
 from gym_unrealcv.envs.base_env import UnrealCv_base
+from gym_unrealcv.envs.async_base_env import AsyncUnrealCv_base
 from gym_unrealcv.envs.rendezvous import Rendezvous
 from gym_unrealcv.envs.track import Track
 from gym_unrealcv.envs.navigation import Navigation
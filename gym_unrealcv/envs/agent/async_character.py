@@ -0,0 +1,322 @@
+import asyncio
+import struct
+import time
+from unrealcv.api import MsgDecoder
+from unrealcv.util import ResChecker
+from gym_unrealcv.envs.agent.character import Character_API, UnrealCvTimeoutError
+
+
+class AsyncClient:
+    """
+    A non-blocking UnrealCV client on asyncio, it speaks the same wire protocol as unrealcv.Client.
+    The requests are written to the socket at once, the replies are matched to the requests by the message id.
+    """
+    magic = 0x9E2B83C1
+
+    def __init__(self, endpoint, type='inet'):
+        self.endpoint = endpoint  # (ip, port) or the path of the unix socket
+        self.type = type
+        self.reader = None
+        self.writer = None
+        self.recv_task = None
+        self.send_message_id = 0
+        self.pending = dict()  # message id -> future, None for the async requests
+
+    async def connect(self, timeout=5):
+        """
+        Connect to the server and wait for the connection confirm.
+
+        Returns:
+            bool: Whether the connection is successful.
+        """
+        if self.type == 'unix':
+            open_conn = asyncio.open_unix_connection(self.endpoint)
+        else:
+            open_conn = asyncio.open_connection(*self.endpoint)
+        self.reader, self.writer = await asyncio.wait_for(open_conn, timeout)
+        message = await asyncio.wait_for(self.read_payload(), timeout)
+        if message is None or not message.startswith(b'connected'):  # e.g. the server only accepts one client
+            self.writer.close()
+            self.reader, self.writer = None, None
+            return False
+        self.recv_task = asyncio.ensure_future(self.receive_loop())
+        return True
+
+    def isconnected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    def disconnect(self):
+        if self.recv_task is not None:
+            self.recv_task.cancel()
+            self.recv_task = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.fail_pending(ConnectionError('The client is disconnected'))
+
+    async def read_payload(self):
+        try:
+            header = await self.reader.readexactly(8)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        magic, payload_size = struct.unpack('II', header)
+        if magic != self.magic:
+            raise ConnectionError(f'Receive a malformed message, magic number {magic}')
+        return await self.reader.readexactly(payload_size)
+
+    async def receive_loop(self):
+        while True:
+            raw_message = await self.read_payload()
+            if raw_message is None:
+                self.fail_pending(ConnectionError('Connection lost during receive'))
+                return
+            message_id, message_body = raw_message.split(b':', 1)
+            try:
+                message_body = message_body.decode('utf-8')
+            except UnicodeDecodeError:  # the images are kept in bytes
+                pass
+            future = self.pending.pop(int(message_id), None)
+            if future is not None and not future.done():
+                future.set_result(message_body)
+
+    def fail_pending(self, exc):
+        for future in self.pending.values():
+            if future is not None and not future.done():
+                future.set_exception(exc)
+        self.pending.clear()
+
+    def send(self, message, wait_reply):
+        if not self.isconnected():
+            raise ConnectionError('Failed to send: socket is closed')
+        if not isinstance(message, bytes):
+            message = message.encode('utf-8')
+        payload = b'%d:%s' % (self.send_message_id, message)
+        self.writer.write(struct.pack('II', self.magic, len(payload)) + payload)
+        future = asyncio.get_event_loop().create_future() if wait_reply else None
+        self.pending[self.send_message_id] = future
+        self.send_message_id += 1
+        return future
+
+    def request(self, message, timeout=15):
+        """
+        Send a request (or a list of requests) at once, and return an awaitable of the reply (or the list of replies).
+        The request is sent even if the awaitable is dropped, so it works with the callers of the blocking client.
+
+        Args:
+            message (str or list): The command(s).
+            timeout (float): The deadline in seconds, a negative value means not waiting for the reply.
+
+        Returns:
+            asyncio.Future: The reply, or True for the async request.
+        """
+        messages = message if isinstance(message, list) else [message]
+        if timeout < 0:
+            for msg in messages:
+                self.send(msg, False)
+            return True
+        futures = [self.send(msg, True) for msg in messages]
+        future = asyncio.gather(*futures) if isinstance(message, list) else futures[0]
+        handle = asyncio.get_event_loop().call_later(timeout, self.expire, future, message, timeout)
+        future.add_done_callback(lambda _: handle.cancel())
+        return future
+
+    def expire(self, future, message, timeout):
+        if not future.done():
+            future.set_exception(UnrealCvTimeoutError(message, timeout, 1))
+
+
+class AsyncCharacter_API(Character_API):
+    """
+    The asyncio variant of Character_API, a single event loop can drive many UE instances concurrently.
+    The setters send the commands at once as in Character_API, the getters return awaitables.
+    Call `await connect()` before sending any command.
+    """
+    def __init__(self, port=9000, ip='127.0.0.1', resolution=(160, 120), comm_mode='tcp'):
+        # do not call UnrealCv_API.__init__, it connects with the blocking client
+        self.ip = ip
+        self.port = port
+        self.comm_mode = comm_mode
+        self.resolution = resolution
+        self.decoder = MsgDecoder()
+        self.checker = ResChecker()
+        self.obj_dict = dict()
+        self.cam = dict()
+        self.client = None
+        self.api_version = None  # the shared memory commands are not used
+        self.trace_writer = None  # the session is not recorded
+        self.init_attributes(resolution)
+        self.max_inflight = 0  # the writes are buffered by the asyncio transport, there is no blocking barrier
+
+    async def connect(self, timeout=5):
+        if self.comm_mode == 'unix':
+            self.client = AsyncClient(f'/tmp/unrealcv_{self.port}.socket', 'unix')
+            try:
+                if await self.client.connect(timeout):
+                    return self.client
+            except OSError:
+                pass
+        self.client = AsyncClient((self.ip, self.port))
+        if not await self.client.connect(timeout):
+            raise ConnectionError(f'Can not connect to the UnrealCV server at {self.ip}:{self.port}')
+        return self.client
+
+    def send_cmd(self, cmd, async_mode=False, timeout=None):
+        # the synchronous command returns an awaitable instead of blocking, the deadline is enforced by the client
+        if async_mode:
+            return super(AsyncCharacter_API, self).send_cmd(cmd, async_mode=True)
+        self.invalidate_pose_snapshot(cmd if isinstance(cmd, list) else [cmd])
+        self.flush_cmds()
+        if timeout is None:
+            timeout = self.request_timeout
+        return self.client.request(cmd, timeout)
+
+    def request(self, cmd, decoder=None):
+        # send the command at once, and return a task of the decoded reply
+        return asyncio.ensure_future(self.decode_reply(self.send_cmd(cmd), decoder))
+
+    async def decode_reply(self, future, decoder=None):
+        res = await future
+        return res if decoder is None else decoder(res)
+
+    async def batch_cmd(self, cmds, decoders, **kwargs):
+        self.invalidate_pose_snapshot(cmds)
+        deferred = self.deferred_cmds
+        self.deferred_cmds = []
+        start = time.perf_counter()
+        res_list = await self.client.request(deferred + cmds, self.request_timeout)
+        self.latency['control'].append(time.perf_counter() - start)
+        self.stats.record(deferred + cmds, res_list, self.latency['control'][-1])
+        res_list = res_list[len(deferred):]
+        if decoders is None:
+            return res_list
+        return [decoder(res, **kwargs) for decoder, res in zip(decoders, res_list)]
+
+    async def decode_batch(self, res_list, decoders):
+        if self.decode_pool is None:
+            return [decoder(res) for decoder, res in zip(decoders, res_list)]
+        loop = asyncio.get_event_loop()
+        futures = [loop.run_in_executor(self.decode_pool, decoder, res) if isinstance(res, bytes) else None
+                   for decoder, res in zip(decoders, res_list)]
+        return [decoder(res) if future is None else await future
+                for decoder, res, future in zip(decoders, res_list, futures)]
+
+    def get_image(self, cam_id, viewmode, mode='bmp', return_cmd=False, show=False, inverse=False):
+        if viewmode == 'depth':
+            cmd = f'vget /camera/{cam_id}/depth npy'
+        else:
+            cmd = f'vget /camera/{cam_id}/{viewmode} {mode}'
+        if return_cmd:
+            return cmd
+        return self.request(cmd, self.get_img_decoder(cmd, self.get_img_buffer(cam_id, viewmode)))
+
+    def get_obj_location(self, obj, return_cmd=False):
+        cmd = f'vget /object/{obj}/location'
+        if return_cmd:
+            return cmd
+        pose = self.get_snapshot_pose(obj)
+        if pose is not None:
+            return self.resolved(pose[:3])
+        return self.request(cmd, self.decoder.string2floats)
+
+    def get_obj_rotation(self, obj, return_cmd=False):
+        cmd = f'vget /object/{obj}/rotation'
+        if return_cmd:
+            return cmd
+        pose = self.get_snapshot_pose(obj)
+        if pose is not None:
+            return self.resolved(pose[3:])
+        return self.request(cmd, self.decoder.string2floats)
+
+    def resolved(self, value):
+        # an awaitable of a value known in advance, e.g. the pose in the snapshot
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(value)
+        return future
+
+    async def get_obj_pose(self, obj):
+        pose = self.get_snapshot_pose(obj)
+        if pose is not None:
+            return pose
+        cmds = [self.get_obj_location(obj, return_cmd=True), self.get_obj_rotation(obj, return_cmd=True)]
+        res = await self.batch_cmd(cmds, [self.decoder.string2floats, self.decoder.string2floats])
+        return res[0] + res[1]
+
+    def get_obj_color(self, obj, return_cmd=False):
+        cmd = f'vget /object/{obj}/color'
+        if return_cmd:
+            return cmd
+        return self.request(cmd, lambda res: self.decoder.string2color(res)[:-1])
+
+    async def cached_query(self, cmd, query):
+        # the awaitable version of Character_API.cached_query, query returns an awaitable of the decoded reply
+        if not self.cache_queries:
+            return await query()
+        if cmd in self.query_cache:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            self.query_cache[cmd] = await query()
+        res = self.query_cache[cmd]
+        return list(res) if isinstance(res, list) else res  # the caller may modify the list
+
+    async def get_objects(self):
+        return await self.cached_query('vget /objects', lambda: self.decode_reply(self.send_cmd('vget /objects'), str.split))
+
+    async def get_camera_num(self):
+        return await self.cached_query('vget /cameras', lambda: self.decode_reply(self.send_cmd('vget /cameras'), lambda res: len(res.split())))
+
+    async def get_camera_config(self):
+        num_cameras = await self.get_camera_num()
+        cmds = []
+        for i in range(num_cameras):
+            cmds.extend([f'vget /camera/{i}/location', f'vget /camera/{i}/rotation', f'vget /camera/{i}/fov'])
+        res = await self.batch_cmd(cmds, None)
+        cam = dict()
+        for i in range(num_cameras):
+            cam[i] = dict(
+                location=self.decoder.string2floats(res[3*i]),
+                rotation=self.decoder.string2floats(res[3*i+1]),
+                fov=res[3*i+2]
+            )
+        return cam
+
+    async def build_color_dict(self, objects, batch=True):
+        # only the colors not in the cache are queried, in one batch
+        cmds = [self.get_obj_color(obj, return_cmd=True) for obj in objects]
+        misses = [cmd for cmd in cmds if not self.cache_queries or cmd not in self.query_cache]
+        res_list = await self.batch_cmd(misses, [self.decoder.string2color for _ in misses]) if len(misses) > 0 else []
+        colors = dict(zip(misses, res_list))
+        color_dict = dict()
+        for obj, cmd in zip(objects, cmds):
+            color_dict[obj] = await self.cached_query(cmd, lambda: self.resolved(colors[cmd]))
+        self.obj_dict = color_dict
+        return color_dict
+
+    async def init_map(self):
+        self.cam = await self.get_camera_config()
+        await self.build_color_dict(await self.get_objects())
+
+    async def set_map(self, map_name, return_cmd=False):
+        self.clear_query_cache()
+        res = await self.send_cmd(f'vset /action/game/level {map_name}')
+        if self.checker.not_error(res):
+            await self.init_map()
+
+    async def init_objects(self, objects):
+        cmds = [self.get_obj_location(obj, return_cmd=True) for obj in objects]
+        res = await self.batch_cmd(cmds, [self.decoder.string2floats for _ in objects])
+        self.objects_dict = dict(zip(objects, res))
+        return self.objects_dict
+
+    async def get_pose_img_batch(self, objs_list, cam_ids, img_flag=[False, True, False, False], action_cmds=None, img_out=None):
+        # the awaitable version of Character_API.get_pose_img_batch, in one round trip
+        if action_cmds is None:
+            action_cmds = []
+        if img_out is None:
+            img_out = dict()
+        plan = self.get_capture_plan(objs_list, cam_ids, img_flag)
+        cmd_list, decoders = plan.cmds, plan.bind(img_out, self.get_img_out)
+        res_list = (await self.batch_cmd(action_cmds + cmd_list, None))[len(action_cmds):]
+        self.record_img_link(sum(len(res) for res in res_list if isinstance(res, bytes)))
+        res_list = await self.decode_batch(res_list, decoders)
+        return self.parse_pose_img_batch(res_list, plan, img_out)
@@ -1,19 +1,114 @@
+import unrealcv
 from unrealcv.api import UnrealCv_API
 import numpy as np
 import math
+import functools
+import os
 import time
 import json
 import re
+import threading
+import warnings
 from io import BytesIO
 import PIL.Image
+import cv2
+from collections import deque
+from queue import Empty
+from concurrent.futures import ThreadPoolExecutor
 from gym_unrealcv.envs.utils import misc
+from gym_unrealcv.envs.utils.stats import CmdStats
+from gym_unrealcv.envs.utils.trace import TraceWriter, RecordingClient
+from gym_unrealcv.envs.utils.encoding import EncodingSelector
+
+
+class UnrealCvTimeoutError(TimeoutError):
+    """
+    Raised when the UnrealCV server does not reply to a command before the deadline.
+    """
+    def __init__(self, cmd, timeout, attempts, missing=1):
+        super(UnrealCvTimeoutError, self).__init__(f'No reply to "{cmd}" in {timeout:.1f}s after {attempts} attempts')
+        self.cmd = cmd
+        self.timeout = timeout
+        self.attempts = attempts
+        self.missing = missing  # the number of replies not received, they arrive late
+
+
+def locked(method):
+    # one request at a time on the control connection, e.g. a query of step_wait while a pipelined tick is in flight
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.conn_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class CapturePlan:
+    """
+    The compiled commands of get_pose_img_batch for a set of objects, cameras and flags: the command payload,
+    the decoders and the positions of the replies. The image decoders are bound to the destinations of each step.
+    """
+    def __init__(self, key, cmds, decoders, img_specs, cam_specs):
+        self.key = key  # (objs_list, cam_ids, img_flag, capture_dir), img_flag may be the flags of each camera
+        self.cmds = cmds
+        self.decoders = decoders  # the decoders of the text replies, None for the images
+        self.img_specs = img_specs  # (position, modality, index, cam_id, viewmode, factory) of each image, factory(out) -> decoder
+        self.cam_specs = cam_specs  # the positions of the replies of each camera, None for the agent without camera
+
+    def bind(self, img_out, get_img_out):
+        decoders = list(self.decoders)
+        for pos, modality, i, cam_id, viewmode, factory in self.img_specs:
+            decoders[pos] = factory(get_img_out(img_out, modality, i, cam_id, viewmode))
+        return decoders
+
+
 class Character_API(UnrealCv_API):
-    def __init__(self, port=9000, ip='127.0.0.1', resolution=(160, 120), comm_mode='tcp'):
+    def __init__(self, port=9000, ip='127.0.0.1', resolution=(160, 120), comm_mode='tcp', record=None):
+        # record: the path of the trace file to record the session, see gym_unrealcv.envs.utils.trace
+        self.trace_writer = TraceWriter(record) if record is not None else None
+        self.init_attributes(resolution)  # before connecting, UnrealCv_API.__init__ queries the scene in init_map
+        self.port = port
+        self.comm_mode = comm_mode
         super(Character_API, self).__init__(port=port, ip=ip, resolution=resolution, mode=comm_mode)
+
+    def init_attributes(self, resolution):
         self.obstacles = []
         self.targets = []
         self.img_color = np.zeros((resolution[1], resolution[0], 3))
         self.img_depth = np.zeros((resolution[1], resolution[0], 1))
+        self.reuse_img_buffer = False  # decode the images of each camera into the same buffer every step
+        self.img_buffers = dict()  # (cam_id, viewmode) -> buffer
+        self.request_timeout = 15  # the deadline (seconds) of a synchronous command, including the retries
+        self.request_retries = 5  # the max number of retries when the server does not reply
+        self.attempt_timeout = 5  # the max time (seconds) to wait for the reply of one attempt before retrying
+        self.stale_replies = 0  # the late replies of the timed out requests, dropped ahead of the next replies
+        self.retry_backoff = 0.05  # the first delay (seconds) between retries, doubled after each retry
+        self.max_inflight = 256  # the max number of async commands waiting for acknowledgement, the sender blocks when it is full
+        self.inflight = 0  # the async commands sent since the last synchronous reply, which acknowledges all of them
+        self.barrier_cmd = 'vget /unrealcv/status'  # the synchronous command to wait for the acknowledgements
+        self.conn_lock = threading.RLock()  # held by the requests on the control connection, see locked
+        self.stream_decode = True  # decode each reply of a batch as it arrives, instead of holding all the raw replies
+        self.defer_cmds = False  # buffer the async commands, and send them ahead of the next batch or synchronous command
+        self.deferred_cmds = []
+        self.decode_workers = 0  # the number of threads to decode the images of a batch, 0: decode in the calling thread
+        self.decode_pool = None
+        self.cache_queries = True  # cache the replies of the static scene queries (objects, cameras, size, class, color)
+        self.query_cache = dict()  # command -> decoded reply
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # the poses fetched by get_pose_img_batch, valid until the next state-changing command
+        self.pose_snapshot = dict()  # obj -> the row [x, y, z, roll, yaw, pitch] of the pose array
+        self.use_pose_snapshot = True  # answer the pose queries of the same step from the snapshot
+        self.vbp_queries = {'get_hit', 'get_speed', 'get_angle', 'is_picked', 'is_carrying'}  # the read-only blueprint calls, they keep the snapshot
+        self.debug_pose_queries = False  # warn on the redundant pose queries in the same step
+        self.redundant_pose_queries = 0
+        self.img_client = None  # the second connection for the image capture, None: the images share the control connection
+        self.capture_dir = None  # the directory (as seen by UE) to capture the frames into, None: the frames are sent over the socket
+        self.docker_dir = None  # (the directory in docker, the directory on the host) to map the paths written by UE in docker
+        self.img_encoding = None  # the EncodingSelector of the lit and mask formats, None: always bmp
+        self.capture_plan = None  # the compiled commands of get_pose_img_batch, see get_capture_plan
+        self.ctrl_executor = None  # the thread to query the poses while the images are fetched
+        self.latency = dict(control=deque(maxlen=100), image=deque(maxlen=100))  # the recent round trip time (seconds) of each connection
+        self.stats = CmdStats()  # the count, bytes and latency of each command family, see stats.snapshot()
         self.animation_dict = {
             'stand': self.set_standup,
             'jump': self.set_jump,
@@ -25,6 +120,587 @@ class Character_API(UnrealCv_API):
             'drop':self.drop_body
         }
 
+    def connect(self, ip, port, mode='tcp'):
+        if self.trace_writer is None:
+            return super(Character_API, self).connect(ip, port, mode)
+        if mode == 'unix':
+            warnings.warn('The session is recorded over tcp, the unix socket is not used')
+        client = RecordingClient((ip, port), self.trace_writer)
+        client.connect()
+        return client
+
+    def close_trace(self):
+        if self.trace_writer is not None:
+            self.trace_writer.close()
+            self.trace_writer = None
+
+    @locked
+    def send_cmd(self, cmd, async_mode=False, timeout=None):
+        """
+        Send a command to the UnrealCV server, all the setters and getters are routed through it.
+        A synchronous command is retried with exponential backoff until the deadline, instead of spinning.
+        Each attempt waits at most self.attempt_timeout, the late replies of the timed out attempts are dropped
+        before the next reply is read, so the replies stay in sync with the commands.
+
+        Args:
+            cmd (str): The command.
+            async_mode (bool): If True, send the command without waiting for the reply.
+            timeout (float, optional): The deadline in seconds. Defaults to self.request_timeout.
+
+        Returns:
+            str: The reply of the server (True for the async command).
+
+        Raises:
+            UnrealCvTimeoutError: If there is no reply before the deadline or after the max retries.
+        """
+        cmds = cmd if isinstance(cmd, list) else [cmd]
+        self.invalidate_pose_snapshot(cmds)
+        if async_mode:
+            if self.defer_cmds:
+                self.deferred_cmds.extend(cmds)
+                return True
+            self.stats.record(cmds)
+            return self.send_async(cmd)
+        self.flush_cmds()  # keep the order of the commands
+        if timeout is None:
+            timeout = self.request_timeout
+        deadline = time.time() + timeout
+        delay = self.retry_backoff
+        attempts = 0
+        while attempts <= self.request_retries:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            attempts += 1
+            wait = min(remaining, self.attempt_timeout)
+            start = time.perf_counter()
+            res = None
+            if self.drop_stale_replies(wait):
+                try:
+                    res = self.timed_request(self.client, cmd, max(wait - (time.perf_counter() - start), 0))
+                except UnrealCvTimeoutError as error:
+                    self.stale_replies += error.missing
+                except TimeoutError:
+                    self.stale_replies += 1
+            if res is not None:
+                self.inflight = 0  # the replies come in order
+                self.latency['control'].append(time.perf_counter() - start)
+                self.stats.record(cmds, res if isinstance(cmd, list) else [res], self.latency['control'][-1])
+                return res
+            warnings.warn(f'No reply to "{cmd}", retry in {delay:.2f}s')
+            time.sleep(max(min(delay, deadline - time.time()), 0))
+            delay *= 2
+        raise UnrealCvTimeoutError(cmd, timeout, attempts)
+
+    def drop_stale_replies(self, timeout):
+        """
+        Drop the late replies of the timed out requests, they arrive ahead of the replies of the next requests.
+        If the reply queue can not be read (see get_stream_client), reconnect to start over on a new connection.
+
+        Args:
+            timeout (float): The max time in seconds to wait for the late replies.
+
+        Returns:
+            bool: True if there is no late reply left.
+        """
+        if self.stale_replies == 0:
+            return True
+        client = self.get_stream_client()
+        if client is None:
+            self.reconnect()
+            return True
+        deadline = time.time() + timeout
+        while self.stale_replies > 0:
+            try:
+                client.recv_data_q.get(timeout=max(deadline - time.time(), 0))
+            except Empty:
+                return False
+            self.stale_replies -= 1
+        return True
+
+    def reconnect(self):
+        # the late replies of the old connection are dropped with it
+        warnings.warn(f'Reconnect to {self.ip}:{self.port} to drop {self.stale_replies} late replies')
+        self.client.disconnect()
+        self.client = self.connect(self.ip, self.port, self.comm_mode)
+        self.client.message_handler = self.message_handler
+        self.stale_replies = 0
+
+    @locked
+    def flush_cmds(self):
+        """
+        Send the deferred commands in one batch without waiting for the replies.
+        """
+        if len(self.deferred_cmds) > 0:
+            cmds = self.deferred_cmds
+            self.deferred_cmds = []
+            self.stats.record(cmds)
+            self.send_async(cmds)
+
+    @locked
+    def send_async(self, cmd):
+        """
+        Send the async command(s) within the in-flight window, the acknowledgements are drained by the receiving thread
+        of the client. A burst larger than the window is sent in chunks, the window is emptied by wait_inflight
+        before a chunk that does not fit.
+
+        Args:
+            cmd (str or list): The command(s).
+
+        Returns:
+            bool: True.
+        """
+        cmds = cmd if isinstance(cmd, list) else [cmd]
+        window = self.max_inflight if self.max_inflight else len(cmds)
+        for i in range(0, len(cmds), window):
+            chunk = cmds[i:i + window]
+            if self.max_inflight and self.inflight + len(chunk) > self.max_inflight:
+                self.wait_inflight()
+            self.client.request(chunk if isinstance(cmd, list) else chunk[0], -1)
+            self.inflight += len(chunk)
+        return True
+
+    def wait_inflight(self, timeout=None):
+        """
+        Block until the async commands in flight are acknowledged (back-pressure). A synchronous barrier command is sent,
+        its reply comes after the acknowledgements of all the commands sent before it.
+
+        Args:
+            timeout (float, optional): The deadline in seconds. Defaults to self.request_timeout.
+
+        Raises:
+            UnrealCvTimeoutError: If the server does not acknowledge the commands before the deadline.
+        """
+        if self.inflight > 0:
+            self.send_cmd(self.barrier_cmd, timeout=timeout)  # resets self.inflight
+
+    @locked
+    def batch_cmd(self, cmds, decoders, **kwargs):
+        # the deferred commands are sent ahead of the batch in the same round trip, their replies are dropped
+        self.invalidate_pose_snapshot(cmds)
+        if not self.drop_stale_replies(self.request_timeout):
+            raise UnrealCvTimeoutError(f'{self.stale_replies} late replies', self.request_timeout, 1)
+        deferred = self.deferred_cmds
+        self.deferred_cmds = []
+        start = time.perf_counter()
+        try:
+            res_list = self.timed_request(self.client, deferred + cmds, self.request_timeout)
+        except UnrealCvTimeoutError as error:
+            self.stale_replies += error.missing  # dropped ahead of the next replies
+            raise
+        self.inflight = 0
+        self.latency['control'].append(time.perf_counter() - start)
+        self.stats.record(deferred + cmds, res_list, self.latency['control'][-1])
+        res_list = res_list[len(deferred):]
+        if decoders is None:
+            return res_list
+        return [decoder(res, **kwargs) for decoder, res in zip(decoders, res_list)]
+
+    def get_stream_client(self, client=None):
+        """
+        Get the client to stream a batch through: the blocking unrealcv client, whose receiving thread puts the replies
+        into recv_data_q in order. This relies on the internals of the unrealcv 1.x client, the streaming is disabled
+        (None) for the other versions and clients, e.g. the asyncio client.
+
+        Args:
+            client (unrealcv.Client, optional): The client to check. Defaults to the control client.
+
+        Returns:
+            unrealcv.Client: The client, None if its internals are not the known ones.
+        """
+        if client is None:
+            client = self.client
+        if unrealcv.__version__.split('.')[0] != '1' or not isinstance(client, unrealcv.Client):
+            return None
+        if not all(hasattr(client, attr) for attr in ['send_message_id', 'recv_num_q', 'recv_data_q']):
+            return None
+        return client
+
+    def timed_request(self, client, cmd, timeout):
+        """
+        client.request with a deadline, also for a batch: unrealcv.Client waits for the replies of a batch without one.
+        If the client can not be streamed (see get_stream_client), the batch is sent by client.request without a deadline.
+
+        Args:
+            client (unrealcv.Client): The client.
+            cmd (str or list): The command or the batch of commands.
+            timeout (float): The deadline in seconds.
+
+        Returns:
+            str or list: The reply, or the replies of the batch.
+
+        Raises:
+            UnrealCvTimeoutError: If the replies do not arrive before the deadline, missing is the number of late replies.
+        """
+        if not isinstance(cmd, list):
+            return client.request(cmd, timeout)
+        if self.get_stream_client(client) is None:
+            return client.request(cmd)
+        deadline = time.time() + timeout
+        self.send_batch(client, cmd)
+        res_list = []
+        for i, each in enumerate(cmd):
+            try:
+                res = client.recv_data_q.get(timeout=max(deadline - time.time(), 0))
+            except Empty:
+                raise UnrealCvTimeoutError(f'{len(cmd)} commands', timeout, 1, missing=len(cmd) - i)
+            if isinstance(res, Exception):
+                raise res
+            if isinstance(each, unrealcv.SharedCommand):  # decoded as in unrealcv.Client.request_batch
+                res = client._decode_shared_response(res, each.response_format)
+            res_list.append(res)
+        return res_list
+
+    def send_batch(self, client, cmds):
+        # send a batch on the blocking client, the receiving thread puts the replies into recv_data_q in order
+        for cmd in cmds:
+            if not client.send(b'%d:%s' % (client.send_message_id, cmd.encode('utf-8'))):
+                raise ConnectionError('Failed to send: socket is closed')
+            client.send_message_id += 1
+        client.recv_num_q.put(-len(cmds))
+
+    def can_stream(self, cmds):
+        # the streaming decode reads the reply queue of the blocking client, the shared-memory commands are re-encoded by it
+        return self.stream_decode and self.get_stream_client() is not None and all(type(cmd) is str for cmd in cmds)
+
+    @locked
+    def batch_cmd_stream(self, cmds, decoders, timeout=None):
+        """
+        Send a batch and decode each reply as soon as it arrives, the raw reply is released right after decoding,
+        so the raw bytes of the whole batch are never held at once. The deferred commands are sent ahead.
+        Falls back to batch_cmd if the client can not be streamed, see get_stream_client.
+
+        Args:
+            cmds (list): The commands.
+            decoders (list): The decoder of each command, None to drop the reply.
+            timeout (float, optional): The deadline in seconds of the whole batch. Defaults to self.request_timeout.
+
+        Returns:
+            list: The decoded results in the order of the commands, None for the dropped replies.
+
+        Raises:
+            UnrealCvTimeoutError: If the replies do not arrive before the deadline.
+        """
+        client = self.get_stream_client()
+        if client is None:
+            res_list = self.batch_cmd(cmds, None)
+            return [None if decoder is None else decoder(res) for decoder, res in zip(decoders, res_list)]
+        if timeout is None:
+            timeout = self.request_timeout
+        start = time.perf_counter()
+        deadline = time.time() + timeout
+        if not self.drop_stale_replies(timeout):
+            raise UnrealCvTimeoutError(f'{self.stale_replies} late replies', timeout, 1)
+        client = self.get_stream_client()  # a new client if it is reconnected
+        self.invalidate_pose_snapshot(cmds)
+        deferred = self.deferred_cmds
+        self.deferred_cmds = []
+        cmds = deferred + cmds
+        decoders = [None] * len(deferred) + decoders
+        self.send_batch(client, cmds)
+        results = [None] * len(cmds)
+        sizes = [0] * len(cmds)
+        futures = []
+        for i, decoder in enumerate(decoders):
+            try:
+                res = client.recv_data_q.get(timeout=max(deadline - time.time(), 0))
+            except Empty:
+                self.stale_replies += len(cmds) - i  # dropped ahead of the next replies
+                raise UnrealCvTimeoutError(f'{len(cmds)} commands', timeout, 1)
+            if isinstance(res, Exception):
+                raise res
+            if res is None:
+                raise ConnectionError('Connection lost during receive')
+            sizes[i] = len(res)
+            if decoder is None:
+                continue
+            if self.decode_pool is not None and isinstance(res, bytes):  # decode while receiving the next replies
+                futures.append((i, self.decode_pool.submit(decoder, res)))
+            else:
+                results[i] = decoder(res)
+        self.inflight = 0
+        self.latency['control'].append(time.perf_counter() - start)
+        self.stats.record(cmds, sizes, self.latency['control'][-1])
+        self.record_img_link(sum(size for cmd, size in zip(cmds, sizes) if self.is_img_cmd(cmd)))
+        for i, future in futures:
+            results[i] = future.result()
+        return results[len(deferred):]
+
+    def invalidate_pose_snapshot(self, cmds):
+        # any command other than a query may change the poses
+        if len(self.pose_snapshot) > 0 and not all(self.is_query(cmd) for cmd in cmds):
+            self.pose_snapshot = dict()
+
+    def is_query(self, cmd):
+        # a vget command or a read-only blueprint call (vbp <obj> get_hit)
+        tokens = cmd.split(' ', 3)
+        return tokens[0] == 'vget' or (tokens[0] == 'vbp' and len(tokens) > 2 and tokens[2] in self.vbp_queries)
+
+    def get_snapshot_pose(self, obj):
+        """
+        Get the pose of an object from the snapshot of the last get_pose_img_batch.
+        The snapshot is dropped by the next state-changing command, e.g. set_move_bp, set_obj_location.
+
+        Args:
+            obj (str): The object name.
+
+        Returns:
+            list: The pose [x, y, z, roll, yaw, pitch], None if the pose has to be queried from the server.
+        """
+        if obj not in self.pose_snapshot:
+            return None
+        self.redundant_pose_queries += 1
+        if self.debug_pose_queries:
+            warnings.warn(f'Redundant pose query of {obj} in the same step', stacklevel=3)
+        if not self.use_pose_snapshot:
+            return None
+        return self.pose_snapshot[obj].tolist()
+
+    def cached_query(self, cmd, query):
+        """
+        Return the cached reply of a static scene query, or run the query and cache the reply.
+        The cache is invalidated by spawn, destroy and set_map (see clear_query_cache).
+
+        Args:
+            cmd (str): The command, used as the key of the cache.
+            query (function): The function to get the decoded reply from the server.
+
+        Returns:
+            The decoded reply.
+        """
+        if not self.cache_queries:
+            return query()
+        if cmd in self.query_cache:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            self.query_cache[cmd] = query()
+        res = self.query_cache[cmd]
+        return list(res) if isinstance(res, list) else res  # the caller may modify the list
+
+    def clear_query_cache(self, obj=None):
+        """
+        Invalidate the cached scene queries.
+
+        Args:
+            obj (str, optional): Invalidate the queries about this object and the object/camera lists.
+                                 Defaults to None, invalidate all.
+        """
+        if obj is None:
+            self.query_cache.clear()
+            return
+        for cmd in ['vget /objects', 'vget /cameras']:
+            self.query_cache.pop(cmd, None)
+        for cmd in [cmd for cmd in self.query_cache if cmd.startswith(f'vget /object/{obj}/')]:
+            self.query_cache.pop(cmd)
+
+    def cache_info(self):
+        return dict(hits=self.cache_hits, misses=self.cache_misses, size=len(self.query_cache))
+
+    def get_objects(self):
+        return self.cached_query('vget /objects', lambda: self.send_cmd('vget /objects').split())
+
+    def get_camera_num(self):
+        return self.cached_query('vget /cameras', lambda: len(self.send_cmd('vget /cameras').split()))
+
+    def get_obj_size(self, obj, box=True):
+        # the size is measured once at the zero rotation, the later calls skip the rotation reset
+        def query():
+            self.set_obj_rotation(obj, [0, 0, 0])  # init
+            bounds = self.decoder.string2floats(self.send_cmd(cmd))
+            return [bounds[3] - bounds[0], bounds[4] - bounds[1], bounds[5] - bounds[2]]
+        cmd = self.get_obj_bounds(obj, return_cmd=True)
+        [x, y, z] = self.cached_query(cmd, query)
+        if box:
+            return [x, y, z]
+        else:
+            return x*y*z
+
+    def get_obj_uclass(self, obj, return_cmd=False):
+        cmd = f'vget /object/{obj}/uclass_name'
+        if return_cmd:
+            return cmd
+        return self.cached_query(cmd, lambda: self.send_cmd(cmd))
+
+    def build_color_dict(self, objects, batch=True):
+        # only the colors not in the cache are queried, in one batch
+        cmds = [self.get_obj_color(obj, return_cmd=True) for obj in objects]
+        misses = [cmd for cmd in cmds if not self.cache_queries or cmd not in self.query_cache]
+        res_list = self.batch_cmd(misses, [self.decoder.string2color for _ in misses]) if len(misses) > 0 else []
+        colors = dict(zip(misses, res_list))
+        color_dict = dict()
+        for obj, cmd in zip(objects, cmds):
+            color_dict[obj] = self.cached_query(cmd, lambda: colors[cmd])
+        self.obj_dict = color_dict
+        return color_dict
+
+    # The methods below override the UnrealCv_API ones that call client.request directly, they are routed through
+    # send_cmd, so they keep their order after the deferred commands and are counted in stats and in flight.
+    def set_map(self, map_name, return_cmd=False):
+        cmd = super(Character_API, self).set_map(map_name, return_cmd=True)
+        if return_cmd:
+            return cmd
+        self.clear_query_cache()
+        if self.checker.not_error(self.send_cmd(cmd)):
+            self.init_map()
+
+    def set_new_obj(self, class_name, obj_name, location=None, return_cmd=False):
+        cmd = super(Character_API, self).set_new_obj(class_name, obj_name, location=location, return_cmd=True)
+        if return_cmd:
+            return cmd
+        self.clear_query_cache(obj_name)
+        res = self.send_cmd(cmd)
+        if self.checker.is_error(res):
+            if isinstance(class_name, str) and class_name.startswith('/'):  # an asset path
+                return self.spawn_object_from_path(class_name, obj_name=obj_name, annotate=True)
+            warnings.warn(f'{res}. Hint: set_new_obj() prefers UClass names, use spawn_object_from_path() for an asset path.')
+            return None
+        # assign a random color to the object
+        color = np.random.randint(0, 255, 3).tolist()
+        used_colors = [list(c) for c in self.obj_dict.values()]
+        while color in used_colors:
+            color = np.random.randint(0, 255, 3).tolist()
+        self.obj_dict[obj_name] = color
+        self.set_obj_color(obj_name, color)
+        # check if new cameras are added
+        while len(self.cam) < self.get_camera_num():
+            self.register_camera(len(self.cam), obj_name)
+        return obj_name
+
+    def spawn_object_from_path(self, asset_path, obj_name=None, annotate=True, return_cmd=False):
+        cmd = super(Character_API, self).spawn_object_from_path(asset_path, obj_name, annotate, return_cmd=True)
+        if return_cmd:
+            return cmd
+        self.clear_query_cache(obj_name)
+        res = self.send_cmd(cmd)
+        if self.checker.is_error(res):
+            warnings.warn(res)
+            return None
+        spawned_name = res.strip()
+        if annotate:
+            self.obj_dict[spawned_name] = self.get_obj_color(spawned_name)
+        return spawned_name
+
+    def destroy_obj(self, obj):
+        self.clear_query_cache(obj)
+        self.pose_snapshot.pop(obj, None)
+        self.send_cmd(f'vset /object/{obj}/destroy', async_mode=True)
+        self.obj_dict.pop(obj)
+
+    def get_image(self, cam_id, viewmode, mode='bmp', return_cmd=False, show=False, inverse=False):
+        if viewmode == 'depth':
+            return self.get_depth(cam_id, return_cmd=return_cmd, show=show)
+        cmd = super(Character_API, self).get_image(cam_id, viewmode, mode, return_cmd=True)
+        if return_cmd:
+            return cmd
+        image = self.decoder.decode_img(self.send_cmd(cmd), mode, inverse)
+        if show:
+            cv2.imshow('image_'+viewmode, image)
+            cv2.waitKey(1)
+        return image
+
+    def get_depth(self, cam_id, inverse=False, return_cmd=False, show=False):
+        cmd = super(Character_API, self).get_depth(cam_id, return_cmd=True)
+        if return_cmd:
+            return cmd
+        depth = self.decoder.decode_depth(self.send_cmd(cmd), inverse)
+        if show:
+            cv2.imshow('image', depth/depth.max())  # normalize the depth image
+            cv2.waitKey(10)
+        return depth
+
+    def get_obj_bounds(self, obj, return_cmd=False):
+        cmd = f'vget /object/{obj}/bounds'
+        if return_cmd:
+            return cmd
+        return self.decoder.string2floats(self.send_cmd(cmd))  # min x,y,z  max x,y,z
+
+    def set_cam_fov(self, cam_id, fov):
+        if fov == self.cam[cam_id]['fov']:
+            return fov
+        self.send_cmd(f'vset /camera/{cam_id}/fov {fov}', async_mode=True)
+        self.cam[cam_id]['fov'] = fov
+        return fov
+
+    def set_hide_obj(self, obj, return_cmd=False):
+        cmd = f'vset /object/{obj}/hide'
+        if return_cmd:
+            return cmd
+        self.send_cmd(cmd, async_mode=True)
+
+    def set_show_obj(self, obj, return_cmd=False):
+        cmd = f'vset /object/{obj}/show'
+        if return_cmd:
+            return cmd
+        self.send_cmd(cmd, async_mode=True)
+
+    def set_hide_objects(self, objects):
+        self.send_cmd([self.set_hide_obj(obj, return_cmd=True) for obj in objects], async_mode=True)
+
+    def set_show_objects(self, objects):
+        self.send_cmd([self.set_show_obj(obj, return_cmd=True) for obj in objects], async_mode=True)
+
+    def set_obj_location(self, obj, loc):
+        [x, y, z] = loc
+        cmd = f'vset /object/{obj}/location {x} {y} {z}'
+        self.send_cmd(cmd, async_mode=True)
+
+    def set_obj_color(self, obj, color, return_cmd=False):  # set object color in object mask, color = [r,g,b]
+        cmd = super(Character_API, self).set_obj_color(obj, color, return_cmd=True)
+        if return_cmd:
+            return cmd
+        self.query_cache.pop(self.get_obj_color(obj, return_cmd=True), None)
+        self.send_cmd(cmd, async_mode=True)
+
+    def set_obj_scale(self, obj, scale=None, return_cmd=False):
+        cmd = super(Character_API, self).set_obj_scale(obj, scale, return_cmd=True)
+        if return_cmd:
+            return cmd
+        self.query_cache.pop(self.get_obj_bounds(obj, return_cmd=True), None)
+        self.send_cmd(cmd, async_mode=True)
+
+    def set_obj_rotation(self, obj, rot):
+        [roll, yaw, pitch] = rot
+        cmd = f'vset /object/{obj}/rotation {pitch} {yaw} {roll}'
+        self.send_cmd(cmd, async_mode=True)
+
+    def set_cam_location(self, cam_id, loc):
+        [x, y, z] = loc
+        self.send_cmd(f'vset /camera/{cam_id}/location {x} {y} {z}', async_mode=True)
+        self.cam[cam_id]['location'] = loc
+
+    def set_cam_rotation(self, cam_id, rot, rpy=False):
+        if rpy:
+            [roll, yaw, pitch] = rot
+        else:
+            [pitch, yaw, roll] = rot
+        self.send_cmd(f'vset /camera/{cam_id}/rotation {pitch} {yaw} {roll}', async_mode=True)
+        self.cam[cam_id]['rotation'] = [pitch, yaw, roll]
+
+    def get_obj_location(self, obj, return_cmd=False):  # get object location
+        cmd = f'vget /object/{obj}/location'
+        if return_cmd:
+            return cmd
+        pose = self.get_snapshot_pose(obj)
+        if pose is not None:
+            return pose[:3]
+        return self.decoder.string2floats(self.send_cmd(cmd))
+
+    def get_obj_rotation(self, obj, return_cmd=False):  # get object rotation
+        cmd = f'vget /object/{obj}/rotation'
+        if return_cmd:
+            return cmd
+        pose = self.get_snapshot_pose(obj)
+        if pose is not None:
+            return pose[3:]
+        return self.decoder.string2floats(self.send_cmd(cmd))
+
+    def get_obj_pose(self, obj):
+        pose = self.get_snapshot_pose(obj)
+        if pose is not None:
+            return pose
+        return super(Character_API, self).get_obj_pose(obj)
+
     def init_mask_color(self, targets=None):
         if targets == 'all':
             self.targets = self.get_objects()
@@ -95,9 +771,7 @@ class Character_API(UnrealCv_API):
             float: The speed that was set.
         """
         cmd = f'vbp {player} set_speed {speed}'
-        res = None
-        while res is None:
-            res = self.client.request(cmd)
+        res = self.send_cmd(cmd)
         return speed
 
     def set_acceleration(self, player, acc):
@@ -112,9 +786,7 @@ class Character_API(UnrealCv_API):
             float: The acceleration that was set.
         """
         cmd = f'vbp {player} set_acc {acc}'
-        res = None
-        while res is None:
-            res = self.client.request(cmd.format(player=player, acc=acc))
+        res = self.send_cmd(cmd)
         return acc
 
     def set_appearance(self, player, id):
@@ -129,9 +801,7 @@ class Character_API(UnrealCv_API):
                int: The appearance ID that was set.
            """
         cmd = f'vbp {player} set_app {id}'
-        res = None
-        while res is None:
-            res = self.client.request(cmd.format(player=player, id=id), -1)
+        res = self.send_cmd(cmd, async_mode=True)
         return id
 
     def move_cam_2d(self, cam_id, angle, distance):
@@ -156,9 +826,7 @@ class Character_API(UnrealCv_API):
                 float: The speed of the player.
         """
         cmd = f'vbp {player} get_speed'
-        res = None
-        while res is None:
-            res = self.client.request(cmd)
+        res = self.send_cmd(cmd)
         return self.decoder.string2vector(res)[0]
 
     def get_angle(self, player):
@@ -172,9 +840,7 @@ class Character_API(UnrealCv_API):
                float: The angle of the player.
         """
         cmd = f'vbp {player} get_angle'
-        res = None
-        while res is None:
-            res = self.client.request(cmd)
+        res = self.send_cmd(cmd)
         return self.decoder.string2vector(res)[0]
 
     def reset_player(self, player):
@@ -185,9 +851,7 @@ class Character_API(UnrealCv_API):
                 player (str): The identifier of the player.
         """
         cmd = f'vbp {player} reset'
-        res=None
-        while res is None:
-            res = self.client.request(cmd)
+        res = self.send_cmd(cmd)
 
     def set_phy(self, obj, state):
         """
@@ -197,9 +861,7 @@ class Character_API(UnrealCv_API):
                 state (int): The physics state to set (0 or 1).
         """
         cmd = f'vbp {obj} set_phy {state}'
-        res=None
-        while res is None:
-            res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
 
     def simulate_physics(self, objects):
         res = [self.set_phy(obj, 1) for obj in objects]
@@ -214,26 +876,20 @@ class Character_API(UnrealCv_API):
         cmd = f'vbp {player} set_move {params_str}'
         if return_cmd:
             return cmd
-        res = None
-        while res is None:
-            res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
 
     # functions for character actions
     def set_jump(self, player, return_cmd=False):
         cmd = f'vbp {player} set_jump'
         if return_cmd:
             return cmd
-        res = None
-        while res is None:
-            res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
 
     def set_crouch(self, player, return_cmd=False):
         cmd = f'vbp {player} set_crouch'
         if return_cmd:
             return cmd
-        res = None
-        while res is None:
-            res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
 
     def set_liedown(self, player, directions=(100, 100), return_cmd=False):
         frontback = directions[0]
@@ -241,26 +897,20 @@ class Character_API(UnrealCv_API):
         cmd = f'vbp {player} set_liedown {frontback} {leftright}'
         if return_cmd:
             return cmd
-        res = None
-        while res is None:
-            res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
 
     def set_standup(self, player, return_cmd=False):
         cmd = f'vbp {player} set_standup'
         if return_cmd:
             return cmd
-        res = None
-        while res is None:
-            res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
 
     def set_animation(self, player, anim_id, return_cmd=False):
         return self.animation_dict[anim_id](player, return_cmd=return_cmd)
 
     def get_hit(self, player):
         cmd = f'vbp {player} get_hit'
-        res = None
-        while res is None:
-            res = self.client.request(cmd)
+        res = self.send_cmd(cmd)
         if '1' in res:
             return True
         if '0' in res:
@@ -268,15 +918,11 @@ class Character_API(UnrealCv_API):
 
     def set_random(self, player, value=1):
         cmd = f'vbp {player} set_random {value}'
-        res=None
-        while res is None:
-            res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
 
     def set_interval(self, player, interval):
         cmd = f'vbp {player} set_interval {interval}'
-        res = None
-        while res is None:
-            res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
 
     def init_objects(self, objects):
         self.objects_dict = dict()
@@ -305,7 +951,6 @@ class Character_API(UnrealCv_API):
                 obstacle_loc[1] = np.random.uniform(area[2]+100, area[3]-100)
                 obstacle_loc[2] = np.random.uniform(area[4], area[5]) -100
             self.set_obj_location(obstacle, obstacle_loc)
-            time.sleep(0.01)
 
     def clean_obstacles(self):
         for obj in self.obstacles:
@@ -314,6 +959,7 @@ class Character_API(UnrealCv_API):
 
     def new_obj(self, obj_class_name, obj_name, loc, rot=[0, 0, 0]):
         # spawn, set obj pose, enable physics
+        self.clear_query_cache(obj_name)
         [x, y, z] = loc
         [pitch, yaw, roll] = rot
         if obj_class_name =="bp_character_C" or obj_class_name =="target_C":
@@ -328,7 +974,7 @@ class Character_API(UnrealCv_API):
                    f'vset /object/{obj_name}/rotation {pitch} {yaw} {roll}',
                    f'vbp {obj_name} set_phy 1'
                    ]
-        self.client.request(cmd, -1)
+        self.send_cmd(cmd, async_mode=True)
         return obj_name
 
     def set_cam(self, obj, loc=[0, 30, 70], rot=[0, 0, 0], return_cmd=False):
@@ -338,7 +984,7 @@ class Character_API(UnrealCv_API):
         cmd = f'vbp {obj} set_cam {x} {y} {z} {roll} {pitch} {yaw}'
         if return_cmd:
             return cmd
-        res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
         return res
 
     def adjust_fov(self, cam_id, delta_fov, min_max=[45, 135]):  # increase/decrease fov
@@ -346,7 +992,7 @@ class Character_API(UnrealCv_API):
 
     def stop_car(self, obj):
         cmd = f'vbp {obj} set_stop'
-        res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
         return res
 
     def nav_to_goal(self, obj, loc): # navigate the agent to a goal location
@@ -354,26 +1000,26 @@ class Character_API(UnrealCv_API):
         # The goal should be reachable in the environment.
         x, y, z = loc
         cmd = f'vbp {obj} nav_to_goal {x} {y} {z}'
-        res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
         return res
     def nav_to_goal_bypath(self, obj, loc): # navigate the agent to a goal location
         # Assign the agent a navigation goal, and use Navmesh to automatically control its movement to reach the goal via the shortest path.
         # The goal should be reachable in the environment.
         x, y, z = loc
         cmd = f'vbp {obj} nav_to_goal {x} {y} {z}'
-        res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
         return res
     def nav_to_random(self, obj, radius, loop): # navigate the agent to a random location
         # Agent randomly selects a point within its own radius range for navigation.
         # The loop parameter controls whether continuous navigation is performed.（True for continuous navigation).
         # Return with the randomly sampled location.
         cmd = f'vbp {obj} nav_random {radius} {loop}'
-        res = self.client.request(cmd)
+        res = self.send_cmd(cmd)
         return res
     def nav_to_obj(self, obj, target_obj, distance=200): # navigate the agent to a target object
         # Assign the agent a navigation goal, and use Navmesh to automatically control its movement to reach the goal via the shortest path.
         cmd = f'vbp {obj} nav_to_target {target_obj} {distance}'
-        res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
         return res
 
     def nav_random(self, player, radius, loop): # navigate the agent to a random location
@@ -381,7 +1027,7 @@ class Character_API(UnrealCv_API):
         # The loop parameter controls whether continuous navigation is performed.（True for continuous navigation).
         # Return with the randomly sampled location.
         cmd = f'vbp {player} nav_random {radius} {loop}'
-        res = self.client.request(cmd)
+        res = self.send_cmd(cmd)
         return self.decoder.string2vector(res)
 
     def generate_nav_goal(self, player, radius_max,radius_min):  # navigate the agent to a random location
@@ -389,7 +1035,7 @@ class Character_API(UnrealCv_API):
         # The loop parameter controls whether continuous navigation is performed.（True for continuous navigation).
         # Return with the randomly sampled location.
         cmd = f'vbp {player} generate_nav_goal {radius_max} {radius_min} '
-        res = self.client.request(cmd)
+        res = self.send_cmd(cmd)
         answer_dict = json.loads(res)
         try:
             loc = answer_dict["nav_goal"]
@@ -402,14 +1048,14 @@ class Character_API(UnrealCv_API):
 
     def set_max_nav_speed(self, obj, max_vel): # set the maximum navigation speed of the car
         cmd = f'vbp {obj} set_nav_speed {max_vel}'
-        res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
         return res
 
     def enter_exit_car(self, obj, player_index):
         # enter or exit the car for a player.
         # If the player is already in the car, it will exit the car. Otherwise, it will enter the car.
         cmd = f'vbp {obj} enter_exit_car {player_index}'
-        res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
         return res
 
     def set_open_door(self, player, state, return_cmd=False):
@@ -418,26 +1064,26 @@ class Character_API(UnrealCv_API):
         if return_cmd:
             return cmd
         else:
-            self.client.request(cmd, -1)
+            self.send_cmd(cmd, async_mode=True)
     def carry_body(self,player,return_cmd=False):
         cmd = f'vbp {player} carry_body'
         if return_cmd:
             return cmd
         else:
-            self.client.request(cmd, -1)
+            self.send_cmd(cmd, async_mode=True)
 
     def drop_body(self,player,return_cmd=False):
         cmd = f'vbp {player} drop_body'
         if return_cmd:
             return cmd
         else:
-            self.client.request(cmd, -1)
+            self.send_cmd(cmd, async_mode=True)
     def Is_picked(self,player,return_cmd = False):
         cmd = f'vbp {player} is_picked'
         if return_cmd:
             return cmd
         else:
-            res = self.client.request(cmd)
+            res = self.send_cmd(cmd)
             if '1' in res:
                 return True
             if '0' in res:
@@ -447,7 +1093,7 @@ class Character_API(UnrealCv_API):
         if return_cmd:
             return cmd
         else:
-            res = self.client.request(cmd)
+            res = self.send_cmd(cmd)
             if '1' in res:
                 return True
             if '0' in res:
@@ -456,70 +1102,281 @@ class Character_API(UnrealCv_API):
     def set_viewport(self, player):
         # set the game window to the player's view
         cmd = f'vbp {player} set_viewport'
-        res = self.client.request(cmd, -1)
+        res = self.send_cmd(cmd, async_mode=True)
         return res
 
-    def get_pose_img_batch(self, objs_list, cam_ids, img_flag=[False, True, False, False]):
+    def get_pose_img_batch(self, objs_list, cam_ids, img_flag=[False, True, False, False], action_cmds=None, img_out=None):
         # get pose and image of objects in objs_list from cameras in cam_ids
+        # action_cmds: the commands (e.g. set_move) sent ahead of the queries in the same batch, their replies are dropped
+        # img_out: {'Color': [...], 'Mask': [...], 'Depth': [...]}, the destinations (H, W, C) of the images of each camera,
+        #          e.g. the slots of the observation buffer, the images are decoded into them directly
+        # img_flag: the flags of all cameras, or a list of the flags of each camera (the image lists are then aligned with
+        #           cam_ids, None for the modalities a camera does not capture)
+        if action_cmds is None:
+            action_cmds = []
+        if img_out is None:
+            img_out = dict()
+        plan = self.get_capture_plan(objs_list, cam_ids, img_flag)
+        cmd_list, decoders = plan.cmds, plan.bind(img_out, self.get_img_out)
+        if self.img_client is None and self.can_stream(action_cmds + cmd_list):
+            # one round trip, each reply is decoded as it arrives and the replies of the actions are dropped
+            res_list = self.batch_cmd_stream(action_cmds + cmd_list, [None] * len(action_cmds) + decoders)[len(action_cmds):]
+            return self.parse_pose_img_batch(res_list, plan, img_out)
+        if self.img_client is None:
+            # one round trip for the actions and the queries, only the replies of the queries are decoded
+            res_list = self.batch_cmd(action_cmds + cmd_list, None)[len(action_cmds):]
+        else:
+            res_list = self.request_split(action_cmds, cmd_list)
+        self.record_img_link(sum(len(res) for res in res_list if isinstance(res, bytes)))
+        res_list = self.decode_batch(res_list, decoders)
+        return self.parse_pose_img_batch(res_list, plan, img_out)
+
+    def get_capture_plan(self, objs_list, cam_ids, img_flag):
+        """
+        Get the compiled commands of get_pose_img_batch, the plan is reused until the objects, cameras or flags change,
+        e.g. add_agent / remove_agent in the env. The adaptive encoding picks the formats every step, so it is not reused.
+
+        Args:
+            objs_list (list): The objects to get the poses.
+            cam_ids (list): The cameras to capture, -1 for the agent without camera.
+            img_flag (list): [use_cam_pose, use_color, use_mask, use_depth], or a list of the flags of each camera.
+
+        Returns:
+            CapturePlan: The plan.
+        """
+        img_flag = tuple(tuple(flag) if isinstance(flag, (list, tuple)) else flag for flag in img_flag)
+        key = (tuple(objs_list), tuple(cam_ids), img_flag, self.capture_dir)
+        if self.capture_plan is None or self.capture_plan.key != key or self.img_encoding is not None:
+            self.capture_plan = self.compile_capture_plan(key)
+        return self.capture_plan
+
+    def invalidate_capture_plan(self):
+        self.capture_plan = None
+
+    def get_cam_flags(self, img_flag, num):
+        # the flags of each camera, and whether they are given per camera
+        if len(img_flag) > 0 and isinstance(img_flag[0], (list, tuple)):
+            return list(img_flag), True
+        return [img_flag] * num, False
+
+    def compile_capture_plan(self, key):
+        # build the query commands, the decoders and the positions of the replies of get_pose_img_batch
+        objs_list, cam_ids, img_flag, _ = key
         cmd_list = []
-        decoder_list = []
-        [use_cam_pose, use_color, use_mask, use_depth] = img_flag
+        decoders = []
+        img_specs = []
+        cam_specs = []
+        cam_flags, _ = self.get_cam_flags(img_flag, len(cam_ids))
         for obj in objs_list:
             cmd_list.extend([self.get_obj_location(obj, True),
                              self.get_obj_rotation(obj, True)])
+            decoders.extend([str, str])  # the pose replies are parsed at once into the pose array
 
-        for cam_id in cam_ids:
+        for i, (cam_id, flag) in enumerate(zip(cam_ids, cam_flags)):
             if cam_id < 0:
+                cam_specs.append(None)
                 continue
+            [use_cam_pose, use_color, use_mask, use_depth] = flag
+            spec = dict()
             if use_cam_pose:
+                spec['cam_pose'] = len(cmd_list)
                 cmd_list.extend([self.get_cam_location(cam_id, return_cmd=True),
                                  self.get_cam_rotation(cam_id, return_cmd=True)])
-            if use_color:
-                cmd_list.append(self.get_image(cam_id, 'lit', 'bmp', return_cmd=True))
-            if use_mask:
-                cmd_list.append(self.get_image(cam_id, 'object_mask', 'bmp', return_cmd=True))
-            if use_depth:
-                cmd_list.append(f'vget /camera/{cam_id}/depth npy')
-                # cmd_list.append(self.get_image(cam_id, 'depth', 'bmp', return_cmd=True))
-
-        decoders = [self.decoder.decode_map[self.decoder.cmd2key(cmd)] for cmd in cmd_list]
-        res_list = self.batch_cmd(cmd_list, decoders)
-        obj_pose_list = []
+                decoders.extend([self.decoder.string2floats, self.decoder.string2floats])
+            for flag, modality, viewmode in zip([use_color, use_mask, use_depth], ['Color', 'Mask', 'Depth'], ['lit', 'object_mask', 'depth']):
+                if flag:
+                    spec[viewmode] = len(cmd_list)
+                    cmd_list.append(self.get_img_cmd(cam_id, viewmode))
+                    decoders.append(None)  # bound to the destination of the step, see CapturePlan.bind
+                    img_specs.append((spec[viewmode], modality, i, cam_id, viewmode, self.get_img_decoder_factory(cmd_list[-1])))
+            cam_specs.append(spec)
+        return CapturePlan(key, cmd_list, decoders, img_specs, cam_specs)
+
+    def parse_pose_img_batch(self, res_list, plan, img_out):
+        # split the decoded replies of get_pose_img_batch into poses and images by the positions in the plan
+        # the object poses are a read-only float32 (N, 6) array, shared by the env, the wrappers and the agents
+        objs_list, cam_ids, img_flag = plan.key[:3]
+        cam_flags, per_cam = self.get_cam_flags(img_flag, len(cam_ids))
+        obj_poses = self.decode_poses(res_list[:2 * len(objs_list)])
         cam_pose_list = []
         img_list = []
         mask_list = []
         depth_list = []
-        # start to read results
-        start_point = 0
-        for i, obj in enumerate(objs_list):
-            obj_pose_list.append(res_list[start_point] + res_list[start_point+1])
-            start_point += 2
-        for i, cam_id in enumerate(cam_ids):
-            # print(cam_id)
-            if cam_id < 0:
-                img_list.append(np.zeros((self.resolution[1], self.resolution[0], 3), dtype=np.uint8))
+        self.pose_snapshot = dict(zip(objs_list, obj_poses))
+        for i, (cam_id, spec, flag) in enumerate(zip(cam_ids, plan.cam_specs, cam_flags)):
+            if spec is None:
+                for modality in img_out.keys():  # clean the slots of the agent without camera
+                    out = self.get_img_out(img_out, modality, i, cam_id, None)
+                    if out is not None:
+                        out[...] = 0
+                if per_cam:
+                    for out_list in [cam_pose_list, img_list, mask_list, depth_list]:
+                        out_list.append(None)
+                    continue
+                # blank images keep the lists aligned with the cameras
+                img_list.append(self.get_blank_img(img_out, 'Color', i, 3, np.uint8))
+                if flag[2]:
+                    mask_list.append(self.get_blank_img(img_out, 'Mask', i, 3, np.uint8))
+                if flag[3]:
+                    depth_list.append(self.get_blank_img(img_out, 'Depth', i, 1, np.float32))
                 continue
-            if use_cam_pose:
-                cam_pose_list.append(res_list[start_point] + res_list[start_point+1])
-                start_point += 2
-            if use_color:
-                # image = self.decoder.decode_bmp(res_list[start_point])
-                img_list.append(res_list[start_point])
-                start_point += 1
-            if use_mask:
-                # image = self.decoder.decode_bmp(res_list[start_point])
-                mask_list.append(res_list[start_point])
-                start_point += 1
-            if use_depth:
-                # image = 1 / self.decoder.decode_depth(res_list[start_point],bytesio=False)
-                # image = self.decoder.decode_depth(res_list[start_point],bytesio=False)
-                image = self.get_depth(cam_id,show=False)
-                image = np.expand_dims(image, axis=-1)
-                depth_list.append(image)  # 500 is the default max depth of most depth cameras
-                # depth_list.append(res_list[start_point])  # 500 is the default max depth of most depth cameras
-                start_point += 1
-
-        return obj_pose_list, cam_pose_list, img_list, mask_list, depth_list
+            if 'cam_pose' in spec:
+                cam_pose_list.append(res_list[spec['cam_pose']] + res_list[spec['cam_pose'] + 1])
+            elif per_cam:
+                cam_pose_list.append(None)
+            if 'lit' in spec:
+                img_list.append(res_list[spec['lit']])
+            elif per_cam:
+                img_list.append(None)
+            if 'object_mask' in spec:
+                mask_list.append(res_list[spec['object_mask']])
+            elif per_cam:
+                mask_list.append(None)
+            if 'depth' in spec:
+                # the depth reply in the batch is decoded in place, no extra request for each camera
+                depth_list.append(self.expand_depth(res_list[spec['depth']]))
+            elif per_cam:
+                depth_list.append(None)
+
+        return obj_poses, cam_pose_list, img_list, mask_list, depth_list
+
+    def get_blank_img(self, img_out, modality, index, channels, dtype):
+        # the image of the agent without camera: its (cleaned) slot, or a new blank image
+        slots = img_out.get(modality)
+        if slots is not None and index < len(slots):
+            return slots[index]
+        return np.zeros((self.resolution[1], self.resolution[0], channels), dtype=dtype)
+
+    def decode_poses(self, res_list):
+        """
+        Parse the location and rotation replies of the objects into one array.
+
+        Args:
+            res_list (list): The replies 'x y z' and 'roll yaw pitch' of each object, in turn.
+
+        Returns:
+            np.ndarray: The read-only float32 (N, 6) poses [x, y, z, roll, yaw, pitch].
+        """
+        poses = np.array(' '.join(res_list).split(), dtype=np.float32).reshape(-1, 6)
+        poses.flags.writeable = False
+        return poses
+
+    def open_img_client(self):
+        """
+        Open a second connection to the server dedicated to the image capture, so the large image replies do not
+        delay the control commands. If the server only accepts one client, the images keep sharing the control connection.
+
+        Returns:
+            bool: Whether the image connection is opened.
+        """
+        if self.img_client is not None:
+            return True
+        if self.trace_writer is not None:  # the image traffic is recorded as well, to be replayed
+            client = RecordingClient((self.ip, self.port), self.trace_writer, image=True)
+        else:
+            client = unrealcv.Client((self.ip, self.port))
+        if not client.connect():
+            warnings.warn('The UnrealCV server rejects the image connection, the images are fetched on the control connection')
+            return False
+        self.img_client = client
+        self.ctrl_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='unrealcv_control')
+        return True
+
+    def close_img_client(self):
+        if self.img_client is not None:
+            self.ctrl_executor.shutdown(wait=True)
+            self.img_client.disconnect()
+            self.img_client = None
+            self.ctrl_executor = None
+
+    def is_img_cmd(self, cmd):
+        return '_shared' in cmd or cmd.split(' ')[-1] in ['bmp', 'png', 'jpg', 'npy']
+
+    def request_split(self, action_cmds, cmd_list):
+        # the actions are sent first on the control connection, then the pose queries (control connection)
+        # and the images (image connection) are fetched concurrently, the replies are merged in the order of cmd_list
+        self.flush_cmds()
+        self.invalidate_pose_snapshot(action_cmds)
+        if len(action_cmds) > 0:
+            self.stats.record(action_cmds)
+            self.send_async(action_cmds)
+        img_ids = [i for i, cmd in enumerate(cmd_list) if self.is_img_cmd(cmd)]
+        ctrl_ids = [i for i, cmd in enumerate(cmd_list) if not self.is_img_cmd(cmd)]
+        future = self.ctrl_executor.submit(self.batch_cmd, [cmd_list[i] for i in ctrl_ids], None)
+        start = time.perf_counter()
+        img_cmds = [cmd_list[i] for i in img_ids]
+        try:
+            img_res = self.timed_request(self.img_client, img_cmds, self.request_timeout) if len(img_ids) > 0 else []
+        except UnrealCvTimeoutError:
+            self.close_img_client()  # the late replies are dropped with the connection
+            self.open_img_client()
+            raise
+        self.latency['image'].append(time.perf_counter() - start)
+        self.stats.record(img_cmds, img_res, self.latency['image'][-1])
+        res_list = [None] * len(cmd_list)
+        for i, res in zip(ctrl_ids, future.result()):
+            res_list[i] = res
+        for i, res in zip(img_ids, img_res):
+            res_list[i] = res
+        return res_list
+
+    def get_latency(self):
+        """
+        Get the mean round trip time of the recent requests on each connection.
+
+        Returns:
+            dict: connection ('control' or 'image') -> latency in seconds, None if there is no request.
+        """
+        return {channel: (float(np.mean(times)) if len(times) > 0 else None) for channel, times in self.latency.items()}
+
+    def set_decode_workers(self, num):
+        """
+        Set the number of threads to decode the images of a batch concurrently.
+        The decoders (numpy copy, PIL, cv2) release the GIL, so the images of multiple cameras are decoded in parallel.
+
+        Args:
+            num (int): The number of threads, 0 to decode in the calling thread.
+        """
+        if self.decode_pool is not None:
+            self.decode_pool.shutdown(wait=True)
+            self.decode_pool = None
+        self.decode_workers = num
+        if num > 0:
+            self.decode_pool = ThreadPoolExecutor(max_workers=num, thread_name_prefix='unrealcv_decode')
+
+    def decode_batch(self, res_list, decoders):
+        """
+        Decode the replies of a batch, the images are decoded by the worker pool if it is set.
+
+        Args:
+            res_list (list): The replies.
+            decoders (list): The decoder of each reply.
+
+        Returns:
+            list: The decoded results, in the order of the replies.
+        """
+        if self.decode_pool is None:
+            return [decoder(res) for decoder, res in zip(decoders, res_list)]
+        img_ids = [i for i, res in enumerate(res_list) if isinstance(res, bytes)]  # the binary replies are images
+        futures = [self.decode_pool.submit(decoders[i], res_list[i]) for i in img_ids]
+        results = [res if isinstance(res, bytes) else decoder(res) for decoder, res in zip(decoders, res_list)]  # text replies
+        for i, future in zip(img_ids, futures):
+            results[i] = future.result()
+        return results
+
+    def get_img_out(self, img_out, modality, index, cam_id, viewmode):
+        # the destination of the image: the given slot, the reusable buffer of the camera, or None (new array)
+        slots = img_out.get(modality)
+        if slots is not None and index < len(slots):
+            return slots[index]
+        if cam_id < 0:
+            return None
+        return self.get_img_buffer(cam_id, viewmode)
+
+    def expand_depth(self, depth):  # make sure the depth image is in shape (H, W, 1)
+        if depth.ndim == 2:
+            depth = np.expand_dims(depth, axis=-1)
+        return depth
 
     # Domain Randomization Functions: randomize texture
     def set_texture(self, player, color=(1, 1, 1), param=(0, 0, 0), picpath=None, tiling=1, e_num=0): #[r, g, b, meta, spec, rough, tiling, picpath]
@@ -527,14 +1384,14 @@ class Character_API(UnrealCv_API):
         r, g, b = color
         meta, spec, rough = param
         cmd = f'vbp {player} set_mat {e_num} {r} {g} {b} {meta} {spec} {rough} {tiling} {picpath}'
-        self.client.request(cmd, -1)
+        self.send_cmd(cmd, async_mode=True)
 
     def set_light(self, obj, direction, intensity, color): # param num out of range
         [roll, yaw, pitch] = direction
         color = color / color.max()
         [r, g, b] = color
         cmd = f'vbp {obj} set_light {roll} {yaw} {pitch} {intensity} {r} {g} {b}'
-        self.client.request(cmd, -1)
+        self.send_cmd(cmd, async_mode=True)
 
     def random_texture(self, backgrounds, img_dirs, num=5):
         if num < 0:
@@ -545,7 +1402,6 @@ class Character_API(UnrealCv_API):
             obj = backgrounds[id]
             img_dir = img_dirs[np.random.randint(0, len(img_dirs))]
             self.set_texture(obj, (1, 1, 1), np.random.uniform(0, 1, 3), img_dir, np.random.randint(1, 4))
-            time.sleep(0.03)
 
     def random_player_texture(self, player, img_dirs, num):
         sample_index = np.random.choice(5, num)
@@ -553,7 +1409,6 @@ class Character_API(UnrealCv_API):
             img_dir = img_dirs[np.random.randint(0, len(img_dirs))]
             self.set_texture(player, (1, 1, 1), np.random.uniform(0, 1, 3),
                              img_dir, np.random.randint(2, 6), id)
-            time.sleep(0.03)
 
     def random_character(self, player):  # appearance, speed, acceleration
         self.set_max_speed(player, np.random.randint(40, 100))
@@ -576,11 +1431,11 @@ class Character_API(UnrealCv_API):
     def set_skylight(self, obj, color, intensity): # param num out of range
         [r, g, b] = color
         cmd = f'vbp {obj} set_light {r} {g} {b} {intensity}'
-        self.client.request(cmd, -1)
+        self.send_cmd(cmd, async_mode=True)
 
     def get_obj_speed(self,obj):
         cmd = f'vbp {obj} get_speed'
-        res = self.client.request(cmd)
+        res = self.send_cmd(cmd)
         answer_dict = json.loads(res)
         speed = float(answer_dict["Speed"])
 
@@ -593,67 +1448,212 @@ class Character_API(UnrealCv_API):
     def read_image(self, cam_id, viewmode, mode='direct'):
             # cam_id:0 1 2 ...
             # viewmode:lit,  =normal, depth, object_mask
-            # mode: direct, file
+            # mode: direct, file, fast, mmap
             res = None
             if mode == 'direct': # get image from unrealcv in png format
                 cmd = f'vget /camera/{cam_id}/{viewmode} png'
-                image = self.decode_png(self.client.request(cmd))
+                image = self.decode_png(self.send_cmd(cmd))
 
             elif mode == 'file': # save image to file and read it
                 cmd = f'vget /camera/{cam_id}/{viewmode} {viewmode}{self.ip}.png'
-                if self.docker:
-                    img_dirs_docker = self.client.request(cmd)
-                    img_dirs = self.envdir + img_dirs_docker[7:]
-                else :
-                    img_dirs = self.client.request(cmd)
+                img_dirs = self.translate_path(self.send_cmd(cmd))
                 image = cv2.imread(img_dirs)
+            elif mode == 'mmap': # capture the raw frame into capture_dir and map it, the pixels are not sent over the socket
+                assert self.capture_dir is not None, 'Call set_capture_dir before reading the images in mmap mode'
+                cmd = self.get_img_cmd(cam_id, viewmode)
+                image = self.get_img_decoder(cmd)(self.send_cmd(cmd))
             elif mode == 'fast': # get image from unrealcv in bmp format
                 cmd = f'vget /camera/{cam_id}/{viewmode} bmp'
-                image = self.decode_bmp(self.client.request(cmd))
+                image = self.decode_bmp(self.send_cmd(cmd))
             return image
 
+    def set_capture_dir(self, capture_dir, envdir=None, docker_dir='/UnrealEnv'):
+        """
+        Capture the frames of the batch into raw bmp/npy files in a local directory (e.g. on tmpfs), the client maps
+        them with np.memmap instead of receiving the pixels over the socket. UE must run on the same host.
+
+        Args:
+            capture_dir (str): The directory on the host, None to send the frames over the socket.
+            envdir (str, optional): The host directory mounted as docker_dir if UE runs in docker, it must contain capture_dir.
+            docker_dir (str): The mount point of envdir in docker.
+        """
+        if capture_dir is None:
+            self.capture_dir = None
+            self.docker_dir = None
+            return
+        capture_dir = os.path.abspath(capture_dir)
+        os.makedirs(capture_dir, exist_ok=True)
+        if envdir is None:
+            self.capture_dir = capture_dir
+            self.docker_dir = None
+        else:
+            envdir = os.path.abspath(envdir)
+            assert capture_dir.startswith(envdir), f'{capture_dir} is not visible in docker, it should be in {envdir}'
+            self.capture_dir = docker_dir + capture_dir[len(envdir):]
+            self.docker_dir = (docker_dir, envdir)
+
+    def translate_path(self, path):  # map the path written by UE in docker to the host
+        if self.docker_dir is not None and path.startswith(self.docker_dir[0]):
+            return self.docker_dir[1] + path[len(self.docker_dir[0]):]
+        return path
+
+    def get_img_cmd(self, cam_id, viewmode):
+        # the image command of a batch: capture to a file in capture_dir if it is set, otherwise bmp (npy for depth)
+        # or the format chosen by img_encoding
+        mode = 'npy' if viewmode == 'depth' else 'bmp'
+        if self.capture_dir is not None:
+            return f'vget /camera/{cam_id}/{viewmode} {self.capture_dir}/{viewmode}_{self.port}_{cam_id}.{mode}'
+        if viewmode == 'depth':
+            return f'vget /camera/{cam_id}/depth npy'
+        if self.img_encoding is not None:
+            return f'vget /camera/{cam_id}/{viewmode} {self.img_encoding.select(cam_id, viewmode)}'
+        return self.get_image(cam_id, viewmode, mode, return_cmd=True)
+
+    def set_adaptive_encoding(self, enable=True, lossy=False, probe_interval=200):
+        """
+        Choose bmp or png (or jpg for lit if lossy) for each camera and view mode by the measured link throughput,
+        reply sizes and decoding time, e.g. png saves the bandwidth when UE runs on another node. The masks stay lossless.
+
+        Args:
+            enable (bool): Enable the adaptive encoding, False to always request bmp.
+            lossy (bool): Allow jpg for the lit images, the server must support it.
+            probe_interval (int): Try the other formats of a camera every probe_interval captures.
+        """
+        self.img_encoding = EncodingSelector(lossy, probe_interval) if enable else None
+
+    def record_img_link(self, nbytes):
+        # measure the link throughput by the size of the image replies of the last batch
+        if self.img_encoding is not None:
+            latency = self.latency['image' if self.img_client is not None else 'control']
+            if len(latency) > 0:
+                self.img_encoding.record_link(nbytes, latency[-1])
+
+    def get_adaptive_decoder(self, cmd, fmt, out=None):
+        # the decoder of an image in the format chosen by img_encoding, it records the reply size and the decoding time
+        _, _, cam_id, viewmode = cmd.split(' ')[1].split('/')
+        decode = self.decode_bmp if fmt == 'bmp' else self.decode_compressed
+
+        def decoder(res):
+            if not isinstance(res, bytes):  # the server can not encode the format
+                if fmt != 'bmp':
+                    warnings.warn(f'The server does not support {fmt} images: {res}')
+                    self.img_encoding.set_unsupported(fmt)
+                return out if out is not None else np.zeros((self.resolution[1], self.resolution[0], 3), dtype=np.uint8)
+            start = time.perf_counter()
+            img = decode(res, out=out)
+            self.img_encoding.record(int(cam_id), viewmode, fmt, len(res), time.perf_counter() - start)
+            return img
+        return decoder
+
+    def is_capture_cmd(self, cmd):
+        return isinstance(cmd, str) and cmd.startswith('vget /camera/') and cmd.endswith(('.bmp', '.npy'))
+
+    def read_capture(self, path):
+        # map the frame written by UE, the decoder copies the pixels out, so the file can be overwritten in the next step
+        return np.memmap(self.translate_path(path.strip()), dtype=np.uint8, mode='r')
+
     def decode_png(self, res):  # decode png image
         img = np.asarray(PIL.Image.open(BytesIO(res)))
         img = img[:, :, :-1]  # delete alpha channel
         img = img[:, :, ::-1]  # transpose channel order
         return img
 
-    def decode_bmp(self, res, channel=4):  # decode bmp image
-        img = np.fromstring(res, dtype=np.uint8)
-        img = img[-self.resolution[1] * self.resolution[0] * channel:]
+    def decode_compressed(self, res, out=None):  # decode png/jpg image into BGR
+        img = np.asarray(PIL.Image.open(BytesIO(res)))
+        img = img[:, :, 2::-1]  # delete alpha channel and transpose channel order
+        if out is None:
+            return np.ascontiguousarray(img)
+        np.copyto(out, img, casting='unsafe')
+        return out
+
+    def decode_bmp(self, res, channel=4, out=None):  # decode bmp image
+        # view the pixels at the end of the reply without copying, and copy the color channels into out in one pass
+        size = self.resolution[1] * self.resolution[0] * channel
+        img = np.frombuffer(res, dtype=np.uint8, count=size, offset=len(res) - size)
         img = img.reshape(self.resolution[1], self.resolution[0], channel)
-        return img[:, :, :-1]  # delete alpha channel
-
-    def decode_depth(self, res):  # decode depth image
-        depth = np.fromstring(res, np.float32)
-        depth = depth[-self.resolution[1] * self.resolution[0]:]
+        if out is None:
+            out = np.empty((self.resolution[1], self.resolution[0], channel - 1), dtype=np.uint8)
+        np.copyto(out, img[:, :, :-1], casting='unsafe')  # delete alpha channel
+        return out
+
+    def decode_depth(self, res, out=None):  # decode depth image
+        size = self.resolution[1] * self.resolution[0]
+        depth = np.frombuffer(res, dtype=np.float32, count=size, offset=len(res) - size * 4)
         depth = depth.reshape(self.resolution[1], self.resolution[0], 1)
-        return depth
+        if out is None:
+            out = np.empty((self.resolution[1], self.resolution[0], 1), dtype=np.float32)
+        np.copyto(out, misc.cast_img(depth, out.dtype), casting='unsafe')  # e.g. the uint16 slot of the compact observation
+        return out
+
+    def get_img_buffer(self, cam_id, viewmode):
+        """
+        Get the reusable output buffer of a camera for decoding.
+
+        Args:
+            cam_id (int): The ID of the camera.
+            viewmode (str): 'lit', 'object_mask' or 'depth'.
+
+        Returns:
+            np.ndarray: The buffer (H, W, C), None if the buffers are not reused.
+        """
+        if not self.reuse_img_buffer:
+            return None
+        if viewmode == 'depth':
+            shape, dtype = (self.resolution[1], self.resolution[0], 1), np.float32
+        else:
+            shape, dtype = (self.resolution[1], self.resolution[0], 3), np.uint8
+        buffer = self.img_buffers.get((cam_id, viewmode))
+        if buffer is None or buffer.shape != shape:
+            buffer = np.zeros(shape, dtype=dtype)
+            self.img_buffers[(cam_id, viewmode)] = buffer
+        return buffer
+
+    def get_img_decoder(self, cmd, out=None):
+        """
+        Get the decoder of an image command, which writes the image into out.
+
+        Args:
+            cmd (str): The image command.
+            out (np.ndarray): The destination of the image, e.g. a slot of the observation buffer.
+
+        Returns:
+            function: The decoder.
+        """
+        return self.get_img_decoder_factory(cmd)(out)
+
+    def get_img_decoder_factory(self, cmd):
+        # parse the image command once, the returned function binds the destination: factory(out) -> decoder
+        if self.is_capture_cmd(cmd):  # the reply is the path of the frame
+            decode = self.decode_depth if cmd.endswith('.npy') else self.decode_bmp
+            return lambda out: (lambda res: decode(self.read_capture(res), out=out))
+        key = self.decoder.cmd2key(cmd)
+        if self.img_encoding is not None and key in ['bmp', 'png', 'jpg'] and '_shared' not in cmd:
+            return lambda out: self.get_adaptive_decoder(cmd, key, out)
+        if '_shared' in cmd:  # the shared-memory capture is re-encoded by the client, use the generic decoder
+            decoder = self.decoder.decode_map[key]
+            return lambda out: decoder if out is None else (lambda res: self.copy_img(decoder(res), out))
+        if key == 'npy':
+            return lambda out: functools.partial(self.decode_depth, out=out)
+        elif key == 'bmp':
+            return lambda out: functools.partial(self.decode_bmp, out=out)
+        decoder = self.decoder.decode_map[key]
+        return lambda out: decoder
+
+    def copy_img(self, img, out):
+        if img.ndim == 2:
+            img = np.expand_dims(img, axis=-1)
+        np.copyto(out, img, casting='unsafe')
+        return out
+
     def set_location(self, cam_id, loc):  # set camera location, loc=[x,y,z]
         [x, y, z] = loc
         cmd = f'vset /camera/{cam_id}/location {x} {y} {z}'
-        self.client.request(cmd, -1)
+        self.send_cmd(cmd, async_mode=True)
         self.cam[cam_id]['location'] = loc
-    def get_pose_states(self, obj_pos):
+    def get_pose_states(self, obj_pos, rows=None):
         # get the relative pose of each agent and the absolute location and orientation of the agent
-        pose_obs = []
-        player_num = len(obj_pos)
-        np.zeros((player_num, player_num, 2))
-        relative_pose = np.zeros((player_num, player_num, 2))
-        for j in range(player_num):
-            vectors = []
-            for i in range(player_num):
-                obs, distance, direction = self.get_relative(obj_pos[j], obj_pos[i])
-                yaw = obj_pos[j][4]/180*np.pi
-                # rescale the absolute location and orientation
-                abs_loc = [obj_pos[i][0], obj_pos[i][1],
-                           obj_pos[i][2], np.cos(yaw), np.sin(yaw)]
-                obs = obs + abs_loc
-                vectors.append(obs)
-                relative_pose[j, i] = np.array([distance, direction])
-            pose_obs.append(vectors)
-
-        return np.array(pose_obs), relative_pose
+        # rows: only compute the rows of these agents (e.g. [tracker_id]), the other rows are NaN, see misc.get_pose_states
+        return misc.get_pose_states(obj_pos, rows)
     def get_relative(self, pose0, pose1):  # pose0-centric
         """
         Get the relative pose between two objects, pose0 is the reference object.
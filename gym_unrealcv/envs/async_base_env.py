@@ -0,0 +1,152 @@
+import asyncio
+import time
+from gym_unrealcv.envs.base_env import UnrealCv_base
+from gym_unrealcv.envs.agent.async_character import AsyncCharacter_API
+
+
+class AsyncUnrealCv_base(UnrealCv_base):
+    """
+    The asyncio version of UnrealCv_base, reset and step are coroutines on top of AsyncCharacter_API.
+    A single process (one event loop) can drive many UE instances concurrently, e.g.
+        obs = await asyncio.gather(*[env.reset() for env in envs])
+        results = await asyncio.gather(*[env.step(actions) for env, actions in zip(envs, batch_actions)])
+    The task envs (Track, Navigation, ...) can not be mixed in: their reset and step_wait query UnrealCV with the
+    blocking calls (e.g. check_visibility, get_hit), which return awaitables here, so only the base env is supported.
+    The gym wrappers are synchronous, wrap the async env only with the wrappers that do not query UnrealCV.
+    """
+    def __init__(self, *args, **kwargs):
+        if type(self).step_wait is not UnrealCv_base.step_wait or type(self).reset is not AsyncUnrealCv_base.reset:
+            raise NotImplementedError(f'{type(self).__name__} overrides the blocking reset/step_wait of a task env, '
+                                      f'only the base env runs on AsyncCharacter_API')
+        super(AsyncUnrealCv_base, self).__init__(*args, **kwargs)
+
+    async def reset(self):
+        """
+        Reset the environment to its initial state.
+
+        Returns:
+            np.array: Initial observations.
+        """
+        if len(self.pending_steps) > 0:  # drop the ticks in flight
+            await asyncio.wait([future for future, state in self.pending_steps])
+            self.pending_steps.clear()
+        if not self.launched:  # first time to launch
+            self.launched = await self.launch_ue_env()
+            await self.init_agents()
+            await self.init_objects()
+
+        self.reset_agents()
+        # get state
+        observations, self.obj_poses, self.img_show = await self.update_observation(self.player_list, self.cam_list, self.cam_flag, self.observation_type)
+        self.unrealcv.flush_cmds()
+
+        return observations
+
+    async def step(self, actions):
+        """
+        Execute one step in the environment, other envs run while waiting for the replies.
+        The actions are held for frame_skip ticks (paced by tick_time) as in UnrealCv_base.step.
+
+        Args:
+            actions (list): List of actions to be performed by the agents.
+
+        Returns:
+            tuple: Observations, rewards, done flag, and additional info.
+        """
+        if len(self.pending_steps) > 0:
+            raise RuntimeError('step is called with ticks in flight, await step_done first.')
+        results = None
+        start = time.perf_counter()
+        for tick in range(self.frame_skip):
+            last = tick == self.frame_skip - 1
+            if tick > 0 and self.tick_time:
+                await asyncio.sleep(max(start + tick * self.tick_time - time.perf_counter(), 0))
+            results = self.merge_tick(results, await self.step_tick(actions, capture=last, hold=tick > 0))
+            if results[2] and not last:  # done in a skipped tick, capture its observation
+                observations, self.obj_poses, self.img_show = await self.update_observation(self.player_list, self.cam_list, self.cam_flag, self.observation_type)
+                return (observations,) + results[1:]
+        return results
+
+    async def step_tick(self, actions, capture=True, hold=False):
+        self.step_async(actions, capture, hold)
+        return await self.step_done()
+
+    def step_async(self, actions, capture=True, hold=False):
+        """
+        Send the actions and the capture request of one tick, and return at once.
+        The replies are received by the event loop while the caller runs, await step_done to get the results.
+        With pipeline_depth = 2, the next tick can be sent before step_done of the current one, as in UnrealCv_base.step_async,
+        it is sent after the replies of the ticks ahead of it.
+
+        Args:
+            actions (list): List of actions to be performed by the agents.
+            capture (bool): Capture the images, False to query the poses only (the observation is None).
+            hold (bool): The actions are held from the previous tick, only the move commands are sent again.
+        """
+        if len(self.pending_steps) >= self.pipeline_depth:
+            raise RuntimeError(f'step_async is called with {len(self.pending_steps)} ticks in flight, '
+                               f'await step_done first (pipeline_depth={self.pipeline_depth}).')
+        action_cmds, capture_cams, capture_flag = self.prepare_step(actions, capture, hold)
+        previous = self.pending_steps[-1][0] if len(self.pending_steps) > 0 else None
+        future = asyncio.ensure_future(self.send_tick(previous, action_cmds, list(self.player_list), capture_cams,
+                                                      capture_flag, self.step_obs_slots[1]))
+        self.pending_steps.append((future, self.get_step_state()))
+
+    async def send_tick(self, previous, *args):
+        # the ticks are sent in order, a tick waits for the replies of the tick ahead of it
+        if previous is not None:
+            await asyncio.wait([previous])
+        return await self.send_step_cmds(*args)
+
+    async def step_done(self):
+        """
+        Wait for the replies of the oldest tick sent by step_async.
+
+        Returns:
+            tuple: Observations, rewards, done flag, and additional info.
+        """
+        if len(self.pending_steps) == 0:
+            raise RuntimeError('step_done is called without step_async.')
+        await asyncio.wait([self.pending_steps[0][0]])
+        return self.step_wait()
+
+    async def send_step_cmds(self, action_cmds, player_list, cam_list, cam_flag, img_out=None):
+        if self.merge_step_cmds:  # a single round trip, the replies of the action commands are dropped
+            return await self.unrealcv.get_pose_img_batch(player_list, cam_list, cam_flag, action_cmds, img_out=img_out)
+        await self.unrealcv.batch_cmd(action_cmds, None)
+        return await self.unrealcv.get_pose_img_batch(player_list, cam_list, cam_flag, img_out=img_out)
+
+    async def update_observation(self, player_list, cam_list, cam_flag, observation_type):
+        capture_cams, capture_flag, obs_types, self.obs_index = self.get_capture_spec(player_list, cam_list, cam_flag, observation_type)
+        obs_slots = self.prepare_obs_slots(observation_type, capture_cams, obs_types)
+        obj_poses, cam_poses, imgs, masks, depths = await self.unrealcv.get_pose_img_batch(player_list, capture_cams, capture_flag, img_out=obs_slots[1])
+        observations = self.prepare_observation(observation_type, imgs, masks, depths, obj_poses, obs_slots, obs_types, self.obs_index)
+        img_show = self.prepare_img2show(self.protagonist_id, observations)
+        return observations, obj_poses, img_show
+
+    async def launch_ue_env(self):
+        # start the server (the mock, the replay or the UE binary) in a thread, the other envs keep running
+        env_ip, env_port, comm_mode = await asyncio.get_event_loop().run_in_executor(None, self.start_ue_env)
+
+        # connect to UnrealCV Server
+        self.unrealcv = AsyncCharacter_API(port=env_port, ip=env_ip, resolution=self.resolution, comm_mode=comm_mode)
+        await self.unrealcv.connect()
+        self.config_unrealcv()
+        await self.unrealcv.set_map(self.env_name)
+        return True
+
+    async def init_agents(self):
+        for obj in self.player_list.copy():  # the agent will be fully removed in self.agents
+            if self.agents[obj]['agent_type'] not in self.agents_category:
+                self.remove_agent(obj)
+
+        for obj in self.player_list:
+            self.unrealcv.set_obj_scale(obj, self.agents[obj]['scale'])
+            self.unrealcv.set_random(obj, 0)
+            self.unrealcv.set_interval(self.interval, obj)
+
+        await self.unrealcv.build_color_dict(self.player_list)
+        self.cam_flag = self.get_cam_flag(self.observation_type)
+
+    async def init_objects(self):
+        await self.unrealcv.init_objects(self.objects_list)
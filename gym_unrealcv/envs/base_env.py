@@ -5,8 +5,14 @@ from gym import spaces
 from gym_unrealcv.envs.utils import misc
 from unrealcv.launcher import RunUnreal
 from gym_unrealcv.envs.agent.character import Character_API
+from gym_unrealcv.envs.utils.trace import ReplayServer
+from gym_unrealcv.envs.utils.mock_server import MockServer
 import random
 import sys
+import time
+from collections import deque
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
 ''' 
 It is a base env for general purpose agent-env interaction, including single/multi-agent navigation, tracking, etc.
 Observation : raw color image and depth
@@ -82,9 +88,43 @@ class UnrealCv_base(gym.Env):
         self.sleep_time = 5
         self.launched = False
         self.comm_mode = 'tcp'
+        self.step_executor = None  # the thread to send the ticks of step_async and receive their replies, in order
+        self.pipeline_depth = 1  # the max number of ticks in flight, 2: the next tick is sent before step_wait of the current one
+        self.pending_steps = deque()  # (future, the state of the tick) of each tick in flight, the oldest first
+        self.step_count = 0  # count_steps of the tick scored by step_wait (info['Steps'])
+        self.step_actions = None
+        self.step_obs_slots = (None, None)
+        self.step_obs_types = None
+        self.step_capture = True  # False in the skipped ticks of frame_skip, only the poses are queried
+        self.frame_skip = 1  # hold the actions of step for frame_skip ticks, only the last tick is captured and the rewards are summed
+        self.tick_time = None  # the min wall-clock time (seconds) between the ticks of frame_skip, None: a tick is one round trip to UE
+        # persistent observation buffers, the decoded images are written into the slots of a preallocated (N, H, W, C) array
+        self.reuse_obs_buffer = False  # the returned observation is overwritten two steps later (double buffered, a buffer more for each extra tick in flight)
+        self.obs_layout = 'NHWC'  # 'NHWC' or 'NCHW' (channel-first)
+        self.obs_readonly = False  # return a read-only view of the buffer
+        self.obs_buffers = dict()  # observation_type -> (layout, [buffer0, buffer1])
+        self.agent_obs_buffers = dict()  # (row, observation_type) -> (layout, [buffer0, buffer1], index) of the list of observations
+        self.obs_index = None  # the player index of each row of the observation, None: all the players, see set_obs_spec
+        self.compact_obs = None  # the dtype of the depth in the compact observations ('float16', or 'uint16' in centimetres), see config_compact_obs
+        self.obs_buffer_index = 0
+        self.decode_workers = 0  # the number of threads to decode the images of multiple cameras, 0: serial decoding
+        self.defer_cmds = False  # buffer the async setters (e.g. from wrappers), and send them with the next step in one batch
+        self.merge_step_cmds = True  # send the action commands and the state queries in one batch, False: two round trips per step
+        self.img_conn = False  # fetch the images on a second connection, the control commands do not wait behind the images
+        self.adaptive_encoding = False  # choose bmp or png (True) or also jpg for lit ('lossy') for each camera by the link throughput
+        self.capture_dir = None  # capture the frames into this directory (e.g. on tmpfs) and map them, UE must run on the same host
+        self.record_trace = None  # the path to record the UnrealCV session, see gym_unrealcv.envs.utils.trace
+        self.replay_trace = None  # the path of a recorded session to replay on localhost instead of launching UE
+        self.mock_server = False  # run against the mock UnrealCV server instead of launching UE, see gym_unrealcv.envs.utils.mock_server
+        self.mock_latency = 0.0  # the artificial latency (seconds) of every reply of the mock server
+        self.mock_img_latency = 0.0  # the extra latency (seconds) of every image reply of the mock server
+        self.local_server = None  # the replay or mock server
+        self.debug_pose_queries = False  # warn when a pose fetched in this step is queried again (e.g. by a task env or wrapper)
 
         self.agents_category = ['player'] # the agent category we use in the env
         self.protagonist_id = 0
+        self.pose_rows = None  # only compute the relative poses of these agents (e.g. [tracker_id]), None: all agents
+        self.obs_specs = dict()  # player -> the observation type of the agent ('None': not captured, 'Pose', 'Color', ...), see set_obs_spec
 
         # init agents
         self.player_list = list(self.agents.keys())
@@ -118,7 +158,13 @@ class UnrealCv_base(gym.Env):
 
     def step(self, actions):
         """
-        Execute one step in the environment.
+        Execute one step in the environment, i.e. step_async then step_wait of each tick, one after the other.
+        Nothing overlaps within step, call step_async and step_wait directly to run the caller's work while the replies
+        are received. With frame_skip > 1, the actions are held for frame_skip ticks: only the poses are queried in the skipped ticks
+        (for the rewards), the images are captured after the last tick, and the rewards of the ticks are summed.
+        A tick is one round trip to UE, so the hold time depends on the latency, unless tick_time is set: the ticks are then sent
+        tick_time apart (wall clock), and the images are captured (frame_skip - 1) * tick_time after the actions are applied.
+        The ticks are counted as one step in count_steps (info['Steps']), so max_steps and the episode length keep their meaning.
 
         Args:
             actions (list): List of actions to be performed by the agents.
@@ -126,13 +172,90 @@ class UnrealCv_base(gym.Env):
         Returns:
             tuple: Observations, rewards, done flag, and additional info.
         """
+        if len(self.pending_steps) > 0:
+            raise RuntimeError('step is called with ticks in flight, call step_wait first.')
+        results = None
+        start = time.perf_counter()
+        for tick in range(self.frame_skip):
+            last = tick == self.frame_skip - 1
+            if tick > 0 and self.tick_time:
+                time.sleep(max(start + tick * self.tick_time - time.perf_counter(), 0))
+            self.step_async(actions, capture=last, hold=tick > 0)
+            results = self.merge_tick(results, self.step_wait())
+            if results[2] and not last:  # done in a skipped tick, capture its observation
+                observations, self.obj_poses, self.img_show = self.update_observation(self.player_list, self.cam_list, self.cam_flag, self.observation_type)
+                return (observations,) + results[1:]
+        return results
+
+    def drop_pending_steps(self):
+        # wait for the ticks in flight and drop their results, e.g. before reset
+        futures.wait([future for future, state in self.pending_steps])
+        self.pending_steps.clear()
+
+    def merge_tick(self, results, tick_results):
+        # aggregate the results of the ticks of a step, the rewards are summed and the rest is from the last tick
+        if results is None:
+            return tick_results
+        observations, rewards, done, info = tick_results
+        rewards = np.add(results[1], rewards)
+        info['Reward'] = rewards
+        return observations, rewards, done, info
+
+    def step_async(self, actions, capture=True, hold=False):
+        """
+        Send the actions and the capture request of one step (one tick), and return at once.
+        The tick is sent and its replies are received (and the images decoded) in a background thread, while the caller
+        runs, e.g. the policy of another env or a learner update. The rewards and the observation are computed in step_wait.
+
+        With pipeline_depth = 2, step_async of the next tick can be called before step_wait of the current one, so UE
+        renders the next frame while step_wait scores the current one:
+            env.step_async(actions)
+            while True:
+                env.step_async(policy(obs))  # the actions are based on the observation one tick older
+                obs, rewards, done, info = env.step_wait()  # the current tick, the next one is in flight
+        The ticks are sent and scored in order. The queries of step_wait (e.g. check_visibility, get_hit) wait for the
+        requests in flight on the connection, and may see the scene of the next tick.
+
+        Args:
+            actions (list): List of actions to be performed by the agents.
+            capture (bool): Capture the images, False to query the poses only (the observation is None).
+            hold (bool): The actions are held from the previous tick, only the move commands are sent again.
+        """
+        if len(self.pending_steps) >= self.pipeline_depth:
+            raise RuntimeError(f'step_async is called with {len(self.pending_steps)} ticks in flight, '
+                               f'call step_wait first (pipeline_depth={self.pipeline_depth}).')
+        action_cmds, capture_cams, capture_flag = self.prepare_step(actions, capture, hold)
+        if self.step_executor is None:
+            self.step_executor = ThreadPoolExecutor(max_workers=1)
+        future = self.step_executor.submit(self.send_step_cmds, action_cmds, list(self.player_list), capture_cams,
+                                           capture_flag, self.step_obs_slots[1])
+        self.pending_steps.append((future, self.get_step_state()))
+
+    def get_step_state(self):
+        # the state of a tick set by prepare_step, restored by step_wait as the later ticks may be in flight
+        return dict(step_actions=self.step_actions, step_capture=self.step_capture, step_obs_slots=self.step_obs_slots,
+                    step_obs_types=self.step_obs_types, obs_index=self.obs_index, step_count=self.count_steps)
+
+    def step_wait(self):
+        """
+        Wait for the replies of the oldest tick sent by step_async, then build the observation, the info and the rewards.
+
+        Returns:
+            tuple: Observations, rewards, done flag, and additional info.
+        """
+        if len(self.pending_steps) == 0:
+            raise RuntimeError('step_wait is called without step_async.')
+        future, state = self.pending_steps.popleft()
+        for key, value in state.items():
+            setattr(self, key, value)
+        obj_poses, cam_poses, imgs, masks, depths = future.result()
         info = dict(
             Collision=0,
             Done=False,
             Reward=0.0,
-            Action=actions,
+            Action=self.step_actions,
             Pose=[],
-            Steps=self.count_steps,
+            Steps=self.step_count,
             Direction=None,
             Distance=None,
             Color=None,
@@ -140,20 +263,16 @@ class UnrealCv_base(gym.Env):
             Relative_Pose=[],
             Success=False
         )
-        actions2move, actions2turn, actions2animate = self.action_mapping(actions, self.player_list)
-        move_cmds = [self.unrealcv.set_move_bp(obj, actions2move[i], return_cmd=True) for i, obj in enumerate(self.player_list) if actions2move[i] is not None]
-        head_cmds = [self.unrealcv.set_cam(obj, self.agents[obj]['relative_location'], actions2turn[i], return_cmd=True) for i, obj in enumerate(self.player_list) if actions2turn[i] is not None]
-        anim_cmds = [self.unrealcv.set_animation(obj, actions2animate[i], return_cmd=True) for i, obj in enumerate(self.player_list) if actions2animate[i] is not None]
-        self.unrealcv.batch_cmd(move_cmds+head_cmds+anim_cmds, None)
-        self.count_steps += 1
 
         # get states
-        obj_poses, cam_poses, imgs, masks, depths = self.unrealcv.get_pose_img_batch(self.player_list, self.cam_list, self.cam_flag)
         self.obj_poses = obj_poses
-        observations = self.prepare_observation(self.observation_type, imgs, masks, depths, obj_poses)
-        self.img_show = self.prepare_img2show(self.protagonist_id, observations)
+        if self.step_capture:
+            observations = self.prepare_observation(self.observation_type, imgs, masks, depths, obj_poses, self.step_obs_slots, self.step_obs_types, self.obs_index)
+            self.img_show = self.prepare_img2show(self.protagonist_id, observations)
+        else:  # a skipped tick of frame_skip
+            observations = None
 
-        pose_obs, relative_pose = self.get_pose_states(obj_poses)
+        pose_obs, relative_pose = self.get_pose_states(obj_poses, self.pose_rows)
 
         # prepare the info
         info['Pose'] = obj_poses
@@ -163,6 +282,68 @@ class UnrealCv_base(gym.Env):
 
         return observations, info['Reward'], info['Done'], info
 
+    def prepare_step(self, actions, capture=True, hold=False):
+        """
+        Get the commands of a step (one tick) and prepare the buffer of its observation.
+
+        Args:
+            actions (list): List of actions to be performed by the agents.
+            capture (bool): Capture the images, False to query the poses only.
+            hold (bool): Only send the move commands, to hold the actions of the previous tick.
+
+        Returns:
+            tuple: The action commands, the cameras to capture and the camera flags.
+        """
+        action_cmds = self.get_action_cmds(actions, moves_only=hold)
+        if not hold:  # the held ticks of frame_skip belong to the same step
+            self.count_steps += 1
+        self.step_actions = actions
+        self.step_capture = capture
+        if not capture:  # no camera in the batch, the previous observation buffer is kept
+            self.step_obs_types, self.step_obs_slots = None, (None, None)
+            return action_cmds, [], self.cam_flag
+        capture_cams, capture_flag, self.step_obs_types, self.obs_index = self.get_capture_spec(self.player_list, self.cam_list, self.cam_flag, self.observation_type)
+        self.step_obs_slots = self.prepare_obs_slots(self.observation_type, capture_cams, self.step_obs_types)
+        return action_cmds, capture_cams, capture_flag
+
+    def get_action_cmds(self, actions, moves_only=False):
+        """
+        Map the actions of the agents to the UnrealCV commands.
+
+        Args:
+            actions (list): List of actions to be performed by the agents.
+            moves_only (bool): Only get the move commands, e.g. to hold the actions without repeating the animations.
+
+        Returns:
+            list: The move, head and animation commands.
+        """
+        actions2move, actions2turn, actions2animate = self.action_mapping(actions, self.player_list)
+        move_cmds = [self.unrealcv.set_move_bp(obj, actions2move[i], return_cmd=True) for i, obj in enumerate(self.player_list) if actions2move[i] is not None]
+        if moves_only:
+            return move_cmds
+        head_cmds = [self.unrealcv.set_cam(obj, self.agents[obj]['relative_location'], actions2turn[i], return_cmd=True) for i, obj in enumerate(self.player_list) if actions2turn[i] is not None]
+        anim_cmds = [self.unrealcv.set_animation(obj, actions2animate[i], return_cmd=True) for i, obj in enumerate(self.player_list) if actions2animate[i] is not None]
+        return move_cmds+head_cmds+anim_cmds
+
+    def send_step_cmds(self, action_cmds, player_list, cam_list, cam_flag, img_out=None):
+        """
+        Send the action commands and get the poses and images, it runs in the step thread.
+
+        Args:
+            action_cmds (list): List of action commands.
+            player_list (list): List of player agents.
+            cam_list (list): List of camera IDs.
+            cam_flag (list): List of camera flags.
+            img_out (dict): The slots of the observation buffer to decode the images into.
+
+        Returns:
+            tuple: Object poses, camera poses, images, masks and depths.
+        """
+        if self.merge_step_cmds:  # a single round trip, the replies of the action commands are dropped
+            return self.unrealcv.get_pose_img_batch(player_list, cam_list, cam_flag, action_cmds, img_out=img_out)
+        self.unrealcv.batch_cmd(action_cmds, None)
+        return self.unrealcv.get_pose_img_batch(player_list, cam_list, cam_flag, img_out=img_out)
+
     def reset(self):
         """
         Reset the environment to its initial state.
@@ -170,11 +351,23 @@ class UnrealCv_base(gym.Env):
         Returns:
             np.array: Initial observations.
         """
+        self.drop_pending_steps()
         if not self.launched:  # first time to launch
             self.launched = self.launch_ue_env()
             self.init_agents()
             self.init_objects()
 
+        self.reset_agents()
+        # get state
+        observations, self.obj_poses, self.img_show = self.update_observation(self.player_list, self.cam_list, self.cam_flag, self.observation_type)
+        self.unrealcv.flush_cmds()
+
+        return observations
+
+    def reset_agents(self):
+        """
+        Reset the counters, and move the agents and their cameras to the initial poses.
+        """
         self.count_close = 0
         self.count_steps = 0
         self.count_eps += 1
@@ -198,18 +391,26 @@ class UnrealCv_base(gym.Env):
         # set view point
             self.unrealcv.set_cam(obj, self.agents[obj]['relative_location'], self.agents[obj]['relative_rotation'])
         self.set_topview(init_poses[self.protagonist_id], self.cam_id[0])
-        # get state
-        observations, self.obj_poses, self.img_show = self.update_observation(self.player_list, self.cam_list, self.cam_flag, self.observation_type)
-
-        return observations
 
     def close(self):
         """
         Close the environment and disconnect from UnrealCV.
         """
+        if self.step_executor is not None:
+            self.step_executor.shutdown(wait=True)
+            self.step_executor = None
+        self.pending_steps.clear()
         if self.launched:
+            self.unrealcv.set_decode_workers(0)
+            self.unrealcv.close_img_client()
             self.unrealcv.client.disconnect()
-            self.ue_binary.close()
+            self.unrealcv.close_trace()
+            if self.local_server is not None:
+                self.local_server.close()
+                self.local_server = None
+            else:
+                self.ue_binary.close()
+            self.launched = False
 
     def render(self, mode='rgb_array', close=False):
         """
@@ -248,8 +449,10 @@ class UnrealCv_base(gym.Env):
         Returns:
             tuple: Updated observations, object poses, and image to show.
         """
-        obj_poses, cam_poses, imgs, masks, depths = self.unrealcv.get_pose_img_batch(player_list, cam_list, cam_flag)
-        observations = self.prepare_observation(observation_type, imgs, masks, depths, obj_poses)
+        capture_cams, capture_flag, obs_types, self.obs_index = self.get_capture_spec(player_list, cam_list, cam_flag, observation_type)
+        obs_slots = self.prepare_obs_slots(observation_type, capture_cams, obs_types)
+        obj_poses, cam_poses, imgs, masks, depths = self.unrealcv.get_pose_img_batch(player_list, capture_cams, capture_flag, img_out=obs_slots[1])
+        observations = self.prepare_observation(observation_type, imgs, masks, depths, obj_poses, obs_slots, obs_types, self.obs_index)
         img_show = self.prepare_img2show(self.protagonist_id, observations)
         return observations, obj_poses, img_show
 
@@ -276,7 +479,7 @@ class UnrealCv_base(gym.Env):
             current_pose (list): Current pose of the camera.
             cam_id (int): Camera ID.
         """
-        cam_loc = current_pose[:3]
+        cam_loc = list(current_pose[:3])  # the pose may be a row of the read-only pose array
         cam_loc[-1] = self.height_top_view
         cam_rot = [-90, 0, 0]
         self.unrealcv.set_cam_location(cam_id, cam_loc)
@@ -301,7 +504,7 @@ class UnrealCv_base(gym.Env):
                       distance]
         return obs_vector, distance, angle
 
-    def prepare_observation(self, observation_type, img_list, mask_list, depth_list, pose_list):
+    def prepare_observation(self, observation_type, img_list, mask_list, depth_list, pose_list, obs_slots=None, obs_types=None, obs_index=None):
         """
         Prepare the observation based on the observation type.
 
@@ -311,10 +514,28 @@ class UnrealCv_base(gym.Env):
             mask_list (list): List of masks.
             depth_list (list): List of depth images.
             pose_list (list): List of poses.
+            obs_slots (tuple): The (buffer, slots) from prepare_obs_slots that the images are decoded into.
+            obs_types (list): The observation type of each row from get_capture_spec, None if the observations are stacked.
+            obs_index (list): The player index of each row from get_capture_spec, None if all the players are observed.
 
         Returns:
-            np.array: Prepared observation.
+            np.array: Prepared observation, or the list of the observations of each agent if obs_types is given.
         """
+        if obs_index is not None:  # the poses of the observed agents, the images are captured for them only
+            pose_list = [pose_list[i] for i in obs_index]
+        if obs_types is not None:
+            img_dict = dict(Color=img_list, Mask=mask_list, Depth=depth_list)
+            buffers = obs_slots[0] if obs_slots is not None and obs_slots[0] is not None else [None] * len(obs_types)
+            return [self.prepare_agent_observation(i, obs_type, img_dict, pose, buffer)
+                    for i, (obs_type, pose, buffer) in enumerate(zip(obs_types, pose_list, buffers))]
+        if self.reuse_obs_buffer and observation_type in self.obs_modalities:
+            buffer, slots = obs_slots if obs_slots is not None else (None, None)
+            return self.fill_obs_buffer(observation_type, dict(Color=img_list, Mask=mask_list, Depth=depth_list), buffer, slots)
+        if self.compact_obs is not None and observation_type in ['Depth', 'Rgbd', 'MaskDepth']:
+            # new arrays in the dtypes of the observation space
+            buffer = self.new_obs_buffer(observation_type, len(depth_list))
+            return self.fill_obs_buffer(observation_type, dict(Color=img_list, Mask=mask_list, Depth=depth_list),
+                                        buffer, self.get_obs_slots(buffer, observation_type))
         if observation_type == 'Depth':
             return np.array(depth_list)
         elif observation_type == 'Mask':
@@ -330,7 +551,298 @@ class UnrealCv_base(gym.Env):
         elif observation_type =='ColorMask':
             return np.append(np.array(img_list), np.array(mask_list), axis=-1)
 
+    def prepare_agent_observation(self, index, observation_type, img_dict, pose, buffer=None):
+        """
+        Prepare the observation of one agent with its own observation type.
 
+        Args:
+            index (int): The row of the agent in the observation (and in the image lists).
+            observation_type (str): The observation type of the agent.
+            img_dict (dict): modality -> list of images, None for the images not captured.
+            pose (list): The pose of the agent.
+            buffer (np.array): The buffer from prepare_obs_slots that the images are decoded into, None to get one.
+
+        Returns:
+            np.array: The observation (a dict for the compact Rgbd and MaskDepth), blank if it is not captured.
+        """
+        if observation_type == 'Pose':
+            return np.array(pose)
+        if observation_type not in self.obs_modalities:
+            return None
+        modalities = [modality for modality, _ in self.obs_modalities[observation_type]]
+        if buffer is None:
+            buffer = self.get_agent_obs_buffer(index, observation_type) if self.reuse_obs_buffer else self.new_obs_buffer(observation_type, 1)
+        arrays = buffer if isinstance(buffer, dict) else {None: buffer}
+        if all(modality in img_dict and img_dict[modality][index] is not None for modality in modalities):
+            self.fill_obs_buffer(observation_type, {modality: [img_dict[modality][index]] for modality in modalities},
+                                 buffer, self.get_obs_slots(buffer, observation_type))
+        elif self.reuse_obs_buffer:  # the agent without camera, clear the observation of two steps ago
+            for array in arrays.values():
+                array.fill(0)
+        views = {modality: self.get_obs_view(array)[0] for modality, array in arrays.items()}
+        return views[None] if None in views else views
+
+    def set_obs_spec(self, players, observation_type=None):
+        """
+        Set the observation type of some agents, e.g. 'None' for the agents driven by the scripted controllers.
+        Only the images consumed by each agent are captured. The agents with 'None' are left out of the observation,
+        self.obs_index gives the player index of each row. The observations are stacked as before if the other agents
+        use the observation type of the env, otherwise a list of the observations of each agent is returned.
+
+        Args:
+            players (list): The names of the agents.
+            observation_type (str): 'None', 'Pose' or an image type ('Color', 'Mask', 'Depth', 'Rgbd', ...),
+                                    None to use the observation type of the env.
+        """
+        for obj in players:
+            if observation_type is None:
+                self.obs_specs.pop(obj, None)
+            else:
+                assert observation_type in ['None', 'Pose'] + list(self.obs_modalities.keys()), f'Unknown observation type {observation_type}'
+                self.obs_specs[obj] = observation_type
+        self.update_observation_space()
+
+    def update_observation_space(self):
+        # redefine the observation space of each agent after its observation type or the observation format is changed
+        self.observation_space = [self.define_observation_space(self.cam_list[i], self.get_obs_type(obj), self.resolution)
+                                  for i, obj in enumerate(self.player_list)]
+
+    def get_obs_type(self, obj):
+        # the observation type of the agent in its observation space, the blank observation of 'None' has the type of the env
+        obs_type = self.obs_specs.get(obj, self.observation_type)
+        return self.observation_type if obs_type == 'None' else obs_type
+
+    def get_capture_spec(self, player_list, cam_list, cam_flag, observation_type):
+        """
+        Apply the observation spec of each agent to the capture, the agents with 'None' are left out of the observation
+        and the agents with 'Pose' capture no image.
+
+        Args:
+            player_list (list): List of player agents.
+            cam_list (list): List of camera IDs.
+            cam_flag (list): The camera flags of the env.
+            observation_type (str): Type of observation of the env.
+
+        Returns:
+            tuple: The cameras to capture for the rows of the observation (-1 for the agents without image), the camera
+                   flags (a list of the flags of each camera if the agents use different image types), the observation
+                   type of each row (None if the observations are stacked), and the player index of each row
+                   (None if all the players are observed).
+        """
+        obs_types = [self.obs_specs.get(obj, observation_type) for obj in player_list]
+        if all(obs_type == observation_type for obs_type in obs_types):
+            return list(cam_list), cam_flag, None, None
+        obs_index = [i for i, obs_type in enumerate(obs_types) if obs_type != 'None']
+        obs_types = [obs_types[i] for i in obs_index]
+        cam_list = [-1 if obs_types[row] == 'Pose' else cam_list[i] for row, i in enumerate(obs_index)]
+        if all(obs_type == observation_type for obs_type in obs_types):
+            return cam_list, cam_flag, None, obs_index
+        img_flags = [[cam_flag[0]] + self.get_cam_flag(obs_type, verbose=False)[1:] for obs_type in obs_types]
+        return cam_list, img_flags, obs_types, obs_index
+
+    # the modalities (name, channels) stacked in the observation, in channel order
+    obs_modalities = {
+        'Color': [('Color', 3)],
+        'Mask': [('Mask', 3)],
+        'Depth': [('Depth', 1)],
+        'Rgbd': [('Color', 3), ('Depth', 1)],
+        'MaskDepth': [('Mask', 3), ('Depth', 1)],
+        'ColorMask': [('Color', 3), ('Mask', 3)],
+    }
+
+    def config_obs_buffer(self, reuse=True, channel_first=False, readonly=False):
+        """
+        Configure the persistent observation buffer.
+
+        Args:
+            reuse (bool): Write the observations into preallocated buffers instead of building new arrays every step.
+            channel_first (bool): Return the observation in (N, C, H, W) layout.
+            readonly (bool): Return a read-only view of the buffer.
+        """
+        self.reuse_obs_buffer = reuse
+        self.obs_layout = 'NCHW' if channel_first else 'NHWC'
+        self.obs_readonly = readonly
+        self.obs_buffers = dict()
+        self.agent_obs_buffers = dict()
+        self.update_observation_space()
+
+    def config_compact_obs(self, depth_dtype='float16'):
+        """
+        Configure the compact observations: the color and the mask stay uint8 and the depth is stored in depth_dtype,
+        instead of promoting them all to float32. Rgbd and MaskDepth are then dicts of their modalities,
+        e.g. {'Color': (N, H, W, 3) uint8, 'Depth': (N, H, W, 1) float16}, and the observation space is a matching Dict.
+
+        Args:
+            depth_dtype (str): 'float16', 'uint16' (centimetres, saturated at 655 m), or None for the float32 observations.
+        """
+        assert depth_dtype in [None, 'float16', 'uint16'], f'Unsupported depth dtype {depth_dtype}'
+        self.compact_obs = depth_dtype
+        self.obs_buffers = dict()
+        self.agent_obs_buffers = dict()
+        self.update_observation_space()
+
+    def get_obs_dtype(self, observation_type):
+        # the dtype of the observation (of a modality in the dict of the compact observation)
+        if observation_type in ['Color', 'Mask', 'ColorMask']:
+            return np.dtype(np.uint8)
+        if observation_type == 'Depth' and self.compact_obs is not None:
+            return np.dtype(self.compact_obs)
+        return np.dtype(np.float32)
+
+    def get_obs_layout(self, observation_type, num):
+        """
+        Get the layout of the observation buffer.
+
+        Args:
+            observation_type (str): Type of observation.
+            num (int): Number of observations.
+
+        Returns:
+            list: The (modality, shape, dtype) of each array, the modality is None if the observation is a single array.
+        """
+        if self.compact_obs is not None and observation_type in ['Rgbd', 'MaskDepth']:  # a dict of the modalities
+            groups = [(modality, channels, self.get_obs_dtype(modality)) for modality, channels in self.obs_modalities[observation_type]]
+        else:
+            groups = [(None, sum([c for _, c in self.obs_modalities[observation_type]]), self.get_obs_dtype(observation_type))]
+        height, width = self.resolution[1], self.resolution[0]
+        layout = []
+        for modality, channels, dtype in groups:
+            if self.reuse_obs_buffer and self.obs_layout == 'NCHW':
+                shape = (num, channels, height, width)
+            else:
+                shape = (num, height, width, channels)
+            layout.append((modality, shape, dtype))
+        return layout
+
+    def new_obs_buffer(self, observation_type, num):
+        # allocate an observation buffer, a dict of the arrays of the modalities for the compact Rgbd and MaskDepth
+        arrays = {modality: np.zeros(shape, dtype=dtype) for modality, shape, dtype in self.get_obs_layout(observation_type, num)}
+        return arrays[None] if None in arrays else arrays
+
+    def get_obs_buffer(self, observation_type, num):
+        """
+        Get the next observation buffer of the double buffer (pipeline_depth + 1 buffers), (re)allocate it if the population size is changed.
+
+        Args:
+            observation_type (str): Type of observation.
+            num (int): Number of observations (agents with camera).
+
+        Returns:
+            np.array: The observation buffer, or a dict of the buffers of the modalities (see config_compact_obs).
+        """
+        layout = (self.get_obs_layout(observation_type, num), self.pipeline_depth)
+        if observation_type not in self.obs_buffers or self.obs_buffers[observation_type][0] != layout:
+            # a buffer for each tick in flight and one for the returned observation
+            buffers = [self.new_obs_buffer(observation_type, num) for _ in range(self.pipeline_depth + 1)]
+            self.obs_buffers[observation_type] = (layout, buffers)
+        buffers = self.obs_buffers[observation_type][1]
+        self.obs_buffer_index = (self.obs_buffer_index + 1) % len(buffers)  # the previous observation is still valid
+        return buffers[self.obs_buffer_index]
+
+    def get_agent_obs_buffer(self, row, observation_type):
+        """
+        Get the next buffer of the double buffer (pipeline_depth + 1 buffers) of one observation in the list of the observations (see set_obs_spec).
+
+        Args:
+            row (int): The row of the agent in the observation.
+            observation_type (str): The observation type of the agent.
+
+        Returns:
+            np.array: The (1, ...) buffer, or a dict of the buffers of the modalities (see config_compact_obs).
+        """
+        key = (row, observation_type)
+        layout = (self.get_obs_layout(observation_type, 1), self.pipeline_depth)
+        if key not in self.agent_obs_buffers or self.agent_obs_buffers[key][0] != layout:
+            buffers = [self.new_obs_buffer(observation_type, 1) for _ in range(self.pipeline_depth + 1)]
+            self.agent_obs_buffers[key] = (layout, buffers, 0)
+        layout, buffers, index = self.agent_obs_buffers[key]
+        index = (index + 1) % len(buffers)  # the previous observation is still valid
+        self.agent_obs_buffers[key] = (layout, buffers, index)
+        return buffers[index]
+
+    def prepare_obs_slots(self, observation_type, cam_list, obs_types=None):
+        """
+        Get the buffer of the next observation before capturing, so the images can be decoded into its slots.
+
+        Args:
+            observation_type (str): Type of observation.
+            cam_list (list): The cameras to capture for the rows of the observation.
+            obs_types (list): The observation type of each row from get_capture_spec, if the observations are not stacked.
+
+        Returns:
+            tuple: The buffer (the list of the buffers of each row if obs_types is given) and its slots,
+                   (None, None) if the buffer is not used.
+        """
+        if not self.reuse_obs_buffer:
+            return None, None
+        if obs_types is not None:
+            buffers = [self.get_agent_obs_buffer(row, obs_type) if obs_type in self.obs_modalities and cam_id >= 0 else None
+                       for row, (cam_id, obs_type) in enumerate(zip(cam_list, obs_types))]
+            slots = dict(Color=[], Mask=[], Depth=[])
+            for buffer, obs_type in zip(buffers, obs_types):
+                agent_slots = self.get_obs_slots(buffer, obs_type) if buffer is not None else dict()
+                for modality in slots:
+                    slots[modality].append(agent_slots[modality][0] if modality in agent_slots else None)
+            return buffers, slots
+        if observation_type not in self.obs_modalities:
+            return None, None
+        buffer = self.get_obs_buffer(observation_type, len(cam_list))
+        return buffer, self.get_obs_slots(buffer, observation_type)
+
+    def get_obs_slots(self, buffer, observation_type):
+        """
+        Get the views of the buffer for each agent and modality, the images can be written into the slots directly.
+
+        Args:
+            buffer (np.array): The observation buffer, or a dict of the buffers of the modalities.
+            observation_type (str): Type of observation.
+
+        Returns:
+            dict: modality -> list of slots (H, W, C) of each agent.
+        """
+        slots = dict()
+        start = 0
+        for modality, channels in self.obs_modalities[observation_type]:
+            array = buffer
+            if isinstance(buffer, dict):  # each modality has its own buffer
+                array, start = buffer[modality], 0
+            if self.reuse_obs_buffer and self.obs_layout == 'NCHW':  # the slot is a (H, W, C) view of the (C, H, W) memory
+                slots[modality] = [np.moveaxis(array[i, start:start+channels], 0, -1) for i in range(len(array))]
+            else:
+                slots[modality] = [array[i, ..., start:start+channels] for i in range(len(array))]
+            start += channels
+        return slots
+
+    def fill_obs_buffer(self, observation_type, img_dict, buffer=None, slots=None):
+        """
+        Copy the images into the slots of the observation buffer.
+
+        Args:
+            observation_type (str): Type of observation.
+            img_dict (dict): modality -> list of images.
+            buffer (np.array): The buffer returned by prepare_obs_slots, if the images are decoded into its slots.
+            slots (dict): The slots of the buffer.
+
+        Returns:
+            np.array: The observation (a view of the buffer), or a dict of the views of the buffers of the modalities.
+        """
+        if buffer is None:
+            num = len(img_dict[self.obs_modalities[observation_type][0][0]])
+            buffer = self.get_obs_buffer(observation_type, num)
+            slots = self.get_obs_slots(buffer, observation_type)
+        for modality, _ in self.obs_modalities[observation_type]:
+            for slot, img in zip(slots[modality], img_dict[modality]):
+                if not np.may_share_memory(slot, img):  # skip the images decoded into the buffer
+                    np.copyto(slot, misc.cast_img(img, slot.dtype), casting='unsafe')
+        if isinstance(buffer, dict):
+            return {modality: self.get_obs_view(array) for modality, array in buffer.items()}
+        return self.get_obs_view(buffer)
+
+    def get_obs_view(self, buffer):
+        obs = buffer.view()
+        if self.obs_readonly:
+            obs.flags.writeable = False
+        return obs
 
     def rotate2exp(self, yaw_exp, obj, th=1):
         """
@@ -407,6 +919,7 @@ class UnrealCv_base(gym.Env):
         self.action_space.append(self.define_action_space(self.action_type, agent_info=new_dict))
         self.observation_space.append(self.define_observation_space(new_dict['cam_id'], self.observation_type, self.resolution))
         self.unrealcv.set_phy(name, 0)
+        self.unrealcv.invalidate_capture_plan()  # the population is changed
         return new_dict
 
     def remove_agent(self, name):
@@ -424,6 +937,8 @@ class UnrealCv_base(gym.Env):
         self.observation_space.pop(agent_index)
         self.unrealcv.destroy_obj(name)  # the agent is removed from the scene
         self.agents.pop(name)
+        self.obs_specs.pop(name, None)
+        self.unrealcv.invalidate_capture_plan()
 
     def remove_cam(self, name):
         """
@@ -485,28 +1000,41 @@ class UnrealCv_base(gym.Env):
         if observation_type == 'Pose' or cam_id < 0:
             observation_space = spaces.Box(low=-100, high=100, shape=(6,),
                                                dtype=np.float16)  # TODO check the range and shape
+        elif self.compact_obs is not None and observation_type in ['Rgbd', 'MaskDepth']:
+            # the compact observation is a dict of its modalities, each in its own dtype
+            observation_space = spaces.Dict({modality: self.define_observation_space(cam_id, modality, resolution)
+                                             for modality, _ in self.obs_modalities[observation_type]})
         else:
             if observation_type == 'Color' or observation_type == 'CG' or observation_type == 'Mask':
                 img_shape = (resolution[1], resolution[0], 3)
                 observation_space = spaces.Box(low=0, high=255, shape=img_shape, dtype=np.uint8)
             elif observation_type == 'Depth':
                 img_shape = (resolution[1], resolution[0], 1)
-                observation_space = spaces.Box(low=0, high=100, shape=img_shape, dtype=np.float16)
+                dtype = self.get_obs_dtype(observation_type)
+                if self.compact_obs is None:
+                    observation_space = spaces.Box(low=0, high=100, shape=img_shape, dtype=dtype)
+                else:  # the full range of the compact dtype
+                    high = np.iinfo(dtype).max if np.issubdtype(dtype, np.integer) else np.finfo(dtype).max
+                    observation_space = spaces.Box(low=0, high=high, shape=img_shape, dtype=dtype)
             elif observation_type == 'Rgbd':
                 s_low = np.zeros((resolution[1], resolution[0], 4))
                 s_high = np.ones((resolution[1], resolution[0], 4))
                 s_high[:, :, -1] = 100.0  # max_depth
                 s_high[:, :, :-1] = 255  # max_rgb
-                observation_space = spaces.Box(low=s_low, high=s_high, dtype=np.float16)
+                observation_space = spaces.Box(low=s_low, high=s_high, dtype=np.float32)  # the color is promoted with the depth
             elif observation_type == 'MaskDepth':
                 s_low = np.zeros((resolution[1], resolution[0], 4))
                 s_high = np.ones((resolution[1], resolution[0], 4))
                 s_high[:, :, -1] = 100.0  # max_depth
                 s_high[:, :, :-1] = 255  # max_rgb
-                observation_space = spaces.Box(low=s_low, high=s_high, dtype=np.float16)
+                observation_space = spaces.Box(low=s_low, high=s_high, dtype=np.float32)  # the color is promoted with the depth
             elif observation_type=='ColorMask':
                 img_shape = (resolution[1], resolution[0], 6)
                 observation_space = spaces.Box(low=0, high=255, shape=img_shape, dtype=np.uint8)
+            if self.reuse_obs_buffer and self.obs_layout == 'NCHW' and observation_type in self.obs_modalities:
+                observation_space = spaces.Box(low=np.moveaxis(np.broadcast_to(observation_space.low, observation_space.shape), -1, 0),
+                                               high=np.moveaxis(np.broadcast_to(observation_space.high, observation_space.shape), -1, 0),
+                                               dtype=observation_space.dtype)
         return observation_space
 
     def sample_init_pose(self, use_reset_area=False, num_agents=1):
@@ -591,39 +1119,55 @@ class UnrealCv_base(gym.Env):
             self.unrealcv.random_obstacles(self.objects_list, self.textures_list,
                                            len(self.objects_list), self.reset_area, self.start_area, layout_texture)
 
-    def get_pose_states(self, obj_pos):
+    def get_pose_states(self, obj_pos, rows=None):
         # get the relative pose of each agent and the absolute location and orientation of the agent
-        pose_obs = []
-        player_num = len(obj_pos)
-        np.zeros((player_num, player_num, 2))
-        relative_pose = np.zeros((player_num, player_num, 2))
-        for j in range(player_num):
-            vectors = []
-            for i in range(player_num):
-                obs, distance, direction = self.get_relative(obj_pos[j], obj_pos[i])
-                yaw = obj_pos[j][4]/180*np.pi
-                # rescale the absolute location and orientation
-                abs_loc = [obj_pos[i][0], obj_pos[i][1],
-                           obj_pos[i][2], np.cos(yaw), np.sin(yaw)]
-                obs = obs + abs_loc
-                vectors.append(obs)
-                relative_pose[j, i] = np.array([distance, direction])
-            pose_obs.append(vectors)
-
-        return np.array(pose_obs), relative_pose
+        # rows: only compute the rows of these agents (e.g. [tracker_id]), the other rows are NaN, see misc.get_pose_states
+        return misc.get_pose_states(obj_pos, rows)
 
     def launch_ue_env(self):
-        # launch the UE4 binary
-        env_ip, env_port = self.ue_binary.start(docker=self.docker, resolution=self.resolution, display=self.display,
-                                               opengl=self.use_opengl, offscreen=self.offscreen_rendering,
-                                               nullrhi=self.nullrhi,sleep_time=10)
-
+        env_ip, env_port, comm_mode = self.start_ue_env()
 
         # connect to UnrealCV Server
-        self.unrealcv = Character_API(port=env_port, ip=env_ip, resolution=self.resolution, comm_mode=self.comm_mode)
+        self.unrealcv = Character_API(port=env_port, ip=env_ip, resolution=self.resolution, comm_mode=comm_mode,
+                                      record=self.record_trace)
+        self.config_unrealcv()
         self.unrealcv.set_map(self.env_name)
         return True
 
+    def start_ue_env(self):
+        """
+        Start the UnrealCV server: the replay or the mock server on localhost, or the UE binary.
+
+        Returns:
+            tuple: The IP, the port and the communication mode to connect with.
+        """
+        if self.replay_trace is not None:  # serve the recorded session on localhost, no UE binary
+            self.local_server = ReplayServer(self.replay_trace)
+        elif self.mock_server:  # serve a synthetic scene on localhost, no UE binary
+            self.local_server = MockServer(resolution=self.resolution, objects=list(self.agents.keys()) + self.objects_list,
+                                           num_cameras=max([self.agents[obj]['cam_id'] for obj in self.agents] + self.cam_id) + 1,
+                                           latency=self.mock_latency, img_latency=self.mock_img_latency)
+        if self.local_server is not None:
+            env_ip, env_port = self.local_server.start()
+            return env_ip, env_port, 'tcp'
+        # launch the UE4 binary
+        env_ip, env_port = self.ue_binary.start(docker=self.docker, resolution=self.resolution, display=self.display,
+                                               opengl=self.use_opengl, offscreen=self.offscreen_rendering,
+                                               nullrhi=self.nullrhi,sleep_time=10)
+        return env_ip, env_port, self.comm_mode
+
+    def config_unrealcv(self):
+        # apply the client options of the env to the connected client
+        self.unrealcv.set_decode_workers(self.decode_workers)
+        self.unrealcv.defer_cmds = self.defer_cmds
+        self.unrealcv.debug_pose_queries = self.debug_pose_queries
+        if self.img_conn:
+            self.unrealcv.open_img_client()
+        if self.capture_dir is not None:
+            self.unrealcv.set_capture_dir(self.capture_dir, envdir=self.ue_binary.path2env if self.docker and self.local_server is None else None)
+        if self.adaptive_encoding:
+            self.unrealcv.set_adaptive_encoding(lossy=self.adaptive_encoding == 'lossy')
+
     def init_agents(self):
         for obj in self.player_list.copy(): # the agent will be fully removed in self.agents
             if self.agents[obj]['agent_type'] not in self.agents_category:
@@ -641,12 +1185,27 @@ class UnrealCv_base(gym.Env):
         self.unrealcv.init_objects(self.objects_list)
 
     def prepare_img2show(self, index, states):
-        if self.observation_type == 'Rgbd':
-            return states[index][:, :, :3]
-        elif self.observation_type in ['Color', 'Gray', 'CG', 'Mask']:
-            return states[index]
-        elif self.observation_type == 'Depth':
-            return states[index]/states[index].max()  # normalize the depth image
+        if isinstance(states, list):  # the observation of each agent has its own type, see set_obs_spec
+            observation_type = self.obs_specs.get(self.player_list[index], self.observation_type)
+        else:
+            observation_type = self.observation_type
+        if self.obs_index is not None:  # the agents with 'None' are left out of the observation
+            if index not in self.obs_index:
+                return None
+            index = self.obs_index.index(index)
+        state = {modality: array[index] for modality, array in states.items()} if isinstance(states, dict) else states[index]
+        if isinstance(state, dict):  # the compact Rgbd or MaskDepth, only the color is shown
+            state = state.get('Color')
+        if state is None:
+            return None
+        if self.reuse_obs_buffer and self.obs_layout == 'NCHW' and observation_type in self.obs_modalities:
+            state = np.moveaxis(state, 0, -1)  # back to (H, W, C) for display
+        if observation_type == 'Rgbd':
+            return state[:, :, :3]
+        elif observation_type in ['Color', 'Gray', 'CG', 'Mask']:
+            return state
+        elif observation_type == 'Depth':
+            return state/state.max()  # normalize the depth image
         else:
             return None
 
@@ -704,7 +1263,7 @@ class UnrealCv_base(gym.Env):
         return actions2move, actions2head, actions2animate
 
 
-    def get_cam_flag(self, observation_type, use_color=False, use_mask=False, use_depth=False, use_cam_pose=False):
+    def get_cam_flag(self, observation_type, use_color=False, use_mask=False, use_depth=False, use_cam_pose=False, verbose=True):
         # get flag for camera
         # observation_type: 'color', 'depth', 'mask', 'cam_pose'
         flag = [False, False, False, False]
@@ -712,7 +1271,8 @@ class UnrealCv_base(gym.Env):
         flag[1] = observation_type == 'Color' or observation_type == 'Rgbd' or use_color or observation_type == 'ColorMask'
         flag[2] = observation_type == 'Mask' or use_mask or observation_type == 'MaskDepth' or observation_type == 'ColorMask'
         flag[3] = observation_type == 'Depth' or observation_type == 'Rgbd' or use_depth or observation_type == 'MaskDepth'
-        print('cam_flag:', flag)
+        if verbose:
+            print('cam_flag:', flag)
         return flag
 
     def sample_from_area(self, area, num):
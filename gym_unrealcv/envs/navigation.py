@@ -49,8 +49,8 @@ class Navigation(UnrealCv_base):
 
         self.count_steps = 0
 
-    def step(self, action):
-        obs, rewards, done, info = super(Navigation, self).step(action)
+    def step_wait(self):
+        obs, rewards, done, info = super(Navigation, self).step_wait()
 
         #detect if the agent collision with environment
         if self.unrealcv.get_hit(self.player[self.protagonist_id]) == 0:
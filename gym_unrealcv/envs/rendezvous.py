@@ -25,8 +25,8 @@ class Rendezvous(UnrealCv_base):
         self.distance_threshold = 200
         self.agents_category = ['player']
 
-    def step(self, action):
-        obs, rewards, done, info = super(Rendezvous, self).step(action)
+    def step_wait(self):
+        obs, rewards, done, info = super(Rendezvous, self).step_wait()
         # compute the useful metrics for rewards and done condition
         metrics = self.rendezvous_metrics(info['Relative_Pose'])
         rewards = self.reward(metrics)
@@ -29,8 +29,8 @@ class Rescue(UnrealCv_base):
         self.reward_type = 'shared'  # 'sparse', 'shared', 'individual'
         ## TODO: add trigger action
 
-    def step(self, action):
-        obs, rewards, done, info = super(Rescue, self).step(action)
+    def step_wait(self):
+        obs, rewards, done, info = super(Rescue, self).step_wait()
         # compute the useful metrics for rewards and done condition
         metrics = self.rescue_metrics(info['Pose'], self.target_pose)
         rewards = self.reward(metrics)
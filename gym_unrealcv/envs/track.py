@@ -41,12 +41,13 @@ class Track(UnrealCv_base):
         self.distance_threshold = self.reward_params["min_distance"]  # distance threshold for collision
         self.tracker_id = self.protagonist_id
         self.target_id = self.protagonist_id+1
+        self.tracker_row_only = False  # only compute the tracker's row of the relative poses (pose_rows), the other rows of info['Relative_Pose'] and info['Pose_Obs'] are NaN and dis_ave is the mean distance from the tracker
 
-    def step(self, action):
-        obs, rewards, done, info = super(Track, self).step(action)
+    def step_wait(self):
+        obs, rewards, done, info = super(Track, self).step_wait()
         relative_pose = info['Relative_Pose']
         # compute the useful metrics for rewards and done condition
-        metrics, score4tracker = self.track_metrics(relative_pose, self.tracker_id, self.target_id)
+        metrics, score4tracker = self.track_metrics(relative_pose, self.tracker_id, self.target_id, check_mask=self.step_capture)
 
         # prepare the info
         info['Distance'], info['Direction'] = relative_pose[self.tracker_id][self.target_id]
@@ -60,6 +61,8 @@ class Track(UnrealCv_base):
 
     def reset(self):
         # initialize the environment
+        if self.tracker_row_only:
+            self.pose_rows = [self.tracker_id]  # the tracker may be re-sampled by the wrappers
         observations = super(Track, self).reset()
         target_pos = self.unrealcv.get_obj_location(self.player_list[self.target_id])
         print(target_pos)
@@ -108,11 +111,13 @@ class Track(UnrealCv_base):
 
         # update the observation
         observations, self.obj_poses, self.img_show = self.update_observation(self.player_list, self.cam_list, self.cam_flag, self.observation_type)
+        self.unrealcv.flush_cmds()
         self.count_lost = 0
         return observations
 
-    def track_metrics(self, relative_pose, tracker_id, target_id):
+    def track_metrics(self, relative_pose, tracker_id, target_id, check_mask=True):
         # compute the relative relation (collision, in-the-view, misleading) among agents for rewards and evaluation metrics
+        # check_mask: False in the skipped ticks of frame_skip, the target_viewed is pose-based and count_lost is kept
         info = dict()
         relative_dis = relative_pose[:, :, 0]
         relative_ori = relative_pose[:, :, 1]
@@ -121,7 +126,7 @@ class Track(UnrealCv_base):
         collision_mat[np.where(np.fabs(relative_ori) > 45)] = 0  # collision should be at the front view
         info['collision'] = collision_mat
 
-        info['dis_ave'] = relative_dis.mean() # average distance among players, regard as a kind of density metric
+        info['dis_ave'] = np.nanmean(relative_dis) # average distance among players, regard as a kind of density metric, the rows not computed (tracker_row_only) are NaN
 
         # if in the tracker's view
         view_mat = np.zeros_like(relative_ori)
@@ -133,23 +138,24 @@ class Track(UnrealCv_base):
         info['target_viewed'] = view_mat_tracker[target_id]  # target in the observable area
 
         # detect target mask to determine if in the view (not work for some environment, which cannot rendering mask, like industrialArea)
-        target_percent = self.unwrapped.unrealcv.check_visibility(self.cam_list[self.tracker_id],
-                                                                  self.player_list[self.target_id])
-        info['target_viewed'] = int(target_percent > 0 and view_mat_tracker[target_id])
+        if check_mask:
+            target_percent = self.unwrapped.unrealcv.check_visibility(self.cam_list[self.tracker_id],
+                                                                      self.player_list[self.target_id])
+            info['target_viewed'] = int(target_percent > 0 and view_mat_tracker[target_id])
 
-        if target_percent <= 0:
-            self.count_lost += 1
-        else:
-            self.count_lost = 0
+            if target_percent <= 0:
+                self.count_lost += 1
+            else:
+                self.count_lost = 0
 
         relative_oir_norm = np.fabs(relative_ori-self.reward_params['exp_angle']) / 45.0
         relation_norm = np.fabs(relative_dis - self.reward_params['exp_distance'])/self.reward_params['max_distance'] + relative_oir_norm
-        reward_tracker = 1 - relation_norm[0]  # measuring the quality among tracker to others
+        reward_tracker = 1 - relation_norm[tracker_id]  # measuring the quality among tracker to others
         info['tracked_id'] = np.argmax(reward_tracker)  # which one is tracked
-        info['perfect'] = info['target_viewed'] * (info['d_in'] == 0) * (reward_tracker[1] > 0.5)
+        info['perfect'] = info['target_viewed'] * (info['d_in'] == 0) * (reward_tracker[target_id] > 0.5)
         info['mislead'] = 0
-        if info['tracked_id'] > 1 and reward_tracker[info['tracked_id']] > 0.5: # only when target is far away to the center and distracotr is close
-            advantage = reward_tracker[info['tracked_id']] - reward_tracker[1]
+        if info['tracked_id'] not in (tracker_id, target_id) and reward_tracker[info['tracked_id']] > 0.5: # only when target is far away to the center and distracotr is close
+            advantage = reward_tracker[info['tracked_id']] - reward_tracker[target_id]
             if advantage > 1:
                 info['mislead'] = info['tracked_id']
 
@@ -182,7 +188,7 @@ class Track(UnrealCv_base):
 
     def get_tracker_init_point(self, target_pos, distance, direction=None):
         if direction is None:
-            direction = 2 * np.pi * np.random.sample(1)
+            direction = 2 * np.pi * np.random.sample()
         else:
             direction = direction % (2 * np.pi)
 
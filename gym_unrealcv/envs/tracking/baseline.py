@@ -18,11 +18,11 @@ class RandomAgent(object):
 
     def act(self, pose):
         self.step_counter += 1
-        if self.pose_last == None:
+        if self.pose_last is None:
             self.pose_last = pose
             d_moved = 100
         else:
-            d_moved = np.linalg.norm(np.array(self.pose_last) - np.array(pose))
+            d_moved = np.linalg.norm(np.asarray(self.pose_last) - np.asarray(pose))
             self.pose_last = pose
         if self.step_counter > self.keep_steps or d_moved < 3:
             self.action = self.action_space.sample()
@@ -70,11 +70,11 @@ class GoalNavAgent(object):
 
     def act(self, pose, ref_goal=None):
         self.step_counter += 1
-        if self.pose_last == None or self.fix:
+        if self.pose_last is None or self.fix:
             self.pose_last = pose
             d_moved = 100
         else:
-            d_moved = np.linalg.norm(np.array(self.pose_last) - np.array(pose))
+            d_moved = np.linalg.norm(np.asarray(self.pose_last) - np.asarray(pose))
             self.pose_last = pose
         if self.check_reach(self.goal, pose) or d_moved < 3 or self.step_counter > self.max_len:
             if ref_goal is None or np.random.random() > self.random_th:
@@ -111,11 +111,11 @@ class GoalNavAgent(object):
         return (velocity, angle)
 
     def act2(self, pose):
-        if self.pose_last == None or self.fix:
+        if self.pose_last is None or self.fix:
             self.pose_last = pose
             d_moved = 100
         else:
-            d_moved = np.linalg.norm(np.array(self.pose_last) - np.array(pose))
+            d_moved = np.linalg.norm(np.asarray(self.pose_last) - np.asarray(pose))
             self.pose_last = pose
         if d_moved < 10:
             self.step_counter += 1
@@ -174,11 +174,11 @@ class GoalNavAgentTest(object):
     def act(self, pose):
 
         self.step_counter += 1
-        if self.pose_last == None:
+        if self.pose_last is None:
             self.pose_last = pose
             d_moved = 100
         else:
-            d_moved = np.linalg.norm(np.array(self.pose_last) - np.array(pose))
+            d_moved = np.linalg.norm(np.asarray(self.pose_last) - np.asarray(pose))
             self.pose_last = pose
         if self.check_reach(self.goal, pose) or d_moved < 3 or self.step_counter > self.max_len:
             self.goal = self.generate_goal()
@@ -220,7 +220,7 @@ class GoalNavAgentTest(object):
         return goal
 
     def check_reach(self, goal, pose_now, dim=2):
-        error = np.array(pose_now[:dim]) - np.array(goal[:dim])
+        error = np.asarray(pose_now[:dim]) - np.asarray(goal[:dim])
         distance = np.linalg.norm(error)
         return distance < 50
 
@@ -239,7 +239,7 @@ class InternalNavAgent(object):
     def act(self, pose):
         self.step_counter += 1
 
-        distance_tmp = np.linalg.norm(np.array(self.pose_last) - np.array(pose))
+        distance_tmp = np.linalg.norm(np.asarray(self.pose_last) - np.asarray(pose))
         self.pose_last = pose
         if self.check_reach(self.goal, pose) or self.step_counter > self.max_len or distance_tmp<1:
             # sample a new goal
@@ -292,7 +292,7 @@ class InternalNavAgent(object):
         return goal
 
     def check_reach(self, goal, pose_now, dim=2):
-        error = np.array(pose_now[:dim]) - np.array(goal[:dim])
+        error = np.asarray(pose_now[:dim]) - np.asarray(goal[:dim])
         distance = np.linalg.norm(error)
         return distance < 50
 
@@ -318,11 +318,11 @@ class Nav2GoalAgent(object):
 
     def act(self, pose, ref_goal=None):
         self.step_counter += 1
-        if self.pose_last == None or self.fix:
+        if self.pose_last is None or self.fix:
             self.pose_last = pose
             d_moved = 10
         else:
-            d_moved = np.linalg.norm(np.array(self.pose_last) - np.array(pose)) # get the distance moved for checking if the agent is stuck
+            d_moved = np.linalg.norm(np.asarray(self.pose_last) - np.asarray(pose)) # get the distance moved for checking if the agent is stuck
             self.pose_last = pose
         self.d_move_ave = self.d_move_ave*0.7 + d_moved*0.3
         if self.check_reach(self.goal, pose) or self.d_move_ave < 3 or self.step_counter > self.max_len:
@@ -390,7 +390,7 @@ class PoseTracker(object):
         # angle = np.clip(self.angle_pid(-delt_yaw), self.angle_low, self.angle_high)
         angle = np.clip(self.angle_pid(self.expected_angle-delt_yaw), self.angle_low, self.angle_high)
 
-        delt_distance = (np.linalg.norm(np.array(pose[:2]) - np.array(target_pose[:2])) - self.expected_distance)
+        delt_distance = (np.linalg.norm(np.asarray(pose[:2]) - np.asarray(target_pose[:2])) - self.expected_distance)
         velocity = np.clip(self.velocity_pid(-delt_distance), self.velocity_low, self.velocity_high)
 
         return [angle, velocity]
@@ -413,7 +413,7 @@ class DronePoseTracker(object):
         # angle = np.clip(self.angle_pid(-delt_yaw), self.angle_low, self.angle_high)
         angle = np.clip(self.angle_pid(self.expected_angle-delt_yaw), self.angle_low, self.angle_high)
 
-        delt_distance = (np.linalg.norm(np.array(pose[:2]) - np.array(target_pose[:2])) - self.expected_distance)
+        delt_distance = (np.linalg.norm(np.asarray(pose[:2]) - np.asarray(target_pose[:2])) - self.expected_distance)
         velocity = np.clip(self.velocity_pid(-delt_distance), self.velocity_low, self.velocity_high)
 
         return [velocity,0,0,angle]
\ No newline at end of file
@@ -0,0 +1,100 @@
+import threading
+import time
+
+LOSSLESS_FORMATS = ['bmp', 'png']
+LOSSY_FORMATS = ['jpg']
+
+
+class EncodingSelector:
+    """
+    Choose the image format (bmp, png, or a lossy format for lit) of each camera and view mode to minimize the step time.
+    The cost of a format is the transfer time of its reply at the measured link throughput plus its decoding time,
+    e.g. bmp on localhost, png (or jpg) to a remote UE instance on a saturated link.
+    The masks and the depth are always lossless. The estimates are refreshed by probing the other formats periodically.
+    """
+    def __init__(self, lossy=False, probe_interval=200, smoothing=0.2):
+        """
+        Args:
+            lossy (bool): Allow the lossy format for the lit images, the server must support it.
+            probe_interval (int): Try the other formats of a camera every probe_interval captures.
+            smoothing (float): The weight of a new sample in the moving averages.
+        """
+        self.lossy = lossy
+        self.probe_interval = probe_interval
+        self.smoothing = smoothing
+        self.throughput = None  # the moving average of the link throughput (bytes per second)
+        self.estimates = dict()  # (cam_id, viewmode) -> {format: {'size': bytes, 'decode': seconds, 'time': last sample}}
+        self.counts = dict()  # (cam_id, viewmode) -> the number of captures
+        self.unsupported = set()  # the formats rejected by the server
+        self.lock = threading.Lock()  # the images are decoded in the worker threads
+
+    def get_candidates(self, viewmode):
+        formats = LOSSLESS_FORMATS + (LOSSY_FORMATS if self.lossy and viewmode == 'lit' else [])
+        return [fmt for fmt in formats if fmt not in self.unsupported]
+
+    def select(self, cam_id, viewmode):
+        """
+        Get the format of the next capture of a camera.
+
+        Args:
+            cam_id (int): The camera ID.
+            viewmode (str): The view mode, 'lit' or 'object_mask'.
+
+        Returns:
+            str: The format.
+        """
+        key = (cam_id, viewmode)
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+            estimates = self.estimates.get(key, dict())
+            candidates = self.get_candidates(viewmode)
+            unknown = [fmt for fmt in candidates if fmt not in estimates]
+            if len(unknown) > 0:  # measure each format once
+                return unknown[0]
+            if self.counts[key] % self.probe_interval == 0:  # refresh the oldest estimate
+                return min(candidates, key=lambda fmt: estimates[fmt]['time'])
+            return min(candidates, key=lambda fmt: self.get_cost(estimates[fmt]))
+
+    def get_cost(self, estimate):
+        transfer = estimate['size'] / self.throughput if self.throughput else 0
+        return transfer + estimate['decode']
+
+    def update(self, value, sample):
+        return sample if value is None else (1 - self.smoothing) * value + self.smoothing * sample
+
+    def record(self, cam_id, viewmode, fmt, size, decode_time):
+        """
+        Record the reply size and the decoding time of a capture.
+        """
+        with self.lock:
+            estimate = self.estimates.setdefault((cam_id, viewmode), dict()).get(fmt)
+            if estimate is None:
+                estimate = dict(size=size, decode=decode_time)
+            else:
+                estimate = dict(size=self.update(estimate['size'], size), decode=self.update(estimate['decode'], decode_time))
+            estimate['time'] = time.time()
+            self.estimates[(cam_id, viewmode)][fmt] = estimate
+
+    def record_link(self, size, latency):
+        """
+        Record the bytes received in a round trip, the small replies are ignored as they are dominated by the latency.
+
+        Args:
+            size (int): The number of bytes received.
+            latency (float): The round trip time in seconds.
+        """
+        if size < 65536 or latency <= 0:
+            return
+        with self.lock:
+            self.throughput = self.update(self.throughput, size / latency)
+
+    def set_unsupported(self, fmt):
+        with self.lock:
+            self.unsupported.add(fmt)
+
+    def __repr__(self):
+        lines = [f'throughput: {self.throughput / 1e6:.1f} MB/s' if self.throughput else 'throughput: -']
+        for (cam_id, viewmode), estimates in sorted(self.estimates.items()):
+            costs = ', '.join(f'{fmt} {e["size"] / 1024:.0f}KB {self.get_cost(e) * 1000:.2f}ms' for fmt, e in estimates.items())
+            lines.append(f'camera {cam_id} {viewmode}: {costs}')
+        return '\n'.join(lines)
@@ -33,6 +33,49 @@ def get_direction(current_pose, target_pose):  # get relative angle between curr
     return angle_relative
 
 
+def get_pose_states(obj_pos, rows=None):
+    """
+    Get the relative poses among the objects at once by broadcasting, object j is the reference of row j.
+    pose_obs[j, i] = [sin(delta yaw), cos(delta yaw), sin(direction), cos(direction), distance, x_i, y_i, z_i, cos(yaw_j), sin(yaw_j)]
+    relative_pose[j, i] = [distance, direction], the direction is in degrees as get_direction.
+
+    Args:
+        obj_pos (list or np.ndarray): The poses [x, y, z, roll, yaw, pitch] of the objects.
+        rows (list, optional): Only compute the rows of these objects (e.g. [tracker_id]), the other rows are NaN.
+
+    Returns:
+        tuple: pose_obs (N, N, 10) and relative_pose (N, N, 2).
+    """
+    num = len(obj_pos)
+    if num == 0:
+        return np.zeros((0, 0, 10)), np.zeros((0, 0, 2))
+    if isinstance(obj_pos, np.ndarray):  # the (N, 6) pose array of the env
+        poses = obj_pos[:, :5].astype(np.float64)
+    else:
+        poses = np.array([pose[:5] for pose in obj_pos], dtype=np.float64)  # x, y, z, roll, yaw
+    rows = np.arange(num) if rows is None else np.asarray(rows, dtype=int)
+    ref = poses[rows]
+    delta = poses[None, :, :3] - ref[:, None, :3]  # (rows, N, 3)
+    distance = np.linalg.norm(delta, axis=-1)
+    direction = np.arctan2(delta[..., 1], delta[..., 0])/np.pi*180 - ref[:, None, 4]
+    direction = np.where(direction > 180, direction - 360, direction)
+    direction = np.where(direction < -180, direction + 360, direction)
+    direction[(delta[..., 0] == 0) & (delta[..., 1] == 0)] = 0  # the same position
+    delta_yaw = (poses[None, :, 4] - ref[:, None, 4])/180*np.pi
+    yaw = np.broadcast_to(ref[:, None, 4]/180*np.pi, distance.shape)
+    loc = np.broadcast_to(poses[None, :, :3], delta.shape)
+    obs = np.concatenate([np.stack([np.sin(delta_yaw), np.cos(delta_yaw), np.sin(direction/180*np.pi),
+                                    np.cos(direction/180*np.pi), distance], axis=-1),
+                          loc, np.stack([np.cos(yaw), np.sin(yaw)], axis=-1)], axis=-1)
+    if len(rows) == num and np.array_equal(rows, np.arange(num)):
+        return obs, np.stack([distance, direction], axis=-1)
+    pose_obs = np.full((num, num, 10), np.nan)
+    relative_pose = np.full((num, num, 2), np.nan)
+    pose_obs[rows] = obs
+    relative_pose[rows] = np.stack([distance, direction], axis=-1)
+    return pose_obs, relative_pose
+
+
 def get_textures(texture_name="textures", docker=False):
     try:
         texture_dir = os.path.join(unrealcv.util.get_path2UnrealEnv(), "textures")
@@ -64,4 +107,22 @@ def convert_dict(old_dict):
                     new_dict[name][key] = info[key][i]
                 else:
                     new_dict[name][key] = info[key]
-    return new_dict
\ No newline at end of file
+    return new_dict
+
+
+def cast_img(img, dtype):
+    """
+    Prepare an image to be copied into an array of the given dtype, the float images (e.g. the depth in centimetres)
+    are rounded and saturated for an integer dtype, the others are returned as they are.
+
+    Args:
+        img (np.ndarray): The image.
+        dtype (np.dtype): The dtype of the destination.
+
+    Returns:
+        np.ndarray: The image to copy.
+    """
+    if np.issubdtype(dtype, np.integer) and np.issubdtype(img.dtype, np.floating):
+        info = np.iinfo(dtype)
+        return np.clip(np.rint(img), info.min, info.max)
+    return img
@@ -0,0 +1,249 @@
+"""
+A mock UnrealCV server for the performance work without the UE binary and GPU.
+It implements the vget/vset/vbp subset used by Character_API, with synthetic poses, lit/mask/depth frames at the
+given resolution (over the socket or written to a file), and an artificial latency.
+
+Use it in an env: set env.unwrapped.mock_server = True before the first reset, or serve it for other clients by
+    python -m gym_unrealcv.envs.utils.mock_server --port 9000 --resolution 320 240
+"""
+import argparse
+import re
+import socket
+import socketserver
+import struct
+import threading
+import time
+from io import BytesIO
+import numpy as np
+import PIL.Image
+from gym_unrealcv.envs.utils.trace import recv_frame, send_frame
+
+VBP_REPLIES = {
+    'get_speed': '{"Speed": "0.0"}',
+    'get_angle': '{"Angle": "0.0"}',
+    'get_hit': '{"Hit": "0"}',
+    'is_picked': '{"Picked": "0"}',
+    'is_carrying': '{"Carrying": "0"}',
+    'generate_nav_goal': '{"nav_goal": "X=0.0 Y=0.0 Z=0.0"}',
+}
+
+
+class MockScene:
+    """
+    The state of the mock scene: the objects (pose, color, scale) and the cameras.
+    An object is created when it is queried for the first time, a spawned object brings a new camera.
+    """
+    def __init__(self, objects=(), num_cameras=1, resolution=(160, 120)):
+        self.resolution = resolution
+        self.objects = dict()
+        self.cameras = dict()
+        self.frames = dict()  # (viewmode, format) -> the encoded frame
+        self.lock = threading.Lock()
+        for obj in objects:
+            self.get_obj(obj)
+        for cam_id in range(num_cameras):
+            self.get_cam(cam_id)
+
+    def get_obj(self, name):
+        if name not in self.objects:
+            i = len(self.objects)
+            self.objects[name] = dict(location=[100.0 * i, 0.0, 100.0], rotation=[0.0, 0.0, 0.0],
+                                      color=[(37 * i) % 256, (91 * i) % 256, (53 * i) % 256], scale=[1.0, 1.0, 1.0])
+        return self.objects[name]
+
+    def get_cam(self, cam_id):
+        if cam_id not in self.cameras:
+            self.cameras[cam_id] = dict(location=[0.0, 0.0, 300.0], rotation=[0.0, 0.0, 0.0], fov=90.0)
+        return self.cameras[cam_id]
+
+    def get_frame(self, viewmode, fmt):
+        # the frames are synthesized once for each view mode and format
+        key = (viewmode, fmt)
+        if key not in self.frames:
+            self.frames[key] = self.encode_frame(viewmode, fmt)
+        return self.frames[key]
+
+    def encode_frame(self, viewmode, fmt):
+        w, h = self.resolution
+        if viewmode == 'depth' or fmt == 'npy':
+            depth = np.tile(np.linspace(100, 5000, h, dtype=np.float32)[:, None], (1, w))
+            buf = BytesIO()
+            np.save(buf, depth)
+            return buf.getvalue()
+        img = np.zeros((h, w, 4), dtype=np.uint8)  # BGRA
+        if viewmode == 'object_mask':
+            img[:, :w // 2, :3] = 255  # the target in white
+        else:
+            img[:, :, 0] = np.linspace(0, 255, w, dtype=np.uint8)[None, :]
+            img[:, :, 1] = np.linspace(0, 255, h, dtype=np.uint8)[:, None]
+            img[:, :, 2] = 128
+        img[:, :, 3] = 255  # the alpha channel keeps the reply from being decoded as utf-8
+        if fmt == 'png':
+            buf = BytesIO()
+            PIL.Image.fromarray(img[:, :, [2, 1, 0, 3]], 'RGBA').save(buf, 'png')
+            return buf.getvalue()
+        if fmt == 'jpg':
+            buf = BytesIO()
+            PIL.Image.fromarray(img[:, :, [2, 1, 0]], 'RGB').save(buf, 'jpeg', quality=90)
+            return buf.getvalue()
+        # 32-bit top-down bmp, the pixels are at the end as the bmp of UnrealCV
+        header = struct.pack('<2sIHHI', b'BM', 54 + img.nbytes, 0, 0, 54)
+        info = struct.pack('<IiiHHIIiiII', 40, w, -h, 1, 32, 0, img.nbytes, 2835, 2835, 0, 0)
+        return header + info + img.tobytes()
+
+    def handle(self, cmd):
+        """
+        Get the reply of a command.
+
+        Args:
+            cmd (str): The command.
+
+        Returns:
+            bytes: The reply.
+        """
+        with self.lock:
+            try:
+                return self.reply(cmd.split())
+            except (ValueError, IndexError):
+                return f'error: can not parse {cmd}'.encode()
+
+    def reply(self, tokens):
+        if len(tokens) < 2:
+            return b'ok'
+        if tokens[0] == 'vbp':
+            return VBP_REPLIES.get(tokens[2] if len(tokens) > 2 else '', '{}').encode()
+        if tokens[0] not in ['vget', 'vset']:
+            return b'ok'
+        path, args = tokens[1], tokens[2:]
+        if path == '/objects':
+            return ' '.join(self.objects.keys()).encode()
+        if path == '/cameras':
+            return ' '.join(f'Camera_{i}' for i in self.cameras).encode()
+        if path == '/objects/spawn' and len(args) > 1:
+            self.get_obj(args[1])
+            self.get_cam(len(self.cameras))
+            return args[1].encode()
+        match = re.match(r'/camera/(\d+)/(\w+)', path)
+        if match:
+            return self.reply_camera(tokens[0], self.get_cam(int(match.group(1))), match.group(2), args)
+        match = re.match(r'/object/([^/]+)/(\w+)', path)
+        if match:
+            return self.reply_object(tokens[0], match.group(1), match.group(2), args)
+        if path.startswith('/unrealcv'):
+            return b'error: not supported by the mock server'
+        return b'ok'
+
+    def reply_camera(self, op, cam, attr, args):
+        if op == 'vset':
+            if attr in ['location', 'rotation'] and len(args) == 3:
+                cam[attr] = [float(v) for v in args]
+            return b'ok'
+        if attr in ['location', 'rotation']:
+            return ' '.join(f'{v:.3f}' for v in cam[attr]).encode()
+        if attr == 'fov':
+            return f'{cam["fov"]:.1f}'.encode()
+        if attr in ['lit', 'object_mask', 'depth', 'normal']:
+            if len(args) > 0 and '.' in args[0]:  # capture to a file, reply the path
+                with open(args[0], 'wb') as f:
+                    f.write(self.get_frame(attr, args[0].split('.')[-1]))
+                return args[0].encode()
+            return self.get_frame(attr, args[0] if len(args) > 0 else 'png')
+        return b'error: not supported by the mock server'
+
+    def reply_object(self, op, name, attr, args):
+        if op == 'vset':
+            if attr == 'destroy':
+                self.objects.pop(name, None)
+            elif attr == 'rotation' and len(args) == 3:  # pitch yaw roll -> roll yaw pitch
+                self.get_obj(name)['rotation'] = [float(args[2]), float(args[1]), float(args[0])]
+            elif attr in ['location', 'color', 'scale'] and len(args) == 3:
+                self.get_obj(name)[attr] = [float(v) for v in args]
+            return b'ok'
+        obj = self.get_obj(name)
+        if attr in ['location', 'rotation', 'scale']:
+            return ' '.join(f'{v:.3f}' for v in obj[attr]).encode()
+        if attr == 'color':
+            r, g, b = [int(v) for v in obj['color']]
+            return f'(R={r},G={g},B={b},A=255)'.encode()
+        if attr == 'bounds':
+            x, y, z = obj['location']
+            return f'{x-40} {y-40} {z-90} {x+40} {y+40} {z+90}'.encode()
+        if attr == 'uclass_name':
+            return b'bp_character_C'
+        return b'error: not supported by the mock server'
+
+
+class MockHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        send_frame(sock, b'connected to the mock server')
+        while True:
+            payload = recv_frame(sock)
+            if payload is None:
+                return
+            message_id, cmd = payload.split(b':', 1)
+            cmd = cmd.decode('utf-8', 'replace')
+            reply = self.server.scene.handle(cmd)
+            latency = self.server.latency + (self.server.img_latency if cmd.split(' ')[-1] in ['bmp', 'png', 'jpg', 'npy'] else 0)
+            if self.server.bandwidth is not None:
+                latency += len(reply) / self.server.bandwidth
+            if latency > 0:
+                time.sleep(latency)
+            send_frame(sock, message_id + b':' + reply)
+
+
+class MockServer(socketserver.ThreadingTCPServer):
+    """
+    Serve the mock scene on localhost, each connection is handled in its own thread.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, resolution=(160, 120), objects=(), num_cameras=1, latency=0.0, img_latency=0.0, bandwidth=None):
+        """
+        Args:
+            port (int): The port to listen, 0 to pick a free port.
+            resolution (tuple): The resolution (width, height) of the frames.
+            objects (list): The objects in the scene at the start, e.g. the agents of the env.
+            num_cameras (int): The number of cameras at the start.
+            latency (float): The artificial latency (seconds) of every reply.
+            img_latency (float): The extra latency (seconds) of every image reply.
+            bandwidth (float, optional): The link throughput (bytes per second) to emulate a remote UE instance.
+        """
+        self.scene = MockScene(objects, num_cameras, resolution)
+        self.latency = latency
+        self.img_latency = img_latency
+        self.bandwidth = bandwidth
+        self.thread = None
+        super(MockServer, self).__init__(('127.0.0.1', port), MockHandler)
+
+    def start(self):
+        """
+        Serve in a background thread.
+
+        Returns:
+            tuple: The IP and port of the server.
+        """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self.server_address
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a mock UnrealCV scene on localhost')
+    parser.add_argument('--port', type=int, default=9000, help='the port to listen')
+    parser.add_argument('--resolution', type=int, nargs=2, default=[160, 120], help='the width and height of the frames')
+    parser.add_argument('--cameras', type=int, default=1, help='the number of cameras at the start')
+    parser.add_argument('--latency', type=float, default=0.0, help='the latency (seconds) of every reply')
+    parser.add_argument('--img-latency', type=float, default=0.0, help='the extra latency (seconds) of every image reply')
+    parser.add_argument('--bandwidth', type=float, default=None, help='the link throughput (MB/s) to emulate')
+    args = parser.parse_args()
+    server = MockServer(args.port, tuple(args.resolution), num_cameras=args.cameras, latency=args.latency, img_latency=args.img_latency,
+                        bandwidth=args.bandwidth * 1e6 if args.bandwidth else None)
+    print(f'Mock UnrealCV server on 127.0.0.1:{args.port}')
+    server.serve_forever()
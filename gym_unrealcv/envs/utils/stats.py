@@ -0,0 +1,90 @@
+import re
+import threading
+from collections import deque
+import numpy as np
+
+
+class CmdStats:
+    """
+    The counters and latency records of the UnrealCV commands, grouped by the command family,
+    e.g. 'vbp <obj> set_move', 'vget /camera/N/lit bmp', 'vset /object/<obj>/location'.
+    The latency of a command in a batch is the round trip time of the batch, the async commands have no latency.
+    """
+    def __init__(self, window=10000):
+        self.enabled = True
+        self.window = window  # the number of recent latencies kept for each family
+        self.families = dict()
+        self.lock = threading.Lock()  # the image and control connections may record concurrently
+
+    def reset(self):
+        with self.lock:
+            self.families = dict()
+
+    @staticmethod
+    def get_family(cmd):
+        tokens = cmd.split(' ')
+        if tokens[0] == 'vbp' and len(tokens) > 2:
+            return f'vbp <obj> {tokens[2]}'
+        if tokens[0] in ['vget', 'vset'] and len(tokens) > 1:
+            path = re.sub(r'/camera/\d+', '/camera/N', tokens[1])
+            path = re.sub(r'/object/[^/]+', '/object/<obj>', path)
+            fmt = [arg if arg in ['bmp', 'png', 'jpg', 'npy'] else '<file>' for arg in tokens[2:] if arg.endswith(('bmp', 'png', 'jpg', 'npy'))]
+            return ' '.join([tokens[0], path] + fmt)
+        return ' '.join(tokens[:2])
+
+    def record(self, cmds, replies=None, latency=None):
+        """
+        Record the commands of a request.
+
+        Args:
+            cmds (list): The commands.
+            replies (list, optional): The replies (or their sizes in bytes), None for the async commands.
+            latency (float, optional): The round trip time of the request in seconds.
+        """
+        if not self.enabled:
+            return
+        if replies is None:
+            replies = [None] * len(cmds)
+        with self.lock:
+            self.record_batch(cmds, replies, latency)
+
+    def record_batch(self, cmds, replies, latency):
+        for cmd, res in zip(cmds, replies):
+            family = self.get_family(cmd)
+            if family not in self.families:
+                self.families[family] = dict(count=0, bytes_sent=0, bytes_recv=0, latency=deque(maxlen=self.window))
+            record = self.families[family]
+            record['count'] += 1
+            record['bytes_sent'] += len(cmd) + 8  # the payload and the header (magic, size)
+            if isinstance(res, int) and not isinstance(res, bool):
+                record['bytes_recv'] += res + 8
+            elif res is not None and not isinstance(res, bool):
+                record['bytes_recv'] += len(res) + 8
+            if latency is not None:
+                record['latency'].append(latency)
+
+    def snapshot(self):
+        """
+        Get the statistics of each command family.
+
+        Returns:
+            dict: family -> {count, bytes_sent, bytes_recv, p50, p95, p99}, the latencies are in milliseconds.
+        """
+        stats = dict()
+        with self.lock:
+            families = {family: dict(record, latency=list(record['latency'])) for family, record in self.families.items()}
+        for family, record in families.items():
+            stats[family] = dict(count=record['count'], bytes_sent=record['bytes_sent'], bytes_recv=record['bytes_recv'])
+            if len(record['latency']) > 0:
+                p50, p95, p99 = [float(p) for p in np.percentile(np.array(record['latency']) * 1000, [50, 95, 99])]
+            else:
+                p50, p95, p99 = None, None, None
+            stats[family].update(p50=p50, p95=p95, p99=p99)
+        return stats
+
+    def __repr__(self):
+        lines = [f'{"family":<40}{"count":>8}{"sent(KB)":>10}{"recv(KB)":>10}{"p50(ms)":>9}{"p95(ms)":>9}{"p99(ms)":>9}']
+        for family, s in sorted(self.snapshot().items(), key=lambda x: -x[1]['count']):
+            p = ['{:>9.2f}'.format(s[k]) if s[k] is not None else '{:>9}'.format('-') for k in ['p50', 'p95', 'p99']]
+            lines.append(f'{family:<40}{s["count"]:>8}{s["bytes_sent"]/1024:>10.1f}{s["bytes_recv"]/1024:>10.1f}' + ''.join(p))
+        return '\n'.join(lines)
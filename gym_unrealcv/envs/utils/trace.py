@@ -0,0 +1,216 @@
+"""
+Record the UnrealCV traffic of a session to a trace file, and replay it on localhost without the UE binary.
+
+Record: set env.unwrapped.record_trace = 'session.trace.gz' before the first reset.
+Replay: set env.unwrapped.replay_trace = 'session.trace.gz' before the first reset, or serve it for other clients by
+    python -m gym_unrealcv.envs.utils.trace session.trace.gz --port 9000
+"""
+import argparse
+import gzip
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import deque
+import unrealcv
+from gym_unrealcv.envs.utils.stats import CmdStats
+
+TRACE_HEADER = b'UCVTRACE1\n'
+RECORD_FMT = '<cdI'  # direction (b'S': sent, b'R': received, b's'/b'r' on the image connection), time (seconds from the start), payload size
+MAGIC = 0x9E2B83C1
+
+
+class TraceWriter:
+    """
+    Write the raw messages of a session to a trace file, a '.gz' path is compressed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, 'wb', compresslevel=1) if path.endswith('.gz') else open(path, 'wb')
+        self.file.write(TRACE_HEADER)
+        self.lock = threading.Lock()  # the messages are sent and received in different threads
+        self.start = time.perf_counter()
+
+    def write(self, direction, payload):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(struct.pack(RECORD_FMT, direction, time.perf_counter() - self.start, len(payload)))
+            self.file.write(payload)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def read_trace(path):
+    """
+    Read a trace file.
+
+    Args:
+        path (str): The path of the trace file.
+
+    Returns:
+        list: The records (direction, time, payload) in the order of recording.
+    """
+    records = []
+    record_size = struct.calcsize(RECORD_FMT)
+    with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as f:
+        assert f.read(len(TRACE_HEADER)) == TRACE_HEADER, f'{path} is not a trace file'
+        while True:
+            head = f.read(record_size)
+            if len(head) < record_size:
+                break
+            direction, t, size = struct.unpack(RECORD_FMT, head)
+            records.append((direction, t, f.read(size)))
+    return records
+
+
+class RecordingClient(unrealcv.Client):
+    """
+    The unrealcv.Client that logs every raw request and reply to a TraceWriter.
+    The image connection (see Character_API.open_img_client) is logged in lower case, its message ids are its own.
+    """
+    def __init__(self, endpoint, writer, type='inet', image=False):
+        super(RecordingClient, self).__init__(endpoint, type)
+        self.writer = writer
+        self.directions = (b's', b'r') if image else (b'S', b'R')
+
+    def send(self, message):
+        self.writer.write(self.directions[0], message)
+        return super(RecordingClient, self).send(message)
+
+    def receive(self):
+        message = super(RecordingClient, self).receive()
+        if message is not None:
+            self.writer.write(self.directions[1], message)
+        return message
+
+
+class TraceReplay:
+    """
+    Look up the recorded reply of a command. The replies of the same command are served in the recorded order,
+    and the last one is repeated when they run out. An unseen command gets the last reply of its command family.
+    """
+    def __init__(self, records):
+        self.replies = dict()  # command -> deque of (reply, latency)
+        self.last = dict()  # command or family -> (reply, latency)
+        self.lock = threading.Lock()
+        sent = dict()  # (connection, message id) -> (command, time)
+        for direction, t, payload in records:
+            message_id, body = payload.split(b':', 1)
+            key = (direction.isupper(), message_id)  # the image connection is in lower case
+            if direction in (b'S', b's'):
+                sent[key] = (body.decode('utf-8', 'replace'), t)
+            elif key in sent:
+                cmd, t_sent = sent.pop(key)
+                self.replies.setdefault(cmd, deque()).append((body, t - t_sent))
+
+    def get_reply(self, cmd):
+        with self.lock:
+            if len(self.replies.get(cmd, [])) > 0:
+                reply = self.replies[cmd].popleft()
+            elif cmd in self.last:
+                reply = self.last[cmd]
+            else:
+                family = CmdStats.get_family(cmd)
+                reply = self.last.get(family)
+                if reply is None:
+                    reply = self.first_of_family(family)
+            self.last[cmd] = reply
+            self.last[CmdStats.get_family(cmd)] = reply
+            return reply
+
+    def first_of_family(self, family):
+        for cmd, replies in self.replies.items():
+            if CmdStats.get_family(cmd) == family and len(replies) > 0:
+                return replies[0]
+        return b'ok', 0.0
+
+
+def recv_frame(sock):
+    head = b''
+    while len(head) < 8:
+        chunk = sock.recv(8 - len(head))
+        if not chunk:
+            return None
+        head += chunk
+    magic, size = struct.unpack('II', head)
+    assert magic == MAGIC, 'Receive a malformed message'
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_frame(sock, payload):
+    sock.sendall(struct.pack('II', MAGIC, len(payload)) + payload)
+
+
+class ReplayHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        send_frame(sock, b'connected to the replay server')
+        while True:
+            payload = recv_frame(sock)
+            if payload is None:
+                return
+            message_id, cmd = payload.split(b':', 1)
+            reply, latency = self.server.replay.get_reply(cmd.decode('utf-8', 'replace'))
+            if self.server.realtime:
+                time.sleep(latency)
+            send_frame(sock, message_id + b':' + reply)
+
+
+class ReplayServer(socketserver.ThreadingTCPServer):
+    """
+    Serve the replies of a trace file on localhost, it works as a UnrealCV server for Character_API.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, path, port=0, realtime=False):
+        """
+        Args:
+            path (str): The path of the trace file.
+            port (int): The port to listen, 0 to pick a free port.
+            realtime (bool): Delay each reply by its recorded latency, False to reply at once.
+        """
+        self.replay = TraceReplay(read_trace(path))
+        self.realtime = realtime
+        self.thread = None
+        super(ReplayServer, self).__init__(('127.0.0.1', port), ReplayHandler)
+
+    def start(self):
+        """
+        Serve in a background thread.
+
+        Returns:
+            tuple: The IP and port of the server.
+        """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self.server_address
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a recorded UnrealCV session on localhost')
+    parser.add_argument('trace', help='the trace file')
+    parser.add_argument('--port', type=int, default=9000, help='the port to listen')
+    parser.add_argument('--realtime', action='store_true', help='delay the replies by the recorded latency')
+    args = parser.parse_args()
+    server = ReplayServer(args.trace, args.port, args.realtime)
+    print(f'Replay {args.trace} on 127.0.0.1:{args.port}')
+    server.serve_forever()
@@ -36,15 +36,19 @@ class NavAgents(Wrapper):
                 new_action.append(self.agents[idx].act(env.obj_poses[idx]))
         obs, reward, done, info = self.env.step(new_action)
         if self.mask_agent:
-            obs = np.array([obs[i] for i, nav in enumerate(self.nav_list) if nav < 0])
+            obs = self.select_obs(obs)
             reward = np.array([reward[i] for i, nav in enumerate(self.nav_list) if nav < 0])
 
         return obs, reward, done, info
 
     def reset(self, **kwargs):
-        states = self.env.reset(**kwargs)
         env = self.env.unwrapped
+        if self.mask_agent:  # before the reset, so the first observation is not captured for the scripted agents
+            self.set_obs_specs(env, self.config_nav_mode(env))
+        states = self.env.reset(**kwargs)
         self.nav_list = self.config_nav_mode(env)
+        if self.mask_agent:  # the population or the tracker may be changed in the reset
+            self.set_obs_specs(env, self.nav_list)
         # init agents
         self.agents = []
         for idx, mode in enumerate(self.nav_list):
@@ -57,11 +61,26 @@ class NavAgents(Wrapper):
             elif mode == 2:  # use external goal navigation
                 self.agents.append(Nav2GoalAgent(env.action_space[idx], env.reset_area, max_len=200))
         if self.mask_agent:
-            states = np.array([states[id] for id, value in enumerate(self.nav_list) if value < 0])
+            states = self.select_obs(states)
             self.action_space = [self.env.action_space[i] for i, nav in enumerate(self.nav_list) if nav < 0]
             self.observation_space = [self.env.observation_space[i] for i, nav in enumerate(self.nav_list) if nav < 0]
         return states
 
+    def set_obs_specs(self, env, nav_list):
+        # the observations of the scripted agents are dropped, so their images are not captured
+        env.set_obs_spec(env.player_list, None)
+        env.set_obs_spec([obj for obj, nav in zip(env.player_list, nav_list) if nav >= 0], 'None')
+
+    def select_obs(self, obs):
+        # the observations of the agents controlled by the user, the compact observation is a dict of the modalities
+        if isinstance(obs, dict):
+            return {modality: self.select_obs(array) for modality, array in obs.items()}
+        rows = [i for i, nav in enumerate(self.nav_list) if nav < 0]
+        obs_index = self.env.unwrapped.obs_index  # the player index of each row, the agents with 'None' are left out
+        if obs_index is not None:
+            rows = [obs_index.index(i) for i in rows]
+        return np.array([obs[row] for row in rows])
+
     def config_nav_mode(self, env):
         # set nav list
         nav_list = []
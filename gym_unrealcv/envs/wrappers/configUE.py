@@ -3,7 +3,8 @@ from gym import Wrapper
 
 class ConfigUEWrapper(Wrapper):
     def __init__(self, env, docker=False, resolution=(160, 160), display=None, offscreen=False,
-                            use_opengl=False, nullrhi=False, gpu_id=None, sleep_time=5, comm_mode='tcp'):
+                            use_opengl=False, nullrhi=False, gpu_id=None, sleep_time=5, comm_mode='tcp', decode_workers=0, img_conn=False,
+                            capture_dir=None, adaptive_encoding=False):
         super().__init__(env)
         env.unwrapped.docker = docker
         env.unwrapped.display = display
@@ -14,6 +15,10 @@ class ConfigUEWrapper(Wrapper):
         env.unwrapped.sleep_time = sleep_time
         env.unwrapped.resolution = resolution
         env.unwrapped.comm_mode = comm_mode
+        env.unwrapped.decode_workers = decode_workers
+        env.unwrapped.img_conn = img_conn
+        env.unwrapped.capture_dir = capture_dir
+        env.unwrapped.adaptive_encoding = adaptive_encoding
 
     def step(self, action):
         obs, reward, done, info = self.env.step(action)
@@ -0,0 +1,58 @@
+import gym
+import pytest
+import gym_unrealcv
+from gym_unrealcv.envs.agent.character import Character_API
+from gym_unrealcv.envs.utils import misc
+from gym_unrealcv.envs.utils.mock_server import MockServer
+from gym_unrealcv.envs.wrappers import augmentation, configUE
+
+TRACK_ENV = 'UnrealTrack-track_train-ContinuousColor-v0'
+
+
+@pytest.fixture
+def mock_server():
+    server = MockServer(objects=['player_0', 'player_1'], num_cameras=3)
+    server.start()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def unrealcv(mock_server):
+    ip, port = mock_server.server_address
+    api = Character_API(port=port, ip=ip, resolution=(160, 120))
+    yield api
+    api.client.disconnect()
+
+
+@pytest.fixture
+def env_file(tmp_path, monkeypatch):
+    """
+    The setting file of the track env, its UE binary is an empty placeholder (the env runs on the mock server).
+    """
+    monkeypatch.setenv('UnrealEnv', str(tmp_path))
+    env_file = gym.spec(TRACK_ENV)._kwargs['env_file']
+    binary = tmp_path / misc.load_env_setting(env_file)['env_bin']
+    binary.parent.mkdir(parents=True, exist_ok=True)
+    binary.touch()
+    return env_file
+
+
+@pytest.fixture
+def make_env(env_file):
+    """
+    Make the track env (or another observation type of it, e.g. 'UnrealTrack-track_train-ContinuousRgbd-v0') on the mock server.
+    """
+    envs = []
+
+    def make(population=2, env_id=TRACK_ENV, **attributes):
+        env = configUE.ConfigUEWrapper(gym.make(env_id), resolution=(160, 120))
+        env.unwrapped.mock_server = True
+        for key, value in attributes.items():
+            setattr(env.unwrapped, key, value)
+        env = augmentation.RandomPopulationWrapper(env, population, population)
+        envs.append(env)
+        return env
+    yield make
+    for env in envs:
+        env.close()
@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from gym_unrealcv.envs import AsyncUnrealCv_base
+
+
+def test_async_env_on_the_mock_server(env_file):
+    env = AsyncUnrealCv_base(setting_file=env_file, action_type='Continuous', observation_type='Color', resolution=(160, 120))
+    env.mock_server = True
+
+    async def run():
+        try:
+            obs = await env.reset()
+            actions = [space.sample() for space in env.action_space]
+            env.step_async(actions)
+            step_obs, rewards, done, info = await env.step_done()
+            assert step_obs.shape == obs.shape
+            env.frame_skip = 2
+            step_obs, rewards, done, info = await env.step(actions)
+            assert step_obs.shape == obs.shape
+            assert info['Steps'] == 2
+        finally:
+            env.close()  # the asyncio client is closed on the loop
+    asyncio.run(run())
+    assert env.local_server is None  # the mock server is closed with the env
+
+
+def test_the_task_envs_are_not_mixed_in(env_file):
+    from gym_unrealcv.envs.track import Track
+
+    class AsyncTrack(AsyncUnrealCv_base, Track):
+        pass
+    with pytest.raises(NotImplementedError):
+        AsyncTrack(env_file, action_type='Continuous', observation_type='Color', resolution=(160, 120))
+
+
+def test_async_scene_queries_are_cached(env_file):
+    env = AsyncUnrealCv_base(setting_file=env_file, action_type='Continuous', observation_type='Color', resolution=(160, 120))
+    env.mock_server = True
+
+    async def run():
+        try:
+            await env.reset()
+            unrealcv = env.unwrapped.unrealcv
+            objects = await unrealcv.get_objects()
+            num_cameras = await unrealcv.get_camera_num()
+            colors = await unrealcv.build_color_dict(objects)
+            unrealcv.stats.reset()
+            hits = unrealcv.cache_info()['hits']
+            assert await unrealcv.get_objects() == objects
+            assert await unrealcv.get_camera_num() == num_cameras
+            assert await unrealcv.build_color_dict(objects) == colors
+            assert unrealcv.cache_info()['hits'] == hits + 2 + len(objects)
+            assert unrealcv.stats.snapshot() == {}  # answered from the cache
+        finally:
+            env.close()
+    asyncio.run(run())
@@ -0,0 +1,36 @@
+import pytest
+import unrealcv as unrealcv_client
+from gym_unrealcv.envs.agent.character import UnrealCvTimeoutError
+
+CMDS = ['vget /object/player_0/location', 'vset /object/player_1/location 1 2 3', 'vget /object/player_1/location']
+
+
+def parse(res):
+    return [float(v) for v in res.split()]
+
+
+def test_stream_decodes_in_order(unrealcv):
+    unrealcv.send_cmd('vset /object/player_0/location 10 20 30', async_mode=True)
+    unrealcv.defer_cmds = True
+    unrealcv.send_cmd('vset /object/player_0/location 4 5 6', async_mode=True)  # sent ahead of the batch
+    assert unrealcv.can_stream(CMDS)
+    res = unrealcv.batch_cmd_stream(CMDS, [parse, None, parse])
+    assert res == [[4.0, 5.0, 6.0], None, [1.0, 2.0, 3.0]]
+    assert unrealcv.deferred_cmds == []
+    assert unrealcv.send_cmd('vget /object/player_0/location') == '4.000 5.000 6.000'  # the replies stay in sync
+
+
+def test_stream_timeout(unrealcv, mock_server):
+    mock_server.latency = 0.5
+    with pytest.raises(UnrealCvTimeoutError):
+        unrealcv.batch_cmd_stream(CMDS, [parse, None, parse], timeout=0.2)
+    mock_server.latency = 0.0
+    assert unrealcv.send_cmd('vget /object/player_0/location') == '0.000 0.000 100.000'  # the late replies are dropped
+
+
+def test_stream_falls_back_to_batch_cmd(unrealcv, monkeypatch):
+    monkeypatch.setattr(unrealcv_client, '__version__', '2.0.0')
+    assert unrealcv.get_stream_client() is None
+    assert not unrealcv.can_stream(CMDS)
+    res = unrealcv.batch_cmd_stream(CMDS, [parse, None, parse])
+    assert res == [[0.0, 0.0, 100.0], None, [1.0, 2.0, 3.0]]
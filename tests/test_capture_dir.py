@@ -0,0 +1,32 @@
+import numpy as np
+
+
+def test_mmap_frames_match_the_socket_frames(unrealcv, tmp_path):
+    lit = unrealcv.read_image(0, 'lit', 'fast')
+    unrealcv.set_capture_dir(tmp_path)
+    unrealcv.stats.reset()
+    mapped = unrealcv.read_image(0, 'lit', 'mmap')
+    assert mapped.shape == lit.shape
+    assert np.array_equal(mapped, lit)
+    assert (tmp_path / f'lit_{unrealcv.port}_0.bmp').exists()
+    stats = unrealcv.stats.snapshot()['vget /camera/N/lit <file>']
+    assert stats['bytes_recv'] < 1024  # only the path is sent back, not the pixels
+
+
+def test_batch_captures_into_the_directory(unrealcv, tmp_path):
+    unrealcv.set_capture_dir(tmp_path)
+    unrealcv.stats.reset()
+    obj_poses, cam_poses, imgs, masks, depths = unrealcv.get_pose_img_batch(['player_0', 'player_1'], [0, 1], [False, True, False, True])
+    assert [img.shape for img in imgs] == [(120, 160, 3)] * 2
+    assert [depth.shape for depth in depths] == [(120, 160, 1)] * 2
+    recv = sum(s['bytes_recv'] for family, s in unrealcv.stats.snapshot().items() if family.endswith('<file>'))
+    assert recv < 1024
+    unrealcv.set_capture_dir(None)
+    assert unrealcv.get_img_cmd(0, 'lit') == 'vget /camera/0/lit bmp'
+
+
+def test_env_capture_dir(make_env, tmp_path):
+    env = make_env(capture_dir=str(tmp_path))
+    obs = env.reset()
+    assert obs.shape == (2, 120, 160, 3)
+    assert any(path.name.startswith('lit_') for path in tmp_path.iterdir())
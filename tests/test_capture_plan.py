@@ -0,0 +1,31 @@
+def test_plan_is_reused_until_the_key_changes(unrealcv, tmp_path):
+    objs, flags = ['player_0', 'player_1'], [False, True, False, True]
+    unrealcv.get_pose_img_batch(objs, [0, 1], flags)
+    plan = unrealcv.capture_plan
+    unrealcv.set_obj_location('player_1', [300, 0, 100])
+    obj_poses = unrealcv.get_pose_img_batch(objs, [0, 1], list(flags))[0]
+    assert unrealcv.capture_plan is plan
+    assert obj_poses[1][:3].tolist() == [300, 0, 100]  # the reused plan still queries the poses
+    for args in [(objs, [0, 1], [False, True, True, True]), (objs, [0], flags), (objs[:1], [0, 1], flags)]:
+        unrealcv.get_pose_img_batch(*args)
+        assert unrealcv.capture_plan is not plan
+        plan = unrealcv.capture_plan
+    unrealcv.set_capture_dir(tmp_path)
+    unrealcv.get_pose_img_batch(objs[:1], [0, 1], flags)
+    assert unrealcv.capture_plan is not plan
+    assert str(tmp_path) in unrealcv.capture_plan.cmds[-1]
+
+
+def test_env_rebuilds_the_plan_for_a_new_population(make_env):
+    env = make_env()
+    env.reset()
+    unwrapped = env.unwrapped
+    unwrapped.step([space.sample() for space in env.action_space])
+    plan = unwrapped.unrealcv.capture_plan
+    unwrapped.step([space.sample() for space in env.action_space])
+    assert unwrapped.unrealcv.capture_plan is plan
+    unwrapped.set_population(3)
+    obs, rewards, done, info = unwrapped.step([space.sample() for space in unwrapped.action_space])
+    assert unwrapped.unrealcv.capture_plan is not plan
+    assert len(unwrapped.unrealcv.capture_plan.key[0]) == 3
+    assert len(obs) == 3
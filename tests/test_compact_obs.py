@@ -0,0 +1,31 @@
+import numpy as np
+from gym_unrealcv.envs.utils import misc
+
+
+def test_cast_img_saturates_the_integer_depth():
+    depth = np.array([[100.4], [70000.0]], dtype=np.float32)
+    assert misc.cast_img(depth, np.dtype(np.uint16)).tolist() == [[100], [65535]]
+    assert misc.cast_img(depth, np.dtype(np.float16)) is depth
+
+
+def test_compact_rgbd_is_a_dict_of_modalities(make_env):
+    env = make_env(env_id='UnrealTrack-track_train-ContinuousRgbd-v0')
+    env.unwrapped.config_compact_obs('uint16')
+    obs = env.reset()
+    obs, rewards, done, info = env.step([space.sample() for space in env.action_space])
+    assert obs['Color'].dtype == np.uint8 and obs['Color'].shape == (2, 120, 160, 3)
+    assert obs['Depth'].dtype == np.uint16 and obs['Depth'].shape == (2, 120, 160, 1)
+    assert obs['Depth'][0, 0, 0, 0] == 100 and obs['Depth'][0, -1, 0, 0] == 5000  # the synthetic depth, rounded
+    for i, space in enumerate(env.unwrapped.observation_space):
+        assert space.contains({modality: array[i] for modality, array in obs.items()})
+
+
+def test_compact_depth_dtype(make_env):
+    env = make_env(env_id='UnrealTrack-track_train-ContinuousDepth-v0')
+    env.unwrapped.config_compact_obs('float16')
+    obs = env.reset()
+    assert obs.dtype == np.float16 and obs.shape == (2, 120, 160, 1)
+    assert env.unwrapped.observation_space[0].dtype == np.float16
+    env.unwrapped.config_compact_obs(None)
+    obs, rewards, done, info = env.step([space.sample() for space in env.action_space])
+    assert obs.dtype == np.float32
@@ -0,0 +1,20 @@
+def test_direct_calls_keep_the_order_of_the_deferred_cmds(unrealcv):
+    unrealcv.defer_cmds = True
+    unrealcv.set_obj_location('player_1', [500, 0, 100])
+    assert unrealcv.get_obj_bounds('player_1')[:3] == [460, -40, 10]  # after the deferred location
+    unrealcv.set_obj_location('player_1', [600, 0, 100])
+    unrealcv.destroy_obj('player_1')  # deferred behind the location, which would re-create it in the mock scene
+    unrealcv.flush_cmds()
+    assert unrealcv.get_objects() == ['player_0']
+
+
+def test_direct_calls_are_counted(unrealcv):
+    unrealcv.stats.reset()
+    unrealcv.set_hide_obj('player_0')
+    unrealcv.get_image(0, 'lit', 'bmp')
+    unrealcv.destroy_obj('player_1')
+    stats = unrealcv.stats.snapshot()
+    assert stats['vset /object/<obj>/hide']['count'] == 1
+    assert stats['vget /camera/N/lit bmp']['count'] == 1
+    assert stats['vset /object/<obj>/destroy']['count'] == 1
+    assert unrealcv.inflight == 1  # the destroy, the hide is acknowledged by the image reply
@@ -0,0 +1,45 @@
+from gym_unrealcv.envs.utils.encoding import EncodingSelector
+
+
+def measure(selector, sizes, decode):
+    for fmt in ['bmp', 'png', 'jpg']:
+        if fmt in selector.get_candidates('lit'):
+            assert selector.select(0, 'lit') == fmt  # each format is measured once
+            selector.record(0, 'lit', fmt, sizes[fmt], decode[fmt])
+
+
+def test_selector_follows_the_link_throughput():
+    sizes = dict(bmp=300000, png=100000)
+    decode = dict(bmp=0.0001, png=0.002)
+    fast, slow = EncodingSelector(), EncodingSelector()
+    measure(fast, sizes, decode)
+    measure(slow, sizes, decode)
+    fast.record_link(1000000, 0.001)  # 1 GB/s
+    slow.record_link(1000000, 0.1)  # 10 MB/s
+    assert fast.select(0, 'lit') == 'bmp'
+    assert slow.select(0, 'lit') == 'png'
+
+
+def test_lossy_only_for_lit():
+    selector = EncodingSelector(lossy=True)
+    assert selector.get_candidates('lit') == ['bmp', 'png', 'jpg']
+    assert selector.get_candidates('object_mask') == ['bmp', 'png']
+    selector.set_unsupported('jpg')
+    assert selector.get_candidates('lit') == ['bmp', 'png']
+
+
+def test_probe_the_oldest_estimate():
+    selector = EncodingSelector(probe_interval=4)
+    measure(selector, dict(bmp=300000, png=100000), dict(bmp=0.0001, png=0.002))
+    selector.record_link(1000000, 0.001)
+    selector.record(0, 'lit', 'bmp', 300000, 0.0001)  # png is now the oldest estimate
+    picks = [selector.select(0, 'lit') for _ in range(2)]
+    assert picks == ['bmp', 'png']  # the 4th capture probes png
+
+
+def test_api_switches_to_png_on_a_slow_link(mock_server, unrealcv):
+    mock_server.bandwidth = 5e6
+    unrealcv.set_adaptive_encoding()
+    for _ in range(5):
+        unrealcv.get_pose_img_batch(['player_0'], [0], [False, True, False, False])
+    assert unrealcv.get_img_cmd(0, 'lit') == 'vget /camera/0/lit png'
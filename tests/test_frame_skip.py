@@ -0,0 +1,39 @@
+import pytest
+from gym_unrealcv.envs.utils.trace import read_trace
+
+
+def count(stats, key):
+    return sum(record['count'] for family, record in stats.items() if key in family)
+
+
+def run_steps(env, steps):
+    env.reset()
+    unrealcv = env.unwrapped.unrealcv
+    unrealcv.stats.reset()
+    for _ in range(steps):
+        obs, rewards, done, info = env.step([env.action_space[i].sample() for i in range(len(env.action_space))])
+    return unrealcv.stats.snapshot(), info
+
+
+@pytest.mark.parametrize('frame_skip', [1, 4])
+def test_captures_once_per_step(make_env, frame_skip):
+    env = make_env(frame_skip=frame_skip)
+    stats, info = run_steps(env, 3)
+    assert count(stats, '/lit') == 3 * 2  # the camera of each agent
+    assert count(stats, '/object_mask') == 3  # the visibility of the target
+    assert count(stats, 'set_move') == 3 * 2 * frame_skip  # the actions are held in each tick
+    assert info['Steps'] == 3
+    assert env.unwrapped.count_lost <= 3  # counted in the captured ticks only
+
+
+def test_ticks_are_paced_by_tick_time(make_env, tmp_path):
+    path = str(tmp_path / 'ticks.trace')
+    env = make_env(frame_skip=4, tick_time=0.05, record_trace=path)
+    env.reset()
+    env.step([env.action_space[i].sample() for i in range(len(env.action_space))])
+    env.close()
+    sent = [(t, payload.decode('utf-8', 'replace')) for direction, t, payload in read_trace(path) if direction == b'S']
+    moves = [t for t, cmd in sent if 'set_move' in cmd][-4 * 2:]  # the moves of the 4 ticks of the step, 2 agents
+    capture = [t for t, cmd in sent if '/lit' in cmd][-1]
+    assert moves[-1] <= capture  # the last tick is captured
+    assert capture - moves[0] >= 3 * 0.05  # the actions are held (frame_skip - 1) * tick_time before the capture
@@ -0,0 +1,16 @@
+def test_window_waits_on_a_barrier(unrealcv):
+    unrealcv.max_inflight = 4
+    barrier = unrealcv.stats.snapshot().get(unrealcv.barrier_cmd, dict(count=0))['count']
+    for i in range(10):
+        unrealcv.send_cmd(f'vset /object/player_0/location {i} 0 100', async_mode=True)
+        assert unrealcv.inflight <= 4
+    assert unrealcv.stats.snapshot()[unrealcv.barrier_cmd]['count'] - barrier == 2
+    assert unrealcv.send_cmd('vget /object/player_0/location') == '9.000 0.000 100.000'
+    assert unrealcv.inflight == 0
+
+
+def test_burst_is_sent_in_chunks(unrealcv):
+    unrealcv.max_inflight = 4
+    unrealcv.send_cmd([f'vset /object/player_1/location {i} 0 100' for i in range(10)], async_mode=True)
+    assert unrealcv.inflight == 2
+    assert unrealcv.send_cmd('vget /object/player_1/location') == '9.000 0.000 100.000'
@@ -0,0 +1,33 @@
+import time
+import numpy as np
+
+
+def test_scene_replies(unrealcv):
+    assert unrealcv.get_objects() == ['player_0', 'player_1']
+    assert unrealcv.get_obj_location('player_1') == [100, 0, 100]
+    unrealcv.set_obj_location('player_1', [250, -30, 100])
+    assert unrealcv.get_obj_location('player_1') == [250, -30, 100]
+    assert unrealcv.get_obj_size('player_1') == [80, 80, 180]
+
+
+def test_frames_at_the_resolution(unrealcv):
+    lit = unrealcv.get_image(0, 'lit', 'bmp')
+    depth = unrealcv.get_depth(0)
+    assert lit.shape == (120, 160, 3)
+    assert depth.shape[:2] == (120, 160)
+    assert np.all(lit[..., 2] == 128)  # the red channel of the synthetic frame
+
+
+def test_latency_is_emulated(mock_server, unrealcv):
+    mock_server.latency = 0.05
+    t0 = time.time()
+    unrealcv.get_obj_location('player_0')
+    assert time.time() - t0 >= 0.05
+
+
+def test_env_runs_on_the_mock_server(make_env):
+    env = make_env()
+    obs = env.reset()
+    obs, rewards, done, info = env.step([space.sample() for space in env.action_space])
+    assert obs.shape == (2, 120, 160, 3)
+    assert len(rewards) == 2
@@ -0,0 +1,65 @@
+import gym
+import numpy as np
+from gym_unrealcv.envs.wrappers import agents
+
+
+def count(stats, key):
+    return sum(record['count'] for family, record in stats.items() if key in family)
+
+
+def sample(env):
+    return [space.sample() for space in env.action_space]
+
+
+def test_none_agents_are_left_out(make_env):
+    env = make_env(population=3)
+    env.reset()
+    unwrapped = env.unwrapped
+    unwrapped.set_obs_spec(unwrapped.player_list[1:], 'None')
+    unwrapped.unrealcv.stats.reset()
+    obs, rewards, done, info = env.step(sample(env))
+    assert obs.shape == (1, 120, 160, 3)
+    assert unwrapped.obs_index == [0]
+    assert count(unwrapped.unrealcv.stats.snapshot(), '/lit') == 1
+
+
+def test_agent_buffers_are_reused(make_env):
+    env = make_env(population=3)
+    env.unwrapped.config_obs_buffer(reuse=True)
+    env.reset()
+    unwrapped = env.unwrapped
+    unwrapped.set_obs_spec(unwrapped.player_list[1:2], 'Depth')
+    unwrapped.set_obs_spec(unwrapped.player_list[2:], 'None')
+    steps = [env.step(sample(env))[0] for _ in range(3)]
+    assert [obs.shape for obs in steps[0]] == [(120, 160, 3), (120, 160, 1)]
+    assert len(unwrapped.agent_obs_buffers) == 2
+    for row in range(2):  # double buffered
+        assert np.shares_memory(steps[0][row], steps[2][row])
+        assert not np.shares_memory(steps[0][row], steps[1][row])
+    assert steps[2][1].max() > 0
+
+
+class SpecSpy(gym.Wrapper):
+    # record the observation specs that the reset is captured with
+    def __init__(self, env):
+        super().__init__(env)
+        self.specs = []
+
+    def reset(self, **kwargs):
+        self.specs.append(dict(self.env.unwrapped.obs_specs))
+        return self.env.reset(**kwargs)
+
+
+def test_nav_agents_set_the_specs_before_reset(make_env):
+    spy = SpecSpy(make_env(population=2))
+    env = agents.NavAgents(spy, mask_agent=True)
+    unwrapped = env.unwrapped
+    assert len(spy.specs[0]) > 0
+    assert unwrapped.obs_specs == {unwrapped.player_list[1]: 'None'}
+    unwrapped.unrealcv.stats.reset()
+    obs = env.reset()
+    assert spy.specs[1] == {unwrapped.player_list[1]: 'None'}
+    assert obs.shape == (1, 120, 160, 3)
+    obs, rewards, done, info = env.step([env.action_space[0].sample()])
+    assert obs.shape == (1, 120, 160, 3)
+    assert count(unwrapped.unrealcv.stats.snapshot(), '/lit') == 3  # the tracker in the two captures of reset and in the step
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+
+def sample(env):
+    return [env.action_space[i].sample() for i in range(len(env.action_space))]
+
+
+def test_next_tick_is_in_flight_while_scoring(make_env):
+    env = make_env()
+    env.reset()
+    unwrapped = env.unwrapped
+    unwrapped.pipeline_depth = 2
+    unwrapped.step_async(sample(env))
+    steps = []
+    for _ in range(3):
+        unwrapped.step_async(sample(env))
+        with pytest.raises(RuntimeError):
+            unwrapped.step_async(sample(env))  # the pipeline is full
+        obs, rewards, done, info = unwrapped.step_wait()
+        steps.append(info['Steps'])
+        future = unwrapped.pending_steps[0][0]
+        assert future.running() or future.done()  # the next tick is sent while the current one is scored
+        assert obs.shape[0] == 2 and 'metrics' in info
+    obs, rewards, done, info = unwrapped.step_wait()
+    assert steps + [info['Steps']] == [1, 2, 3, 4]
+    with pytest.raises(RuntimeError):
+        unwrapped.step_wait()
+
+
+def test_pipelined_observations_are_not_overwritten(make_env):
+    env = make_env(pipeline_depth=2)
+    env.unwrapped.config_obs_buffer(reuse=True)
+    env.reset()
+    unwrapped = env.unwrapped
+    unwrapped.step_async(sample(env))
+    observations = []
+    for _ in range(3):
+        unwrapped.step_async(sample(env))
+        observations.append(unwrapped.step_wait()[0])
+    # the returned observation is still valid while the next tick is decoded
+    assert not np.shares_memory(observations[0], observations[1])
+    assert not np.shares_memory(observations[1], observations[2])
+    assert not np.shares_memory(observations[2], unwrapped.pending_steps[0][1]['step_obs_slots'][0])  # the tick in flight
+
+
+def test_reset_drops_the_ticks_in_flight(make_env):
+    env = make_env(pipeline_depth=2)
+    env.reset()
+    env.unwrapped.step_async(sample(env))
+    env.unwrapped.step_async(sample(env))
+    env.reset()
+    assert len(env.unwrapped.pending_steps) == 0
+    env.step(sample(env))
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+
+def test_decode_poses(unrealcv):
+    poses = unrealcv.decode_poses(['100.000 0.000 100.000', '0.000 90.000 -10.000', '1 2 3', '4 5 6'])
+    assert poses.dtype == np.float32
+    assert poses.tolist() == [[100, 0, 100, 0, 90, -10], [1, 2, 3, 4, 5, 6]]
+    with pytest.raises(ValueError):
+        poses[0, 0] = 0  # shared without copies, so it is read-only
+
+
+def test_batch_poses_follow_the_scene(unrealcv):
+    unrealcv.set_obj_rotation('player_1', [10, 20, 30])
+    obj_poses = unrealcv.get_pose_img_batch(['player_0', 'player_1'], [0], [False, False, False, False])[0]
+    assert obj_poses.shape == (2, 6)
+    unrealcv.use_pose_snapshot = False
+    assert obj_poses.tolist() == [unrealcv.get_obj_pose('player_0'), unrealcv.get_obj_pose('player_1')]
+    assert obj_poses[1].tolist() == [100, 0, 100, 10, 20, 30]
+
+
+def test_env_shares_the_pose_array(make_env):
+    env = make_env()
+    env.reset()
+    obs, rewards, done, info = env.step([space.sample() for space in env.action_space])
+    poses = info['Pose']
+    assert poses is env.unwrapped.obj_poses
+    assert poses.dtype == np.float32 and poses.shape == (2, 6)
+    assert not poses.flags.writeable
+    obs, rewards, done, info = env.step([space.sample() for space in env.action_space])
+    assert info['Pose'] is not poses  # a new array each step, the previous one stays valid
@@ -0,0 +1,32 @@
+import numpy as np
+
+
+def step(env):
+    env.reset()
+    return env.step([env.action_space[i].sample() for i in range(len(env.action_space))])[3]
+
+
+def test_full_relative_pose_by_default(make_env):
+    info = step(make_env())
+    assert not np.isnan(info['Relative_Pose']).any()
+    assert not np.isnan(info['Pose_Obs']).any()
+    assert info['metrics']['dis_ave'] == info['Relative_Pose'][:, :, 0].mean()
+
+
+def test_tracker_row_only(make_env):
+    env = make_env(tracker_row_only=True)
+    info = step(env)
+    tracker_id = env.unwrapped.tracker_id
+    others = np.arange(len(info['Relative_Pose'])) != tracker_id
+    assert not np.isnan(info['Relative_Pose'][tracker_id]).any()
+    assert np.isnan(info['Relative_Pose'][others]).all()
+    assert info['metrics']['dis_ave'] == info['Relative_Pose'][tracker_id, :, 0].mean()
+
+
+def test_tracker_row_only_with_another_tracker(make_env):
+    env = make_env(tracker_row_only=True)
+    env.unwrapped.tracker_id, env.unwrapped.target_id = 1, 0
+    info = step(env)
+    assert np.isnan(info['Relative_Pose'][0]).all()
+    assert np.isfinite(info['Reward']).all()
+    assert info['metrics']['mislead'] == 0
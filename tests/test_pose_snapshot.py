@@ -0,0 +1,25 @@
+import pytest
+
+
+def test_snapshot_survives_the_blueprint_queries(unrealcv):
+    obj_poses = unrealcv.get_pose_img_batch(['player_0', 'player_1'], [0], [False, False, False, False])[0]
+    unrealcv.stats.reset()
+    assert unrealcv.get_obj_location('player_1') == obj_poses[1][:3].tolist()
+    assert unrealcv.get_hit('player_0') is False
+    assert unrealcv.get_obj_pose('player_1') == obj_poses[1].tolist()
+    stats = unrealcv.stats.snapshot()
+    assert list(stats) == ['vbp <obj> get_hit']  # the poses are not queried again
+    assert unrealcv.redundant_pose_queries == 2
+
+
+def test_snapshot_is_dropped_by_a_setter(unrealcv):
+    unrealcv.get_pose_img_batch(['player_0', 'player_1'], [0], [False, False, False, False])
+    unrealcv.set_obj_location('player_1', [500, 0, 100])
+    assert unrealcv.get_obj_location('player_1') == [500, 0, 100]
+
+
+def test_debug_flags_the_redundant_queries(unrealcv):
+    unrealcv.debug_pose_queries = True
+    unrealcv.get_pose_img_batch(['player_0', 'player_1'], [0], [False, False, False, False])
+    with pytest.warns(UserWarning, match='Redundant pose query of player_0'):
+        unrealcv.get_obj_rotation('player_0')
@@ -0,0 +1,25 @@
+def test_scene_queries_are_cached(unrealcv):
+    objects = unrealcv.get_objects()
+    unrealcv.stats.reset()
+    hits = unrealcv.cache_info()['hits']
+    assert unrealcv.get_objects() == objects
+    assert unrealcv.get_camera_num() == len(unrealcv.cam)
+    assert unrealcv.cache_info()['hits'] == hits + 2
+    assert 'vget /objects' not in unrealcv.stats.snapshot()
+
+
+def test_destroy_invalidates_the_object_queries(unrealcv):
+    unrealcv.get_obj_size('player_1')
+    assert 'player_1' in unrealcv.get_objects()
+    unrealcv.destroy_obj('player_1')
+    unrealcv.stats.reset()
+    assert 'player_1' not in unrealcv.get_objects()
+    unrealcv.get_obj_size('player_1')
+    stats = unrealcv.stats.snapshot()
+    assert stats['vget /objects']['count'] == 1
+    assert stats['vget /object/<obj>/bounds']['count'] == 1
+
+
+def test_returned_lists_are_copies(unrealcv):
+    unrealcv.get_objects().append('player_9')
+    assert 'player_9' not in unrealcv.get_objects()
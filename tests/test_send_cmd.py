@@ -0,0 +1,62 @@
+import threading
+import pytest
+from gym_unrealcv.envs.agent.character import UnrealCvTimeoutError
+
+
+def test_retry_after_a_late_reply(unrealcv, mock_server):
+    unrealcv.attempt_timeout = 0.2
+    unrealcv.retry_backoff = 0.01
+    mock_server.latency = 0.4  # only the first attempt is slow
+    threading.Timer(0.1, setattr, (mock_server, 'latency', 0.0)).start()
+    with pytest.warns(UserWarning, match='retry'):
+        res = unrealcv.send_cmd('vget /object/player_1/location')
+    assert res == '100.000 0.000 100.000'
+    assert unrealcv.stale_replies == 0
+    assert unrealcv.send_cmd('vget /object/player_0/location') == '0.000 0.000 100.000'
+
+
+def test_timeout_keeps_the_replies_in_sync(unrealcv, mock_server):
+    unrealcv.attempt_timeout = 0.1
+    unrealcv.retry_backoff = 0.01
+    mock_server.latency = 0.5
+    with pytest.warns(UserWarning, match='retry'):
+        with pytest.raises(UnrealCvTimeoutError) as error:
+            unrealcv.send_cmd('vget /object/player_1/location', timeout=0.3)
+    assert error.value.attempts > 1
+    assert unrealcv.stale_replies > 0
+    mock_server.latency = 0.0
+    unrealcv.attempt_timeout = 1
+    assert unrealcv.send_cmd('vget /object/player_0/location') == '0.000 0.000 100.000'
+    assert unrealcv.stale_replies == 0
+    assert unrealcv.send_cmd('vget /object/player_1/location') == '100.000 0.000 100.000'
+
+
+def test_batch_has_a_deadline(unrealcv, mock_server):
+    unrealcv.request_timeout = 0.2
+    mock_server.latency = 0.1
+    with pytest.raises(UnrealCvTimeoutError) as error:
+        unrealcv.batch_cmd(['vget /object/player_0/location', 'vget /object/player_1/location',
+                            'vget /object/player_0/rotation'], None)
+    assert error.value.missing > 0
+    assert unrealcv.stale_replies == error.value.missing
+    mock_server.latency = 0.0
+    assert unrealcv.batch_cmd(['vget /object/player_1/location'], None) == ['100.000 0.000 100.000']
+
+
+def test_image_batch_has_a_deadline(unrealcv, mock_server):
+    assert unrealcv.open_img_client()
+    unrealcv.request_timeout = 0.2
+    mock_server.img_latency = 0.5
+    with pytest.raises(UnrealCvTimeoutError):
+        unrealcv.get_pose_img_batch(['player_0'], [0, 1])
+    mock_server.img_latency = 0.0
+    obj_poses, cam_poses, imgs, masks, depths = unrealcv.get_pose_img_batch(['player_0'], [0, 1])
+    assert len(imgs) == 2 and imgs[0].shape == (120, 160, 3)
+    unrealcv.close_img_client()
+
+
+def test_list_is_recorded_per_command(unrealcv):
+    unrealcv.stats.reset()
+    res = unrealcv.send_cmd(['vget /object/player_0/location', 'vget /object/player_1/location'])
+    assert res == ['0.000 0.000 100.000', '100.000 0.000 100.000']
+    assert unrealcv.stats.snapshot()['vget /object/<obj>/location']['count'] == 2
@@ -0,0 +1,35 @@
+import pytest
+from gym_unrealcv.envs.utils.stats import CmdStats
+
+
+def test_families_group_the_objects_and_cameras():
+    assert CmdStats.get_family('vget /object/player_0/location') == 'vget /object/<obj>/location'
+    assert CmdStats.get_family('vget /camera/2/lit bmp') == 'vget /camera/N/lit bmp'
+    assert CmdStats.get_family('vget /camera/2/lit /tmp/lit_9000_2.bmp') == 'vget /camera/N/lit <file>'
+    assert CmdStats.get_family('vbp player_1 set_move 10 0') == 'vbp <obj> set_move'
+
+
+def test_record_counts_bytes_and_latency():
+    stats = CmdStats()
+    stats.record(['vget /object/a/location', 'vget /object/b/location'], ['1 2 3', b'4 5 6 7'], latency=0.002)
+    stats.record(['vset /object/a/location 0 0 0'])  # async, no reply and no latency
+    snapshot = stats.snapshot()
+    location = snapshot['vget /object/<obj>/location']
+    assert location['count'] == 2
+    assert location['bytes_sent'] == len('vget /object/a/location') * 2 + 16
+    assert location['bytes_recv'] == len('1 2 3') + len(b'4 5 6 7') + 16
+    assert location['p50'] == pytest.approx(2.0)
+    assert snapshot['vset /object/<obj>/location']['p50'] is None
+    stats.reset()
+    assert stats.snapshot() == {}
+
+
+def test_api_records_every_request(unrealcv):
+    unrealcv.stats.reset()
+    unrealcv.get_obj_location('player_0')
+    unrealcv.get_pose_img_batch(['player_0', 'player_1'], [0, 1], [False, True, False, False])
+    stats = unrealcv.stats.snapshot()
+    assert stats['vget /camera/N/lit bmp']['count'] == 2
+    assert stats['vget /camera/N/lit bmp']['bytes_recv'] > 2 * 160 * 120 * 4
+    assert stats['vget /object/<obj>/location']['count'] == 3
+    assert stats['vget /object/<obj>/location']['p99'] is not None
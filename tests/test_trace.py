@@ -0,0 +1,83 @@
+import random
+import numpy as np
+from gym_unrealcv.envs.agent.character import Character_API
+from gym_unrealcv.envs.utils.trace import ReplayServer, read_trace
+
+CMDS = ['vget /object/player_0/location', 'vget /object/player_1/location', 'vget /camera/1/lit bmp']
+
+
+def session(api):
+    replies = [api.send_cmd(cmd) for cmd in CMDS]
+    replies += api.batch_cmd_stream(CMDS, [None] * len(CMDS))
+    return replies
+
+
+def test_record_and_replay_a_session(mock_server, tmp_path):
+    path = str(tmp_path / 'session.trace.gz')
+    ip, port = mock_server.server_address
+    api = Character_API(port=port, ip=ip, resolution=(160, 120), record=path)
+    recorded = session(api)
+    api.close_trace()
+    api.client.disconnect()
+    sent = [payload.split(b':', 1)[1].decode() for direction, t, payload in read_trace(path) if direction == b'S']
+    assert sent[-len(CMDS):] == CMDS
+
+    server = ReplayServer(path)
+    ip, port = server.start()
+    try:
+        api = Character_API(port=port, ip=ip, resolution=(160, 120))
+        assert session(api) == recorded
+        api.client.disconnect()
+    finally:
+        server.close()
+
+
+def test_record_and_replay_the_image_connection(mock_server, tmp_path):
+    path = str(tmp_path / 'images.trace')
+    ip, port = mock_server.server_address
+    api = Character_API(port=port, ip=ip, resolution=(160, 120), record=path)
+    assert api.open_img_client()
+    recorded = api.get_pose_img_batch(['player_0', 'player_1'], [0, 1], [False, True, True, False])
+    api.close_img_client()
+    api.close_trace()
+    api.client.disconnect()
+    directions = set(direction for direction, t, payload in read_trace(path))
+    assert directions == {b'S', b'R', b's', b'r'}  # the image traffic is recorded on its own connection
+
+    server = ReplayServer(path)
+    ip, port = server.start()
+    try:
+        api = Character_API(port=port, ip=ip, resolution=(160, 120))
+        assert api.open_img_client()
+        replayed = api.get_pose_img_batch(['player_0', 'player_1'], [0, 1], [False, True, True, False])
+        np.testing.assert_array_equal(recorded[0], replayed[0])  # the poses
+        for modality in [2, 3]:  # the color images and the masks
+            for img, img_replayed in zip(recorded[modality], replayed[modality]):
+                np.testing.assert_array_equal(img, img_replayed)
+        api.close_img_client()
+        api.client.disconnect()
+    finally:
+        server.close()
+
+
+def run_episode(env, steps=3):
+    random.seed(0)
+    np.random.seed(0)
+    observations = [env.reset()]
+    infos = []
+    for i in range(steps):
+        obs, rewards, done, info = env.step([np.array([0, 50]) for _ in range(2)])
+        observations.append(obs)
+        infos.append(info)
+    env.close()
+    return observations, infos
+
+
+def test_replay_an_env_session(make_env, tmp_path):
+    path = str(tmp_path / 'env.trace')
+    obs_recorded, info_recorded = run_episode(make_env(record_trace=path))
+    obs_replayed, info_replayed = run_episode(make_env(mock_server=False, replay_trace=path))
+    for recorded, replayed in zip(obs_recorded, obs_replayed):
+        np.testing.assert_array_equal(np.asarray(recorded), np.asarray(replayed))
+    for recorded, replayed in zip(info_recorded, info_replayed):
+        np.testing.assert_allclose(recorded['Pose'], replayed['Pose'])